@@ -1,4 +1,6 @@
+import 'dart:convert';
 import 'dart:math' as math;
+import 'dart:typed_data';
 
 import 'package:flutter/services.dart';
 import 'package:image/image.dart' as img;
@@ -6,6 +8,8 @@ import 'package:image/image.dart' as img;
 class TFLiteModelHandler {
   static const String _modelFileName = 'japanese_character_model.tflite';
   static const String _labelsFileName = 'japanese_character_labels.txt';
+  // Metadata entry written by model_training/model_bundle.py
+  static const String _bundleMetadataName = 'mygana_bundle';
 
   // Model parameters
   static const int inputSize = 64; // Expected input size for the model
@@ -15,6 +19,7 @@ class TFLiteModelHandler {
   List<String>? _labels;
   bool _isInitialized = false;
   Uint8List? _modelData;
+  Map<String, dynamic>? _bundleSpec;
 
   // Singleton pattern
   static final TFLiteModelHandler _instance = TFLiteModelHandler._internal();
@@ -52,14 +57,27 @@ class TFLiteModelHandler {
       _modelData = modelData.buffer.asUint8List();
       _interpreter = 'loaded'; // Mark as loaded
       print('TFLite model data loaded successfully (${_modelData!.length} bytes)');
+
+      // Bundled models carry their labels and preprocessing spec
+      _bundleSpec = _readBundleSpec(_modelData!);
+      if (_bundleSpec != null) {
+        print('Model bundle version ${_bundleSpec!['model_version']}');
+      }
     } catch (e) {
       print('Failed to load TFLite model: $e');
       _interpreter = null;
       _modelData = null;
+      _bundleSpec = null;
     }
   }
 
   Future<void> _loadLabels() async {
+    if (_bundleSpec != null) {
+      _labels = List<String>.from(_bundleSpec!['labels']);
+      print('Loaded ${_labels!.length} labels from the model bundle');
+      return;
+    }
+
     try {
       // Load labels from assets
       final labelsData = await rootBundle.loadString('assets/models/$_labelsFileName');
@@ -148,7 +166,7 @@ class TFLiteModelHandler {
           (x) {
             final pixel = grayscaleImage.getPixel(x, y);
             final value = pixel.r; // Use red channel (all channels are the same in grayscale)
-            return value / 255.0; // Normalize to [0, 1]
+            return _normalize(value.toDouble());
           },
         ),
       );
@@ -427,10 +445,44 @@ class TFLiteModelHandler {
     return sortedResults;
   }
 
+  /// Pixel normalization from the bundle spec, [0, 1] for plain models
+  double _normalize(double value) {
+    final preprocessing = _bundleSpec?['preprocessing'];
+    if (preprocessing == null) return value / 255.0;
+    return (value - (preprocessing['mean'] as num)) / (preprocessing['std'] as num);
+  }
+
+  /// Reads the bundle spec from the model's TFLite metadata, or null for a plain model
+  static Map<String, dynamic>? _readBundleSpec(Uint8List model) {
+    try {
+      final reader = _FlatBufferReader(ByteData.sublistView(model));
+      final root = reader.uint32(0);
+      final buffers = reader.field(root, 4); // Model.buffers
+      final metadata = reader.field(root, 6); // Model.metadata
+      if (buffers == null || metadata == null) return null;
+
+      for (final entry in reader.tables(metadata)) {
+        final name = reader.field(entry, 0); // Metadata.name
+        final buffer = reader.field(entry, 1); // Metadata.buffer
+        if (name == null || buffer == null) continue;
+        if (utf8.decode(reader.bytes(name)) != _bundleMetadataName) continue;
+
+        final bufferTable = reader.tables(buffers).elementAt(reader.uint32(buffer));
+        final data = reader.field(bufferTable, 0); // Buffer.data
+        if (data == null) return null;
+        return jsonDecode(utf8.decode(reader.bytes(data))) as Map<String, dynamic>;
+      }
+    } catch (e) {
+      print('Error reading model bundle metadata: $e');
+    }
+    return null;
+  }
+
   void dispose() {
     _interpreter = null;
     _labels = null;
     _modelData = null;
+    _bundleSpec = null;
     _isInitialized = false;
   }
 }
@@ -448,3 +500,36 @@ class ImageStats {
     required this.aspectRatio,
   });
 }
+
+/// Minimal read-only access to the FlatBuffer tables of a .tflite model
+class _FlatBufferReader {
+  final ByteData data;
+
+  _FlatBufferReader(this.data);
+
+  int uint32(int offset) => data.getUint32(offset, Endian.little);
+
+  /// Position of a table field, or null when the field is absent
+  int? field(int table, int index) {
+    final vtable = table - data.getInt32(table, Endian.little);
+    final entry = 4 + 2 * index;
+    if (entry >= data.getUint16(vtable, Endian.little)) return null;
+    final offset = data.getUint16(vtable + entry, Endian.little);
+    return offset == 0 ? null : table + offset;
+  }
+
+  /// Positions of the tables in the vector referenced by a field
+  Iterable<int> tables(int field) {
+    final vector = field + uint32(field);
+    return Iterable<int>.generate(uint32(vector), (i) {
+      final element = vector + 4 + 4 * i;
+      return element + uint32(element);
+    });
+  }
+
+  /// Bytes of the string or [ubyte] vector referenced by a field
+  Uint8List bytes(int field) {
+    final vector = field + uint32(field);
+    return data.buffer.asUint8List(data.offsetInBytes + vector + 4, uint32(vector));
+  }
+}
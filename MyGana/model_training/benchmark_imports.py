@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Import-Time Benchmark for the Training Scripts
+Measures the startup cost of each entry point in a fresh interpreter
+and tracks it over time so heavy top-level imports don't creep back in
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from datetime import datetime
+
+ENTRY_POINTS = [
+    'characters',
+    'cli',
+    'collect_training_data',
+    'simple_train',
+    'test_model',
+    'convert_model',
+    'create_model',
+    'quick_train',
+    'run_training',
+    'train_japanese_model',
+]
+
+HISTORY_FILE = 'import_benchmark_history.jsonl'
+
+
+def time_command(code, repeats):
+    """Wall time of running `python -c code` in a fresh interpreter"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    stderr = ''
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            cwd=here, capture_output=True, text=True
+        )
+        timings.append(time.perf_counter() - start)
+        stderr = result.stderr
+        if result.returncode != 0:
+            raise RuntimeError(f"`{code}` failed:\n{stderr}")
+    return timings, stderr
+
+
+def parse_importtime(stderr, top=5):
+    """Heaviest direct imports of the entry point from `-X importtime` output"""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented by two spaces per level under their parent
+        if len(name) - len(name.lstrip()) == 3:
+            imports.append((name.strip(), int(cumulative) / 1000))
+    imports.sort(key=lambda item: item[1], reverse=True)
+    return [{'module': name, 'ms': ms} for name, ms in imports[:top]]
+
+
+def run_benchmark(entry_points=None, repeats=5):
+    """Benchmark every entry point, relative to a bare interpreter start"""
+    entry_points = entry_points or ENTRY_POINTS
+
+    baseline, _ = time_command('pass', repeats)
+    baseline_ms = min(baseline) * 1000
+    print(f"Interpreter startup: {baseline_ms:.1f} ms")
+
+    results = {}
+    for module in entry_points:
+        timings, stderr = time_command(f'import {module}', repeats)
+        import_ms = max(0.0, min(timings) * 1000 - baseline_ms)
+        results[module] = {
+            'import_ms': import_ms,
+            'median_ms': max(0.0, statistics.median(timings) * 1000 - baseline_ms),
+            'heaviest_imports': parse_importtime(stderr),
+        }
+        print(f"   {module:<24} {import_ms:8.1f} ms")
+
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'interpreter_startup_ms': baseline_ms,
+        'entry_points': results,
+    }
+
+
+def load_history(history_path=HISTORY_FILE):
+    if not os.path.exists(history_path):
+        return []
+    with open(history_path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(current, previous, threshold=0.2, min_delta_ms=20.0):
+    """Entry points that got slower than the previous run by more than threshold"""
+    regressions = []
+    for module, result in current['entry_points'].items():
+        before = previous['entry_points'].get(module)
+        if before is None:
+            continue
+        delta = result['import_ms'] - before['import_ms']
+        if delta > min_delta_ms and delta > threshold * max(before['import_ms'], 1.0):
+            regressions.append({
+                'module': module,
+                'before_ms': before['import_ms'],
+                'after_ms': result['import_ms'],
+            })
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark import time of each entry point")
+    parser.add_argument('modules', nargs='*', help="Entry points to time (default: all)")
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--history', default=HISTORY_FILE)
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Relative slowdown that counts as a regression")
+    args = parser.parse_args(argv)
+
+    print("⏱️  Import-time benchmark")
+    print("=" * 50)
+
+    history = load_history(args.history)
+    current = run_benchmark(args.modules, args.repeats)
+
+    with open(args.history, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(current, ensure_ascii=False) + '\n')
+
+    if history:
+        regressions = compare(current, history[-1], args.threshold)
+        for regression in regressions:
+            print(f"❌ {regression['module']}: {regression['before_ms']:.1f} ms -> "
+                  f"{regression['after_ms']:.1f} ms")
+        if regressions:
+            return 1
+        print("✅ No import-time regressions")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+End-to-End Pipeline Benchmark
+Times every stage of the training pipeline on fixed-seed fixtures: rendering,
+export decode, augmentation, a training step of each architecture, TFLite
+conversion and single/batch inference
+
+Results are appended to a history file and compared with a baseline, so a
+slower stage fails the nightly job instead of going unnoticed.
+
+Examples:
+    python benchmark_pipeline.py
+    python benchmark_pipeline.py --save-baseline
+    python benchmark_pipeline.py render decode --repeats 3
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from datetime import datetime
+
+import numpy as np
+
+HISTORY_FILE = 'pipeline_benchmark_history.jsonl'
+BASELINE_FILE = 'pipeline_benchmark_baseline.json'
+SEED = 42
+BATCH_SIZE = 32
+
+
+def seed_everything(seed=SEED):
+    random.seed(seed)
+    np.random.seed(seed)
+    try:
+        import tensorflow as tf
+        tf.random.set_seed(seed)
+    except ImportError:
+        pass
+
+
+class Fixtures:
+    """Deterministic inputs shared by the stages, built lazily and cached"""
+
+    def __init__(self, directory, samples=230):
+        self.directory = directory
+        self.samples = samples
+        self._cache = {}
+
+    def _cached(self, name, build):
+        if name not in self._cache:
+            seed_everything()
+            self._cache[name] = build()
+        return self._cache[name]
+
+    def export_path(self):
+        def build():
+            from collect_training_data import DataCollector
+            collector = DataCollector()
+            per_char = max(1, self.samples // len(collector.characters))
+            path = os.path.join(self.directory, 'fixture_export.json')
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({'data': collector.generate_synthetic_data(per_char)}, f, ensure_ascii=False)
+            return path
+        return self._cached('export', build)
+
+    def batch(self):
+        def build():
+            rng = np.random.default_rng(SEED)
+            images = rng.random((BATCH_SIZE, 64, 64, 1), dtype=np.float32)
+            labels = rng.integers(0, 46, BATCH_SIZE)
+            return images, labels
+        return self._cached('batch', build)
+
+    def keras_model_path(self):
+        def build():
+            from train_japanese_model import JapaneseCharacterTrainer
+            trainer = JapaneseCharacterTrainer()
+            model = trainer.create_model()
+            path = os.path.join(self.directory, 'fixture_model.h5')
+            model.save(path)
+            return path
+        return self._cached('keras_model', build)
+
+    def tflite_path(self):
+        def build():
+            from train_japanese_model import JapaneseCharacterTrainer
+            path = os.path.join(self.directory, 'fixture_model.tflite')
+            JapaneseCharacterTrainer().convert_to_tflite(path, model_path=self.keras_model_path())
+            return path
+        return self._cached('tflite', build)
+
+
+def measure(fn, repeats, units=1, warmup=1):
+    """Milliseconds per unit of fn() over repeats runs, after warmup runs"""
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000 / units)
+    return {'min_ms': min(timings), 'median_ms': statistics.median(timings)}
+
+
+def stage_render(fixtures, repeats):
+    from collect_training_data import DataCollector
+    collector = DataCollector()
+    characters = collector.characters
+    count = 50
+
+    def run():
+        for i in range(count):
+            collector.create_character_image(characters[i % len(characters)], variation=i)
+
+    return measure(run, repeats, units=count), 'sample'
+
+
+def stage_decode(fixtures, repeats):
+    from train_japanese_model import JapaneseCharacterTrainer
+    path = fixtures.export_path()
+    trainer = JapaneseCharacterTrainer()
+    holder = {}
+
+    def run():
+        holder['X'], _ = trainer.load_training_data(path)
+
+    result = measure(run, repeats, warmup=1)
+    samples = max(len(holder['X']), 1)
+    return {key: value / samples if key.endswith('_ms') else value for key, value in result.items()}, 'sample'
+
+
+def stage_augment(fixtures, repeats):
+    """The in-memory ImageDataGenerator when this Keras has it, else the preprocessing layers"""
+    from tensorflow import keras
+    from train_japanese_model import DEFAULT_HYPERPARAMETERS
+    images, labels = fixtures.batch()
+
+    if hasattr(keras.preprocessing.image, 'ImageDataGenerator'):
+        datagen = keras.preprocessing.image.ImageDataGenerator(
+            rotation_range=DEFAULT_HYPERPARAMETERS['rotation_range'],
+            width_shift_range=DEFAULT_HYPERPARAMETERS['shift_range'],
+            height_shift_range=DEFAULT_HYPERPARAMETERS['shift_range'],
+            zoom_range=DEFAULT_HYPERPARAMETERS['zoom_range'],
+            fill_mode='nearest')
+        flow = datagen.flow(images, labels, batch_size=BATCH_SIZE, seed=SEED)
+        run = lambda: next(flow)
+    else:
+        from sharded_dataset import build_augmentation
+        augmentation = build_augmentation(DEFAULT_HYPERPARAMETERS['rotation_range'],
+                                          DEFAULT_HYPERPARAMETERS['shift_range'],
+                                          DEFAULT_HYPERPARAMETERS['zoom_range'])
+        run = lambda: augmentation(images, training=True)
+
+    return measure(run, repeats, units=BATCH_SIZE, warmup=2), 'sample'
+
+
+def _train_step(model, fixtures, repeats):
+    images, labels = fixtures.batch()
+    # Several warmup steps so graph tracing is not counted
+    return measure(lambda: model.train_on_batch(images, labels), repeats, warmup=3), 'step'
+
+
+def stage_train_full(fixtures, repeats):
+    from train_japanese_model import JapaneseCharacterTrainer
+    return _train_step(JapaneseCharacterTrainer().create_model(), fixtures, repeats)
+
+
+def stage_train_quick(fixtures, repeats):
+    from quick_train import create_simple_model
+    return _train_step(create_simple_model(), fixtures, repeats)
+
+
+def stage_train_minimal(fixtures, repeats):
+    from create_model import create_minimal_model
+    model = create_minimal_model()
+    model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    return _train_step(model, fixtures, repeats)
+
+
+def stage_convert(fixtures, repeats):
+    from train_japanese_model import JapaneseCharacterTrainer
+    model_path = fixtures.keras_model_path()
+    output = os.path.join(fixtures.directory, 'convert_benchmark.tflite')
+    trainer = JapaneseCharacterTrainer()
+    # Conversion takes seconds and varies little, so fewer runs and no warmup
+    return measure(lambda: trainer.convert_to_tflite(output, model_path=model_path),
+                   max(1, repeats // 3), warmup=0), 'model'
+
+
+def stage_inference_single(fixtures, repeats):
+    from inference import TFLitePredictor
+    predictor = TFLitePredictor(fixtures.tflite_path())
+    image = fixtures.batch()[0][:1]
+    count = 100
+
+    def run():
+        for _ in range(count):
+            predictor.predict(image)
+
+    return measure(run, repeats, units=count), 'sample'
+
+
+def stage_inference_batch(fixtures, repeats):
+    from inference import TFLitePredictor
+    predictor = TFLitePredictor(fixtures.tflite_path())
+    images = fixtures.batch()[0]
+    return measure(lambda: predictor.predict(images), repeats, units=len(images), warmup=2), 'sample'
+
+
+STAGES = {
+    'render': stage_render,
+    'decode': stage_decode,
+    'augment': stage_augment,
+    'train_full': stage_train_full,
+    'train_quick': stage_train_quick,
+    'train_minimal': stage_train_minimal,
+    'convert': stage_convert,
+    'inference_single': stage_inference_single,
+    'inference_batch': stage_inference_batch,
+}
+
+
+def run_benchmark(stages=None, repeats=5, samples=230):
+    """Time each stage on the same fixtures; a stage that fails is recorded and the others still run"""
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        fixtures = Fixtures(directory, samples)
+        for name in stages or STAGES:
+            seed_everything()
+            try:
+                result, unit = STAGES[name](fixtures, repeats)
+                result['unit'] = unit
+                print(f"   {name:<18} {result['min_ms']:10.3f} ms/{unit} (median {result['median_ms']:.3f})",
+                      flush=True)
+            except Exception as e:
+                result = {'error': f"{type(e).__name__}: {e}"}
+                print(f"   {name:<18} failed: {result['error']}", flush=True)
+            results[name] = result
+
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'cpu_count': os.cpu_count(),
+        'seed': SEED,
+        'repeats': repeats,
+        'stages': results,
+    }
+
+
+def load_history(history_path=HISTORY_FILE):
+    if not os.path.exists(history_path):
+        return []
+    with open(history_path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(current, baseline, threshold=0.2, min_delta_ms=0.05):
+    """Stages slower than the baseline by more than threshold (on the min timing)"""
+    regressions = []
+    for name, result in current['stages'].items():
+        before = baseline['stages'].get(name)
+        if before is None or 'min_ms' not in before or 'min_ms' not in result:
+            continue
+        delta = result['min_ms'] - before['min_ms']
+        if delta > min_delta_ms and delta > threshold * before['min_ms']:
+            regressions.append({
+                'stage': name,
+                'before_ms': before['min_ms'],
+                'after_ms': result['min_ms'],
+                'slowdown': result['min_ms'] / before['min_ms'] - 1,
+            })
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the training pipeline")
+    parser.add_argument('stages', nargs='*', help=f"Stages to time (default: all of {', '.join(STAGES)})")
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--samples', type=int, default=230, help="Samples in the fixture export")
+    parser.add_argument('--history', default=HISTORY_FILE)
+    parser.add_argument('--baseline', default=BASELINE_FILE,
+                        help="Baseline to compare with (default: the previous run in the history)")
+    parser.add_argument('--save-baseline', action='store_true', help="Make this run the baseline")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Relative slowdown that counts as a regression")
+    args = parser.parse_args(argv)
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    print("⏱️  Pipeline benchmark")
+    print("=" * 50)
+
+    history = load_history(args.history)
+    current = run_benchmark(args.stages, args.repeats, args.samples)
+
+    with open(args.history, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(current, ensure_ascii=False) + '\n')
+
+    # A broken stage fails the run even without a baseline to compare with
+    failures = {name: result['error'] for name, result in current['stages'].items() if 'error' in result}
+    for name, error in failures.items():
+        print(f"❌ {name}: failed ({error})")
+
+    if args.save_baseline:
+        if failures:
+            print("❌ Baseline not saved: failed stages have no timings")
+            return 1
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+        print(f"📁 Baseline saved to {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    elif history:
+        baseline = history[-1]
+    else:
+        return 1 if failures else 0
+
+    regressions = compare(current, baseline, args.threshold)
+    for regression in regressions:
+        print(f"❌ {regression['stage']}: {regression['before_ms']:.3f} ms -> "
+              f"{regression['after_ms']:.3f} ms (+{regression['slowdown']:.0%})")
+    if regressions or failures:
+        return 1
+    print(f"✅ No pipeline regressions against the baseline from {baseline['timestamp']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Confidence-Gated Model Cascade for Japanese Character Recognition
+Runs the smallest model first and only escalates uncertain samples to larger
+models or to specialists for confusable character pairs
+
+Models:
+    create_model.create_minimal_model         - tiny
+    quick_train.create_simple_model           - mid-size
+    JapaneseCharacterTrainer.create_model     - full BatchNorm CNN
+"""
+
+import sys
+import json
+import time
+import itertools
+import argparse
+
+import numpy as np
+
+from inference import load_predictor, load_labels
+
+# Pairs (and triples) of characters that models commonly confuse
+CONFUSABLE_GROUPS = [
+    ('シ', 'ツ'),
+    ('ソ', 'ン'),
+    ('ぬ', 'め'),
+    ('は', 'ほ'),
+    ('る', 'ろ'),
+    ('さ', 'ち'),
+    ('い', 'り'),
+    ('わ', 'れ', 'ね'),
+    ('ク', 'ケ'),
+    ('ウ', 'ワ'),
+]
+
+
+def label_mapping(stage_labels, target_labels):
+    """Index of each target label in a stage's output (-1 when missing)"""
+    position = {label: i for i, label in enumerate(stage_labels)}
+    return np.array([position.get(label, -1) for label in target_labels])
+
+
+def project(probabilities, mapping):
+    """Map stage probabilities onto the target label space and renormalize"""
+    projected = np.where(mapping >= 0, probabilities[:, np.maximum(mapping, 0)], 0.0)
+    total = projected.sum(axis=1, keepdims=True)
+    return projected / np.maximum(total, 1e-12)
+
+
+def top2_margin(probabilities):
+    """Difference between the two highest probabilities of each row"""
+    top2 = np.partition(probabilities, -2, axis=1)[:, -2:]
+    return top2[:, 1] - top2[:, 0]
+
+
+class CascadeStage:
+    def __init__(self, name, predictor, labels, target_labels, threshold=None):
+        self.name = name
+        self.predictor = predictor
+        self.labels = labels
+        self.target_labels = list(target_labels)
+        self.mapping = label_mapping(labels, target_labels)
+        self.threshold = threshold
+
+    def predict(self, images):
+        return project(self.predictor.predict(images), self.mapping)
+
+
+class Specialist:
+    """Small model that only separates the characters of one confusable group"""
+
+    def __init__(self, group, predictor, target_labels, margin=0.3):
+        self.group = tuple(group)
+        self.predictor = predictor
+        self.margin = margin
+        missing = [c for c in group if c not in target_labels]
+        if missing:
+            raise ValueError(f"Specialist group {''.join(group)}: {''.join(missing)} not among the "
+                             f"cascade's {len(target_labels)} target labels")
+        self.target_indices = np.array([target_labels.index(c) for c in group])
+
+    def applies(self, top2_indices):
+        """Rows whose two best labels both belong to this group"""
+        return np.isin(top2_indices, self.target_indices).all(axis=1)
+
+    def refine(self, images, probabilities):
+        """Redistribute the group's probability mass using the specialist"""
+        group_mass = probabilities[:, self.target_indices].sum(axis=1, keepdims=True)
+        refined = probabilities.copy()
+        refined[:, self.target_indices] = self.predictor.predict(images) * group_mass
+        return refined
+
+
+class CascadeClassifier:
+    """Escalates samples through stages while their top-1 margin is below threshold"""
+
+    def __init__(self, stages, specialists=None, target_labels=None):
+        self.stages = stages
+        self.specialists = specialists or []
+        # Stages map their outputs onto one label space; default to theirs
+        self.target_labels = target_labels or stages[0].target_labels
+
+    def predict(self, images):
+        """Probabilities and the index of the stage that answered each sample"""
+        images = np.asarray(images, dtype=np.float32)
+        probabilities = np.zeros((len(images), len(self.target_labels)), dtype=np.float32)
+        answered_by = np.full(len(images), -1, dtype=np.int8)
+        pending = np.arange(len(images))
+
+        for stage_id, stage in enumerate(self.stages):
+            if len(pending) == 0:
+                break
+            stage_probabilities = stage.predict(images[pending])
+            probabilities[pending] = stage_probabilities
+
+            is_last = stage_id == len(self.stages) - 1
+            confident = np.ones(len(pending), dtype=bool) if is_last else \
+                top2_margin(stage_probabilities) >= stage.threshold
+            answered_by[pending[confident]] = stage_id
+            pending = pending[~confident]
+
+        # Hand close calls between confusable characters to specialists
+        top2 = np.argsort(-probabilities, axis=1)[:, :2]
+        margins = top2_margin(probabilities)
+        for specialist in self.specialists:
+            rows = np.where(specialist.applies(top2) & (margins < specialist.margin))[0]
+            if len(rows):
+                probabilities[rows] = specialist.refine(images[rows], probabilities[rows])
+
+        return probabilities, answered_by
+
+    def to_config(self):
+        return {
+            'target_labels': self.target_labels,
+            'stages': [{'name': s.name, 'model': s.predictor.model_path, 'threshold': s.threshold}
+                       for s in self.stages],
+            'specialists': [{'group': list(s.group), 'model': s.predictor.model_path,
+                             'margin': s.margin} for s in self.specialists],
+        }
+
+
+def load_cascade(config_path):
+    """Rebuild a cascade from the config written by main()"""
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    target_labels = config['target_labels']
+
+    stages = []
+    for stage in config['stages']:
+        predictor = load_predictor(stage['model'])
+        labels = load_labels(stage.get('labels'), predictor.num_classes, stage['model'])
+        stages.append(CascadeStage(stage['name'], predictor, labels, target_labels, stage['threshold']))
+
+    specialists = [Specialist(s['group'], load_predictor(s['model']), target_labels, s['margin'])
+                   for s in config['specialists']]
+    return CascadeClassifier(stages, specialists, target_labels)
+
+
+def measure_latency(predictor, images, batch_size=32, repeats=3):
+    """Mean per-sample latency in milliseconds at the given batch size"""
+    batch = np.asarray(images[:batch_size], dtype=np.float32)
+    predictor.predict(batch)  # warm up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        predictor.predict(batch)
+    return (time.perf_counter() - start) * 1000 / (repeats * len(batch))
+
+
+def simulate(stage_margins, stage_correct, thresholds, stage_costs):
+    """Accuracy and mean latency of a cascade, from each stage's held-out predictions"""
+    num_samples = len(stage_correct[0])
+    pending = np.ones(num_samples, dtype=bool)
+    correct = 0
+    cost = 0.0
+
+    for stage_id, (margins, is_correct) in enumerate(zip(stage_margins, stage_correct)):
+        cost += stage_costs[stage_id] * pending.sum()
+        is_last = stage_id == len(stage_margins) - 1
+        confident = pending if is_last else pending & (margins >= thresholds[stage_id])
+        correct += int(is_correct[confident].sum())
+        pending &= ~confident
+
+    return correct / num_samples, float(cost / num_samples)
+
+
+def tune_thresholds(stage_probabilities, y, stage_costs, target_accuracy,
+                    grid=np.linspace(0.0, 1.0, 41)):
+    """Margin thresholds that reach target accuracy at the lowest mean latency"""
+    # Margins and correctness don't depend on the thresholds, compute them once
+    stage_margins = [top2_margin(p) for p in stage_probabilities]
+    stage_correct = [np.argmax(p, axis=1) == y for p in stage_probabilities]
+
+    best = None
+    results = []
+    for thresholds in itertools.product(grid, repeat=len(stage_probabilities) - 1):
+        accuracy, latency = simulate(stage_margins, stage_correct, thresholds, stage_costs)
+        results.append((thresholds, accuracy, latency))
+        if accuracy >= target_accuracy and (best is None or latency < best[2]):
+            best = (thresholds, accuracy, latency)
+
+    if best is None:
+        # Target unreachable: escalate everything to the last stage
+        thresholds = (np.inf,) * (len(stage_probabilities) - 1)
+        best = (thresholds,) + simulate(stage_margins, stage_correct, thresholds, stage_costs)
+        print(f"⚠️  Target accuracy {target_accuracy:.3f} not reachable; using the largest model only")
+
+    return {
+        'thresholds': [float(t) for t in best[0]],
+        'accuracy': best[1],
+        'mean_latency_ms': best[2],
+        'evaluated': len(results),
+    }
+
+
+def train_specialist(X, y_characters, group, output_path, epochs=15, batch_size=32):
+    """Train a tiny model on the samples of one confusable group"""
+    from create_model import create_minimal_model
+
+    y_characters = np.asarray(y_characters)
+    mask = np.isin(y_characters, group)
+    if mask.sum() < 10:
+        print(f"Skipping specialist {'/'.join(group)}: only {mask.sum()} samples")
+        return None
+
+    X_group = X[mask]
+    y_group = np.array([group.index(c) for c in y_characters[mask]])
+
+    model = create_minimal_model(num_classes=len(group))
+    model.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    model.fit(X_group, y_group, epochs=epochs, batch_size=batch_size, validation_split=0.2, verbose=0)
+    model.save(output_path)
+    print(f"Specialist {'/'.join(group)} saved to {output_path}")
+    return output_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tune a confidence-gated model cascade")
+    parser.add_argument('--models', nargs='+', required=True,
+                        help="Stage models from smallest to largest (.tflite/.h5/.keras)")
+    parser.add_argument('--data', default='training_data_export.json', help="Held-out export")
+    parser.add_argument('--target-accuracy', type=float, default=0.95)
+    parser.add_argument('--tune-fraction', type=float, default=0.5,
+                        help="Share of --data used to tune thresholds; the rest reports held-out accuracy")
+    parser.add_argument('--specialist', action='append', default=[], metavar='CHARS=MODEL',
+                        help="Confusable-group specialist, e.g. シツ=specialist_shi_tsu.h5")
+    parser.add_argument('--specialist-margin', type=float, default=0.3)
+    parser.add_argument('--train-specialists', metavar='EXPORT_JSON',
+                        help="Train specialists for every confusable group from this export")
+    parser.add_argument('--output', default='cascade_config.json')
+    args = parser.parse_args(argv)
+
+    from train_japanese_model import JapaneseCharacterTrainer
+
+    # Target the widest label set among the stages (all kana when any model has 92 outputs)
+    predictors = [load_predictor(model_path) for model_path in args.models]
+    stage_labels = [load_labels(None, predictor.num_classes, model_path)
+                    for predictor, model_path in zip(predictors, args.models)]
+    target_labels = max(stage_labels, key=len)
+
+    trainer = JapaneseCharacterTrainer()
+    trainer.use_labels(target_labels)
+    X, y = trainer.load_training_data(args.data)
+    X = X.reshape(-1, trainer.input_size, trainer.input_size, 1).astype(np.float32)
+
+    # Thresholds are tuned on one part and the cascade is scored on the other
+    order = np.random.default_rng(42).permutation(len(y))
+    num_tune = int(round(len(y) * args.tune_fraction))
+    tune_idx, report_idx = order[:num_tune], order[num_tune:]
+    if len(tune_idx) == 0 or len(report_idx) == 0:
+        print(f"❌ --tune-fraction {args.tune_fraction} leaves no tuning or reporting samples "
+              f"out of {len(y)}")
+        return 1
+    print(f"   {len(tune_idx)} samples for tuning, {len(report_idx)} for held-out accuracy")
+
+    # Every stage predicts every held-out sample once; the cascade is simulated from that
+    stages, stage_probabilities, stage_costs = [], [], []
+    for i, (model_path, predictor, labels) in enumerate(zip(args.models, predictors, stage_labels)):
+        stage = CascadeStage(f"stage_{i}", predictor, labels, target_labels)
+        stage_probabilities.append(np.concatenate(
+            [stage.predict(X[start:start + 256]) for start in range(0, len(X), 256)]
+        ))
+        stage_costs.append(measure_latency(predictor, X))
+        stages.append(stage)
+        print(f"   {model_path}: accuracy {np.mean(np.argmax(stage_probabilities[-1], axis=1) == y):.4f}, "
+              f"{stage_costs[-1]:.3f} ms/sample")
+
+    tuned = tune_thresholds([p[tune_idx] for p in stage_probabilities], y[tune_idx],
+                            stage_costs, args.target_accuracy)
+    for stage, threshold in zip(stages, tuned['thresholds']):
+        stage.threshold = threshold
+
+    specialist_specs = list(args.specialist)
+    if args.train_specialists:
+        X_train, y_train = trainer.load_training_data(args.train_specialists)
+        X_train = X_train.reshape(-1, trainer.input_size, trainer.input_size, 1)
+        y_characters = [trainer.index_to_character[i] for i in y_train]
+        for group in CONFUSABLE_GROUPS:
+            if not all(c in target_labels for c in group):
+                print(f"⚠️  Skipping specialist {''.join(group)}: not in the stages' labels")
+                continue
+            model_path = train_specialist(X_train, y_characters, group,
+                                          f"specialist_{'_'.join(group)}.h5")
+            if model_path:
+                specialist_specs.append(f"{''.join(group)}={model_path}")
+
+    specialists = []
+    for spec in specialist_specs:
+        chars, model_path = spec.split('=', 1)
+        try:
+            specialists.append(Specialist(list(chars), load_predictor(model_path), target_labels,
+                                          args.specialist_margin))
+        except ValueError as e:
+            print(f"❌ {e}")
+            return 1
+
+    cascade = CascadeClassifier(stages, specialists, target_labels)
+    probabilities, answered_by = cascade.predict(X[report_idx])
+    accuracy = float(np.mean(np.argmax(probabilities, axis=1) == y[report_idx]))
+
+    config = cascade.to_config()
+    config['tuning'] = dict(tuned, samples=len(tune_idx))
+    config['held_out_accuracy'] = accuracy
+    config['held_out_samples'] = len(report_idx)
+    config['answered_by_stage'] = np.bincount(answered_by, minlength=len(stages)).tolist()
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+
+    print(f"✅ Thresholds {tuned['thresholds']}: tuning accuracy {tuned['accuracy']:.4f}, "
+          f"held-out accuracy {accuracy:.4f}, "
+          f"{tuned['mean_latency_ms']:.3f} ms/sample (largest model alone: {stage_costs[-1]:.3f})")
+    print(f"📁 Cascade config saved to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
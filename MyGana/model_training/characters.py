@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Character Lists for Japanese Character Recognition
+Shared label lists with no heavy dependencies, safe to import from any script
+"""
+
+# Basic hiragana (46 classes)
+HIRAGANA = [
+    'あ', 'い', 'う', 'え', 'お',
+    'か', 'き', 'く', 'け', 'こ',
+    'さ', 'し', 'す', 'せ', 'そ',
+    'た', 'ち', 'つ', 'て', 'と',
+    'な', 'に', 'ぬ', 'ね', 'の',
+    'は', 'ひ', 'ふ', 'へ', 'ほ',
+    'ま', 'み', 'む', 'め', 'も',
+    'や', 'ゆ', 'よ',
+    'ら', 'り', 'る', 'れ', 'ろ',
+    'わ', 'を', 'ん',
+]
+
+# Basic katakana (46 classes)
+KATAKANA = [
+    'ア', 'イ', 'ウ', 'エ', 'オ',
+    'カ', 'キ', 'ク', 'ケ', 'コ',
+    'サ', 'シ', 'ス', 'セ', 'ソ',
+    'タ', 'チ', 'ツ', 'テ', 'ト',
+    'ナ', 'ニ', 'ヌ', 'ネ', 'ノ',
+    'ハ', 'ヒ', 'フ', 'ヘ', 'ホ',
+    'マ', 'ミ', 'ム', 'メ', 'モ',
+    'ヤ', 'ユ', 'ヨ',
+    'ラ', 'リ', 'ル', 'レ', 'ロ',
+    'ワ', 'ヲ', 'ン',
+]
+
+# Label order of the 92-class TensorFlow Lite model
+ALL_KANA = HIRAGANA + KATAKANA
+
+# Voiced kana as (base, mark): composed from base glyph samples plus a diacritic mark
+# (see DiacriticComposer in collect_training_data.py) instead of being rendered separately
+DAKUTEN = 'dakuten'
+HANDAKUTEN = 'handakuten'
+
+VOICED_HIRAGANA = {
+    voiced: (base, DAKUTEN) for voiced, base in zip('がぎぐげござじずぜぞだぢづでどばびぶべぼ',
+                                                     'かきくけこさしすせそたちつてとはひふへほ')
+}
+VOICED_HIRAGANA.update({voiced: (base, HANDAKUTEN) for voiced, base in zip('ぱぴぷぺぽ', 'はひふへほ')})
+
+VOICED_KATAKANA = {
+    voiced: (base, DAKUTEN) for voiced, base in zip('ガギグゲゴザジズゼゾダヂヅデドバビブベボ',
+                                                     'カキクケコサシスセソタチツテトハヒフヘホ')
+}
+VOICED_KATAKANA.update({voiced: (base, HANDAKUTEN) for voiced, base in zip('パピプペポ', 'ハヒフヘホ')})
+
+VOICED_KANA = {**VOICED_HIRAGANA, **VOICED_KATAKANA}
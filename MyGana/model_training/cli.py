@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+"""
+Command Line Interface for Japanese Character Recognition Training
+Headless entry point for cron and batch jobs: generate, pack, ingest, dedup, sweep, train, eval,
+convert, bundle, score, atlas, pipeline, benchmark
+
+Heavy dependencies (TensorFlow, OpenCV, scikit-learn) are only imported by the
+subcommand that needs them, so `--help` and data-only commands start instantly.
+
+Examples:
+    python cli.py generate --target-samples 2000
+    python cli.py generate --shards kanji_shards --samples-per-class 200
+    python cli.py dedup training_data_export.json --output training_data_dedup.json
+    python cli.py pack training_data_export.json --output dataset_shards
+    python cli.py pack training_data_export.json dataset --output binary_shards --binarize
+    python cli.py ingest --inbox inbox --dataset dataset_shards
+    python cli.py sweep --data training_data_export.json --trials 27 --max-epochs 27
+    python cli.py train --epochs 30 --config train_config.json
+    python cli.py train --hyperparameters sweep/best_hyperparameters.json
+    python cli.py train --data dataset_shards --workers 4
+    python cli.py train --epochs 30 --qat-epochs 3
+    python cli.py eval --model best_model.h5
+    python cli.py eval --model japanese_character_model.tflite --data dataset_shards --workers 4
+    python cli.py convert --model best_model.h5 --output japanese_character_model.tflite
+    python cli.py convert --model best_model.h5 --format onnx
+    python cli.py convert --model qat_model.keras --quantization int8
+    python cli.py bundle --model japanese_character_model.tflite --labels japanese_character_labels.txt
+    python cli.py bundle --inspect ../assets/models/japanese_character_model.tflite
+    python cli.py score stroke_export.json --output scores.jsonl
+    python cli.py atlas --model best_model.h5 --output ../assets/models/reference_atlas.bin
+    python cli.py pipeline --pipeline-config pipeline.json --jobs 3
+    python cli.py benchmark --model japanese_character_model.tflite
+    python cli.py benchmark --pipeline
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+
+logger = logging.getLogger('mygana')
+
+
+def load_config(config_path):
+    """Load a JSON (or YAML, if PyYAML is installed) config file"""
+    with open(config_path, 'r', encoding='utf-8') as f:
+        if config_path.endswith(('.yml', '.yaml')):
+            try:
+                import yaml
+            except ImportError:
+                raise SystemExit("PyYAML is required for YAML configs: pip install pyyaml")
+            config = yaml.safe_load(f)
+        else:
+            config = json.load(f)
+    return config or {}
+
+
+def cmd_generate(args):
+    """Generate synthetic data and append it to the export (or to class shards)"""
+    import collect_training_data
+
+    if args.shards:
+        from label_registry import LabelRegistry, build_registry
+        registry = LabelRegistry.load(args.registry) if os.path.exists(args.registry) else build_registry()
+        collect_training_data.generate_class_shards(registry.labels, args.samples_per_class,
+                                                    args.shards, args.workers,
+                                                    binarize_threshold=args.binarize,
+                                                    compose_voiced=not args.no_compose)
+        return 0
+
+    collect_training_data.main(data_path=args.data, target_samples=args.target_samples)
+    return 0
+
+
+def cmd_pack(args):
+    """Pack exports into an on-disk sharded dataset"""
+    import sharded_dataset
+    sharded_dataset.pack_exports(args.exports, args.output, args.shard_size, args.workers,
+                                 binarize_threshold=args.binarize)
+    return 0
+
+
+def cmd_ingest(args):
+    """Append new samples from exports dropped into an inbox to a sharded dataset"""
+    import ingest
+    argv = ['--inbox', args.inbox, '--dataset', args.dataset, '--shard-size', str(args.shard_size),
+            '--interval', str(args.interval)]
+    if args.workers:
+        argv += ['--workers', str(args.workers)]
+    if args.binarize is not None:
+        argv += ['--binarize', str(args.binarize)]
+    if args.once:
+        argv.append('--once')
+    return ingest.main(argv)
+
+
+def cmd_train(args):
+    """Run the full training pipeline"""
+    if args.workers > 1:
+        import distributed_training
+        argv = ['--data', args.data, '--epochs', str(args.epochs), '--batch-size', str(args.batch_size),
+                '--workers', str(args.workers), '--output', args.output]
+        if args.hyperparameters:
+            argv += ['--hyperparameters', args.hyperparameters]
+        return distributed_training.main(argv)
+
+    import train_japanese_model
+    hyperparameters = None
+    batch_size = args.batch_size
+    if args.hyperparameters:
+        with open(args.hyperparameters, 'r', encoding='utf-8') as f:
+            hyperparameters = json.load(f)
+        batch_size = hyperparameters.pop('batch_size', batch_size)
+    tflite_path = train_japanese_model.main(
+        data_path=args.data,
+        epochs=args.epochs,
+        batch_size=batch_size,
+        hard_example_mining=args.hard_example_mining,
+        show_plot=args.show_plot,
+        tflite_path=args.output,
+        report_path=args.report,
+        profile_steps=args.profile_steps,
+        profile_mode=args.profile_mode,
+        top_k=args.top_k or None,
+        hyperparameters=hyperparameters,
+        qat_epochs=args.qat_epochs,
+    )
+    return 0 if tflite_path else 1
+
+
+def cmd_sweep(args):
+    """Parallel hyperparameter sweep with successive halving"""
+    import sweep
+    argv = ['--data', args.data, '--output-dir', args.output_dir, '--scheduler', args.scheduler,
+            '--trials', str(args.trials), '--min-epochs', str(args.min_epochs),
+            '--max-epochs', str(args.max_epochs), '--eta', str(args.eta)]
+    for option in ('parallel', 'threads', 'space'):
+        if getattr(args, option):
+            argv += [f'--{option}', str(getattr(args, option))]
+    return sweep.main(argv)
+
+
+def cmd_eval(args):
+    """Evaluate a trained Keras model, or a .tflite model with a pool of interpreters"""
+    if args.model.endswith('.tflite'):
+        import evaluate_tflite
+        argv = ['--model', args.model, '--data', args.data, '--batch-size', str(args.batch_size),
+                '--min-accuracy', str(args.min_accuracy)]
+        if args.workers:
+            argv += ['--workers', str(args.workers)]
+        if args.report:
+            argv += ['--report', args.report]
+        return evaluate_tflite.main(argv)
+
+    from train_japanese_model import JapaneseCharacterTrainer
+
+    trainer = JapaneseCharacterTrainer()
+    X, y = trainer.load_training_data(args.data)
+    X = X.reshape(-1, trainer.input_size, trainer.input_size, 1)
+    test_accuracy, _ = trainer.evaluate_model(X, y, model_path=args.model)
+    return 0 if test_accuracy >= args.min_accuracy else 1
+
+
+def cmd_convert(args):
+    """Convert a trained Keras model to TensorFlow Lite, or to ONNX with a parity check"""
+    if args.format == 'onnx':
+        import onnx_export
+        output = args.output
+        if output.endswith('.tflite'):
+            output = output[:-len('.tflite')] + '.onnx'
+        return onnx_export.main(['--model', args.model, '--output', output])
+
+    from train_japanese_model import JapaneseCharacterTrainer
+
+    trainer = JapaneseCharacterTrainer()
+    representative_data = None
+    if args.quantization == 'int8':
+        X, _ = trainer.load_training_data(args.calibration_data)
+        representative_data = X.reshape(-1, trainer.input_size, trainer.input_size, 1)
+    if args.model.endswith('.keras'):
+        from quantization import quantization_layers
+        quantization_layers()  # qat_model.keras from quantization-aware fine-tuning
+    trainer.convert_to_tflite(args.output, model_path=args.model, top_k=args.top_k or None,
+                              quantization=args.quantization, representative_data=representative_data)
+    return 0
+
+
+def cmd_dedup(args):
+    """Remove or down-weight near-duplicate samples of an export"""
+    import dedup
+    argv = [args.export, '--mode', args.mode, '--hash', args.hash,
+            '--max-distance', str(args.max_distance), '--epochs', str(args.epochs)]
+    if args.output:
+        argv += ['--output', args.output]
+    return dedup.main(argv)
+
+
+def cmd_score(args):
+    """Re-score exported stroke data against the reference strokes"""
+    import stroke_scoring
+    argv = list(args.exports) + ['--batch-size', str(args.batch_size)]
+    if args.output:
+        argv += ['--output', args.output]
+    return stroke_scoring.main(argv)
+
+
+def cmd_bundle(args):
+    """Embed labels and the preprocessing spec into a .tflite model, or validate a bundle"""
+    import model_bundle
+    if args.inspect:
+        return model_bundle.main(['--inspect', args.inspect])
+    argv = ['--model', args.model, '--labels', args.labels]
+    if args.output:
+        argv += ['--output', args.output]
+    if args.model_version:
+        argv += ['--version', args.model_version]
+    return model_bundle.main(argv)
+
+
+def cmd_atlas(args):
+    """Build the reference glyph atlas from the AnimCJK SVGs"""
+    import reference_atlas
+    argv = ['--output', args.output, '--input-size', str(args.input_size)]
+    if args.model:
+        argv += ['--model', args.model]
+    if args.canvas:
+        argv.append('--canvas')
+    return reference_atlas.main(argv)
+
+
+def cmd_pipeline(args):
+    """Bring the generate → evaluate pipeline up to date, skipping unchanged stages"""
+    import pipeline
+    argv = list(args.targets) + ['--workdir', args.workdir, '--jobs', str(args.jobs)]
+    if args.pipeline_config:
+        argv += ['--config', args.pipeline_config]
+    for stage in args.force:
+        argv += ['--force', stage]
+    if args.dry_run:
+        argv.append('--dry-run')
+    return pipeline.main(argv)
+
+
+def cmd_benchmark(args):
+    """Measure TensorFlow Lite inference latency, per-script import time or every pipeline stage"""
+    if args.imports:
+        import benchmark_imports
+        return benchmark_imports.main(['--repeats', str(args.repeats)])
+    if args.pipeline:
+        import benchmark_pipeline
+        argv = ['--repeats', str(args.repeats), '--threshold', str(args.threshold)]
+        if args.save_baseline:
+            argv.append('--save-baseline')
+        return benchmark_pipeline.main(argv)
+
+    import numpy as np
+    import tensorflow as tf
+
+    interpreter = tf.lite.Interpreter(model_path=args.model, num_threads=args.threads)
+    interpreter.allocate_tensors()
+    input_details = interpreter.get_input_details()[0]
+    output_details = interpreter.get_output_details()[0]
+
+    rng = np.random.default_rng(42)
+    sample = rng.random(input_details['shape'], dtype=np.float32).astype(input_details['dtype'])
+
+    # Warm up
+    for _ in range(5):
+        interpreter.set_tensor(input_details['index'], sample)
+        interpreter.invoke()
+
+    timings = []
+    for _ in range(args.iterations):
+        start = time.perf_counter()
+        interpreter.set_tensor(input_details['index'], sample)
+        interpreter.invoke()
+        interpreter.get_tensor(output_details['index'])
+        timings.append(time.perf_counter() - start)
+
+    timings = np.array(timings) * 1000
+    result = {
+        'model': args.model,
+        'iterations': args.iterations,
+        'mean_ms': float(timings.mean()),
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p95_ms': float(np.percentile(timings, 95)),
+    }
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Japanese character recognition training pipeline",
+    )
+    parser.add_argument('--config', help="JSON/YAML config file with defaults per subcommand")
+    parser.add_argument('--log-level', default='INFO', help="Logging level (default: INFO)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate = subparsers.add_parser('generate', help="Generate synthetic training data")
+    generate.add_argument('--data', default='training_data_export.json')
+    generate.add_argument('--target-samples', type=int, default=1000)
+    generate.add_argument('--shards', metavar='DIR',
+                          help="Write class shards for every registry label to DIR instead")
+    generate.add_argument('--registry', default='label_registry.json',
+                          help="Label registry (built from the app database if missing)")
+    generate.add_argument('--samples-per-class', type=int, default=200)
+    generate.add_argument('--workers', type=int, default=None)
+    generate.add_argument('--binarize', type=int, nargs='?', const=128, default=None, metavar='THRESHOLD',
+                          help="Store class shards as bit-packed 1-bit ink masks")
+    generate.add_argument('--no-compose', action='store_true',
+                          help="Render voiced kana instead of composing them from base shards")
+    generate.set_defaults(func=cmd_generate)
+
+    pack = subparsers.add_parser('pack', help="Pack exports into on-disk shards")
+    pack.add_argument('exports', nargs='+')
+    pack.add_argument('--output', default='dataset_shards')
+    pack.add_argument('--shard-size', type=int, default=65536)
+    pack.add_argument('--workers', type=int, default=None)
+    pack.add_argument('--binarize', type=int, nargs='?', const=128, default=None, metavar='THRESHOLD',
+                      help="Store bit-packed 1-bit ink masks (8x smaller)")
+    pack.set_defaults(func=cmd_pack)
+
+    ingest = subparsers.add_parser('ingest', help="Watch an inbox and append new exports to shards")
+    ingest.add_argument('--inbox', default='inbox')
+    ingest.add_argument('--dataset', default='dataset_shards')
+    ingest.add_argument('--shard-size', type=int, default=65536)
+    ingest.add_argument('--workers', type=int, default=None)
+    ingest.add_argument('--binarize', type=int, nargs='?', const=128, default=None, metavar='THRESHOLD',
+                        help="Store bit-packed 1-bit ink masks (new datasets only)")
+    ingest.add_argument('--interval', type=float, default=5.0, help="Seconds between inbox polls")
+    ingest.add_argument('--once', action='store_true', help="Ingest the current inbox and exit")
+    ingest.set_defaults(func=cmd_ingest)
+
+    train = subparsers.add_parser('train', help="Train the CNN and export TensorFlow Lite")
+    train.add_argument('--data', default='training_data_export.json',
+                       help="Export JSON file or sharded dataset directory")
+    train.add_argument('--epochs', type=int, default=50)
+    train.add_argument('--batch-size', type=int, default=16)
+    train.add_argument('--hard-example-mining', action='store_true')
+    train.add_argument('--show-plot', action='store_true', help="Open the plot window (blocks)")
+    train.add_argument('--output', default='japanese_character_model.tflite')
+    train.add_argument('--report', default='run_report.json')
+    train.add_argument('--profile-steps', type=int, default=0)
+    train.add_argument('--profile-mode', choices=['cprofile', 'tf'], default='cprofile')
+    train.add_argument('--top-k', type=int, default=0,
+                       help="Export only the top-k scores and class ids (for large label sets)")
+    train.add_argument('--hyperparameters',
+                       help="JSON file of hyperparameters, e.g. best_hyperparameters.json from a sweep")
+    train.add_argument('--qat-epochs', type=int, default=0,
+                       help="Quantization-aware fine-tuning epochs; compares float, PTQ-INT8 and QAT-INT8")
+    train.add_argument('--workers', type=int, default=1,
+                       help="Data-parallel worker processes (sharded datasets only, see distributed_training.py)")
+    train.set_defaults(func=cmd_train)
+
+    sweep = subparsers.add_parser('sweep', help="Parallel hyperparameter sweep with successive halving")
+    sweep.add_argument('--data', default='training_data_export.json')
+    sweep.add_argument('--output-dir', default='sweep')
+    sweep.add_argument('--scheduler', choices=['sha', 'hyperband'], default='sha')
+    sweep.add_argument('--trials', type=int, default=27)
+    sweep.add_argument('--min-epochs', type=int, default=1)
+    sweep.add_argument('--max-epochs', type=int, default=27)
+    sweep.add_argument('--eta', type=int, default=3)
+    sweep.add_argument('--parallel', type=int, default=0, help="Concurrent trials (default: half the CPUs)")
+    sweep.add_argument('--threads', type=int, default=0, help="CPU threads per trial")
+    sweep.add_argument('--space', help="JSON file overriding the search space")
+    sweep.set_defaults(func=cmd_sweep)
+
+    evaluate = subparsers.add_parser('eval', help="Evaluate a trained Keras or .tflite model")
+    evaluate.add_argument('--data', default='training_data_export.json',
+                          help="Export JSON file (or, for .tflite models, a sharded dataset directory)")
+    evaluate.add_argument('--model', default='best_model.h5')
+    evaluate.add_argument('--batch-size', type=int, default=256)
+    evaluate.add_argument('--workers', type=int, default=0,
+                          help="Interpreters for .tflite models (default: CPU count)")
+    evaluate.add_argument('--report', help="Write the .tflite evaluation report as JSON")
+    evaluate.add_argument('--min-accuracy', type=float, default=0.0,
+                          help="Exit with status 1 below this accuracy")
+    evaluate.set_defaults(func=cmd_eval)
+
+    convert = subparsers.add_parser('convert', help="Convert a Keras model to TensorFlow Lite")
+    convert.add_argument('--model', default='best_model.h5')
+    convert.add_argument('--output', default='japanese_character_model.tflite')
+    convert.add_argument('--top-k', type=int, default=0)
+    convert.add_argument('--quantization', choices=['float', 'dynamic', 'int8'], default='dynamic',
+                         help="int8 is fully integer, calibrated on --calibration-data")
+    convert.add_argument('--calibration-data', default='training_data_export.json')
+    convert.add_argument('--format', choices=['tflite', 'onnx'], default='tflite',
+                         help="onnx needs tf2onnx and onnxruntime")
+    convert.set_defaults(func=cmd_convert)
+
+    dedup = subparsers.add_parser('dedup', help="Remove or down-weight near-duplicate samples")
+    dedup.add_argument('export')
+    dedup.add_argument('--output')
+    dedup.add_argument('--mode', choices=['remove', 'weight'], default='remove')
+    dedup.add_argument('--hash', choices=['dhash', 'phash'], default='dhash')
+    dedup.add_argument('--max-distance', type=int, default=3)
+    dedup.add_argument('--epochs', type=int, default=50)
+    dedup.set_defaults(func=cmd_dedup)
+
+    bundle = subparsers.add_parser('bundle', help="Embed labels and preprocessing spec into a .tflite model")
+    bundle.add_argument('--model', default='japanese_character_model.tflite')
+    bundle.add_argument('--labels', default='japanese_character_labels.txt')
+    bundle.add_argument('--output', help="Bundle path (default: rewrite --model in place)")
+    bundle.add_argument('--model-version', help="Model version (default: date+hash)")
+    bundle.add_argument('--inspect', metavar='BUNDLE', help="Validate an existing bundle and print its spec")
+    bundle.set_defaults(func=cmd_bundle)
+
+    score = subparsers.add_parser('score', help="Re-score exported strokes against reference strokes")
+    score.add_argument('exports', nargs='+')
+    score.add_argument('--output', help="Per-attempt scores as JSON lines")
+    score.add_argument('--batch-size', type=int, default=2048)
+    score.set_defaults(func=cmd_score)
+
+    atlas = subparsers.add_parser('atlas', help="Build the reference glyph atlas asset")
+    atlas.add_argument('--output', default='reference_atlas.bin')
+    atlas.add_argument('--input-size', type=int, default=64)
+    atlas.add_argument('--model', help="Keras model for the reference embeddings")
+    atlas.add_argument('--canvas', action='store_true', help="Keep glyph positions on the full canvas")
+    atlas.set_defaults(func=cmd_atlas)
+
+    pipeline = subparsers.add_parser('pipeline', help="Incremental generate → evaluate pipeline")
+    pipeline.add_argument('targets', nargs='*', help="Stages to bring up to date (default: all)")
+    pipeline.add_argument('--pipeline-config', help="JSON file overriding the default pipeline config")
+    pipeline.add_argument('--workdir', default='pipeline_artifacts')
+    pipeline.add_argument('--jobs', type=int, default=2)
+    pipeline.add_argument('--force', action='append', default=[], metavar='STAGE')
+    pipeline.add_argument('--dry-run', action='store_true')
+    pipeline.set_defaults(func=cmd_pipeline)
+
+    benchmark = subparsers.add_parser('benchmark', help="Benchmark TensorFlow Lite inference")
+    benchmark.add_argument('--model', default='japanese_character_model.tflite')
+    benchmark.add_argument('--iterations', type=int, default=200)
+    benchmark.add_argument('--threads', type=int, default=1)
+    benchmark.add_argument('--imports', action='store_true',
+                           help="Benchmark import time of each entry point instead")
+    benchmark.add_argument('--pipeline', action='store_true',
+                           help="Benchmark every pipeline stage against a baseline instead")
+    benchmark.add_argument('--save-baseline', action='store_true')
+    benchmark.add_argument('--threshold', type=float, default=0.2)
+    benchmark.add_argument('--repeats', type=int, default=5)
+    benchmark.set_defaults(func=cmd_benchmark)
+
+    return parser, subparsers.choices
+
+
+def parse_args(argv=None):
+    """Parse arguments, with config file values as defaults and CLI flags on top"""
+    parser, subcommands = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.config:
+        config = load_config(args.config)
+        # Config may be flat or keyed by subcommand
+        section = {k: v for k, v in config.items() if k not in subcommands}
+        section.update(config.get(args.command, {}))
+        # Each default goes on the parser that owns the option: a subparser default for a
+        # top-level option such as --log-level would override the flag given on the command line
+        top_level = {action.dest for action in parser._actions}
+        defaults = {k.replace('-', '_'): v for k, v in section.items()}
+        parser.set_defaults(**{k: v for k, v in defaults.items() if k in top_level})
+        subcommands[args.command].set_defaults(**{k: v for k, v in defaults.items() if k not in top_level})
+        args = parser.parse_args(argv)
+
+    return args
+
+
+def main(argv=None):
+    # Stream output line by line even when redirected to a log file
+    sys.stdout.reconfigure(line_buffering=True)
+    sys.stderr.reconfigure(line_buffering=True)
+
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=getattr(logging, args.log_level.upper(), logging.INFO),
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s',
+        stream=sys.stdout,
+    )
+
+    # Use a non-interactive plotting backend unless a window was requested
+    if not getattr(args, 'show_plot', False):
+        os.environ.setdefault('MPLBACKEND', 'Agg')
+
+    logger.info("%s started", args.command)
+    start = time.perf_counter()
+    status = args.func(args)
+    logger.info("%s finished in %.1fs (exit status %d)", args.command, time.perf_counter() - start, status)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
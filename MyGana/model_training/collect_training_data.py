@@ -6,29 +6,23 @@ Generates synthetic training data and collects real user data
 
 import os
 import json
-import numpy as np
-import cv2
 from PIL import Image, ImageDraw, ImageFont
 import base64
 import io
 import random
 from datetime import datetime
+from multiprocessing import Pool
+
+from characters import HIRAGANA, VOICED_KANA, DAKUTEN, HANDAKUTEN
+
+# NumPy and OpenCV are only needed to render images, so they are imported there
 
 class DataCollector:
-    def __init__(self):
-        self.input_size = 64
-        self.characters = [
-    'あ', 'い', 'う', 'え', 'お',
-    'か', 'き', 'く', 'け', 'こ',
-    'さ', 'し', 'す', 'せ', 'そ',
-    'た', 'ち', 'つ', 'て', 'と',
-    'な', 'に', 'ぬ', 'ね', 'の',
-    'は', 'ひ', 'ふ', 'へ', 'ほ',
-    'ま', 'み', 'む', 'め', 'も',
-    'や', 'ゆ', 'よ',
-    'ら', 'り', 'る', 'れ', 'ろ',
-            'わ', 'を', 'ん'
-        ]
+    def __init__(self, characters=None, input_size=64):
+        self.input_size = input_size
+        self.characters = list(characters or HIRAGANA)
+        self.font = None
+        self.composer = None
     
     def generate_synthetic_data(self, num_samples_per_char=50):
         """Generate synthetic training data"""
@@ -39,9 +33,17 @@ class DataCollector:
         for char in self.characters:
             print(f"Generating data for character: {char}")
             
+            # Voiced kana are composed from cached base glyphs instead of rendered
+            if char in VOICED_KANA:
+                composed = self.get_composer(num_samples_per_char).compose(char, num_samples_per_char,
+                                                                           seed=len(training_data))
+            
             for i in range(num_samples_per_char):
                 # Create image with character
-                img = self.create_character_image(char, variation=i)
+                if char in VOICED_KANA:
+                    img = Image.fromarray(composed[i])
+                else:
+                    img = self.create_character_image(char, variation=i)
                 
                 # Convert to base64
                 img_bytes = io.BytesIO()
@@ -65,35 +67,14 @@ class DataCollector:
     
     def create_character_image(self, character, variation=0):
         """Create an image of a Japanese character with variations"""
+        import numpy as np
+        import cv2
+        
         # Create image
         img = Image.new('L', (self.input_size, self.input_size), 255)
         draw = ImageDraw.Draw(img)
         
-        # Try to use a Japanese font, fallback to default
-        try:
-            # Try different font paths
-            font_paths = [
-                '/System/Library/Fonts/Hiragino Sans GB.ttc',  # macOS
-                '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',  # Linux
-                'C:/Windows/Fonts/msgothic.ttc',  # Windows
-            ]
-            
-            font_size = 40
-            font = None
-            
-            for font_path in font_paths:
-                if os.path.exists(font_path):
-                    try:
-                        font = ImageFont.truetype(font_path, font_size)
-                        break
-                    except:
-                        continue
-            
-            if font is None:
-                font = ImageFont.load_default()
-                
-        except:
-            font = ImageFont.load_default()
+        font = self.get_font()
         
         # Add variations
         x_offset = random.randint(-5, 5) + variation % 3
@@ -128,8 +109,50 @@ class DataCollector:
         
         return Image.fromarray(img_array)
     
+    def get_font(self):
+        """Load a Japanese font once, fallback to default"""
+        if self.font is not None:
+            return self.font
+        
+        try:
+            # Try different font paths (Noto CJK covers kana and kanji on Linux)
+            font_paths = [
+                '/System/Library/Fonts/Hiragino Sans GB.ttc',  # macOS
+                '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc',  # Linux
+                '/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc',  # Linux
+                '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',  # Linux
+                'C:/Windows/Fonts/msgothic.ttc',  # Windows
+            ]
+            
+            font_size = 40
+            
+            for font_path in font_paths:
+                if os.path.exists(font_path):
+                    try:
+                        self.font = ImageFont.truetype(font_path, font_size)
+                        break
+                    except:
+                        continue
+            
+            if self.font is None:
+                self.font = ImageFont.load_default()
+                
+        except:
+            self.font = ImageFont.load_default()
+        
+        return self.font
+    
+    def get_composer(self, samples_per_base=50):
+        """DiacriticComposer over the base glyphs of this collector's voiced characters, built once"""
+        if self.composer is None:
+            bases = sorted({VOICED_KANA[char][0] for char in self.characters if char in VOICED_KANA})
+            self.composer = DiacriticComposer.from_collector(self, bases, min(samples_per_base, 50))
+        return self.composer
+    
     def rotate_image(self, image, angle):
         """Rotate image by angle degrees"""
+        import cv2
+        
         h, w = image.shape
         center = (w // 2, h // 2)
         
@@ -140,6 +163,9 @@ class DataCollector:
     
     def scale_image(self, image, scale):
         """Scale image by scale factor"""
+        import numpy as np
+        import cv2
+        
         h, w = image.shape
         new_h, new_w = int(h * scale), int(w * scale)
         
@@ -162,20 +188,14 @@ class DataCollector:
         return scaled
     
     def get_stroke_count(self, character):
-        """Get stroke count for character (simplified)"""
-        stroke_counts = {
-            'あ': 3, 'い': 2, 'う': 2, 'え': 2, 'お': 3,
-            'か': 3, 'き': 3, 'く': 2, 'け': 3, 'こ': 2,
-            'さ': 3, 'し': 1, 'す': 2, 'せ': 3, 'そ': 2,
-            'た': 4, 'ち': 2, 'つ': 1, 'て': 1, 'と': 2,
-            'な': 4, 'に': 3, 'ぬ': 2, 'ね': 2, 'の': 1,
-            'は': 3, 'ひ': 1, 'ふ': 4, 'へ': 1, 'ほ': 4,
-            'ま': 3, 'み': 2, 'む': 3, 'め': 2, 'も': 3,
-            'や': 3, 'ゆ': 2, 'よ': 2,
-            'ら': 2, 'り': 2, 'る': 1, 'れ': 2, 'ろ': 1,
-            'わ': 2, 'を': 3, 'ん': 1,
-        }
-        return stroke_counts.get(character, 2)
+        """Get stroke count for character from the AnimCJK reference strokes"""
+        from stroke_scoring import reference_stroke_counts
+        
+        try:
+            return reference_stroke_counts().get(character, 2)
+        except Exception:
+            # Database or SVG assets not available
+            return 2
     
     def load_existing_data(self, file_path):
         """Load existing training data"""
@@ -207,29 +227,208 @@ class DataCollector:
         print(f"Total samples: {len(data)}")
         print(f"Characters: {len(metadata['characters'])}")
 
-def main():
+def render_marks(mark, count, size=16, seed=0):
+    """Hand-drawn looking diacritic marks as uint8 (count, size, size), black ink on white
+    
+    Dakuten are two short slanted ticks, handakuten a small circle; position,
+    length, slant and stroke width vary per sample.
+    """
+    import numpy as np
+    
+    rng = np.random.default_rng(seed)
+    marks = np.empty((count, size, size), dtype=np.uint8)
+    for i in range(count):
+        img = Image.new('L', (size, size), 255)
+        draw = ImageDraw.Draw(img)
+        width = max(1, round(size * rng.uniform(0.1, 0.18)))
+        if mark == DAKUTEN:
+            slant = rng.uniform(0.1, 0.5)
+            for x in (size * 0.3, size * 0.65):
+                x += rng.uniform(-1, 1)
+                top = size * 0.15 + rng.uniform(-1, 1)
+                length = size * rng.uniform(0.35, 0.55)
+                draw.line([(x, top), (x + slant * length, top + length)], fill=0, width=width)
+        elif mark == HANDAKUTEN:
+            radius = size * rng.uniform(0.2, 0.3)
+            cx, cy = size / 2 + rng.uniform(-1, 1, size=2)
+            draw.ellipse((cx - radius, cy - radius, cx + radius, cy + radius), outline=0, width=width)
+        else:
+            raise ValueError(f"Unknown diacritic mark: {mark}")
+        marks[i] = np.asarray(img)
+    return marks
+
+def _index_draws(indices, seed, stream, n):
+    """Uniform integers in [0, n) from a hash of (seed, stream, index), one per index"""
+    import numpy as np
+    
+    # splitmix64 finalizer over the combined key
+    key = ((seed * 4 + stream) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    x = np.asarray(indices, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15) + np.uint64(key)
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return (x % np.uint64(n)).astype(np.int64)
+
+class DiacriticComposer:
+    """Voiced kana composed from cached base-glyph and diacritic-mark samples
+    
+    Base samples are rendered (or read from class shards) once per base character
+    and marks are rendered once per mark type; a voiced sample is a base sample
+    with a mark pasted near its top-right corner, the placement jitter of a whole
+    batch drawn and applied with array indexing.
+    """
+    
+    def __init__(self, base_samples=None, input_size=64, num_marks=64, seed=42):
+        self.base_samples = dict(base_samples or {})
+        self.input_size = input_size
+        mark_size = input_size // 4
+        self.marks = {mark: render_marks(mark, num_marks, mark_size, seed + i)
+                      for i, mark in enumerate((DAKUTEN, HANDAKUTEN))}
+    
+    @classmethod
+    def from_collector(cls, collector, bases, samples_per_base=50, **kwargs):
+        """Render samples_per_base samples of each base character with the collector"""
+        import numpy as np
+        
+        samples = {base: np.stack([np.asarray(collector.create_character_image(base, variation=i))
+                                   for i in range(samples_per_base)])
+                   for base in bases}
+        return cls(samples, collector.input_size, **kwargs)
+    
+    def compose(self, character, count, seed=0):
+        """count uint8 samples of a voiced character from the cached samples of its base"""
+        base, mark = VOICED_KANA[character]
+        return self.compose_batch(self.base_samples[base], mark, count, seed)
+    
+    def compose_batch(self, base_images, mark, count, seed=0, indices=None):
+        """Paste random marks with placement jitter onto random base images (N, H, W)
+        
+        With indices (sample positions in a composed shard; count is ignored), each
+        sample's draws depend only on the seed and its own index, so any slice of a
+        composed shard can be built without composing the rest.
+        """
+        import numpy as np
+        
+        if indices is None:
+            rng = np.random.default_rng(seed)
+            draw = lambda stream, n: rng.integers(n, size=count)
+        else:
+            count = len(indices)
+            draw = lambda stream, n: _index_draws(indices, seed, stream, n)
+        
+        base_choice = draw(0, len(base_images))
+        images = np.array(base_images[np.sort(base_choice) if indices is None else base_choice])
+        marks = self.marks[mark][draw(1, len(self.marks[mark]))]
+        
+        size = marks.shape[1]
+        jitter = max(1, size // 5)
+        top = jitter + draw(2, 2 * jitter + 1) - jitter
+        left = images.shape[2] - size - jitter + draw(3, 2 * jitter + 1) - jitter
+        rows = (top[:, None] + np.arange(size))[:, :, None]
+        columns = (left[:, None] + np.arange(size))[:, None, :]
+        samples = np.arange(count)[:, None, None]
+        
+        # Darker pixel wins, so a mark overlapping the glyph does not erase it
+        images[samples, rows, columns] = np.minimum(images[samples, rows, columns], marks)
+        return images
+
+def _render_class_shard(args):
+    """Worker: render all samples of one class and save them as a class shard"""
+    import numpy as np
+    
+    label, character, num_samples, output_dir, input_size, seed, binarize_threshold = args
+    random.seed(seed + label)
+    collector = DataCollector([character], input_size)
+    
+    images = np.empty((num_samples, input_size, input_size), dtype=np.uint8)
+    for i in range(num_samples):
+        images[i] = np.asarray(collector.create_character_image(character, variation=i))
+    
+    if binarize_threshold is not None:
+        from preprocessing import pack_bits
+        images = pack_bits(images, binarize_threshold)
+    
+    name = f"class_{label:05d}"
+    np.save(os.path.join(output_dir, f"{name}.images.npy"), images)
+    np.save(os.path.join(output_dir, f"{name}.labels.npy"), np.full(num_samples, label, dtype=np.int16))
+    return label, name, num_samples
+
+def generate_class_shards(labels, samples_per_class, output_dir, workers=None, input_size=64, seed=42,
+                          binarize_threshold=None, compose_voiced=True):
+    """Render synthetic samples for every label on all cores, one shard per class
+    
+    Workers write their own shard files, so generation scales with the number of
+    cores; the index is updated as classes finish, and classes that already have a
+    shard are skipped when the run is resumed.
+    
+    With compose_voiced, voiced kana whose base character is also a label are not
+    rendered: their shards are index entries that ShardedDataset composes from the
+    base class shard and a diacritic mark when read, so they take no disk space.
+    """
+    from sharded_dataset import ShardWriter
+    
+    writer = ShardWriter(output_dir, labels=labels, shard_size=1, input_size=input_size,
+                         binarize_threshold=binarize_threshold)
+    if list(labels[:len(writer.index['labels'])]) != writer.index['labels']:
+        raise ValueError(f"Labels of {output_dir} are not a prefix of the new label list")
+    writer.index['labels'] = list(labels)
+    
+    label_index = {character: label for label, character in enumerate(labels)}
+    composed = {label: label_index[VOICED_KANA[character][0]] for label, character in enumerate(labels)
+                if compose_voiced and character in VOICED_KANA and VOICED_KANA[character][0] in label_index}
+    
+    done = {shard['label'] for shard in writer.index['shards'] if 'label' in shard}
+    tasks = [(label, character, samples_per_class, output_dir, input_size, seed,
+              writer.threshold if writer.packed else None)
+             for label, character in enumerate(labels) if label not in done and label not in composed]
+    print(f"Generating {samples_per_class} samples for {len(tasks)} classes "
+          f"({len(done)} already done, {len(composed)} composed)...")
+    
+    with Pool(workers) as pool:
+        for finished, (label, name, num_samples) in enumerate(
+                pool.imap_unordered(_render_class_shard, tasks), 1):
+            writer.add_shard(name, num_samples, label)
+            if finished % 100 == 0:
+                print(f"  {finished}/{len(tasks)} classes")
+    
+    # Base shards exist now; voiced classes only need their recipe in the index
+    for label, base_label in composed.items():
+        if label not in done:
+            writer.add_shard(f"class_{label:05d}", samples_per_class, label, compose={
+                'base': f"class_{base_label:05d}",
+                'mark': VOICED_KANA[labels[label]][1],
+                'seed': seed + label,
+            })
+    
+    writer.write_index()
+    print(f"Dataset has {writer.index['total_samples']} samples in {len(writer.index['shards'])} class shards")
+    return writer.index
+
+def main(data_path='training_data_export.json', target_samples=1000):
     """Main data collection function"""
-        print("Japanese Character Data Collection")
-        print("=" * 40)
+    print("Japanese Character Data Collection")
+    print("=" * 40)
     
     collector = DataCollector()
     
     # Load existing data
-    existing_data = collector.load_existing_data('training_data_export.json')
+    existing_data = collector.load_existing_data(data_path)
     existing_samples = len(existing_data['data'])
     
     print(f"Existing samples: {existing_samples}")
     
     # Generate synthetic data
-    if existing_samples < 1000:  # Generate more data if we don't have enough
-        num_samples_per_char = max(20, (1000 - existing_samples) // len(collector.characters))
+    if existing_samples < target_samples:  # Generate more data if we don't have enough
+        num_samples_per_char = max(20, (target_samples - existing_samples) // len(collector.characters))
         synthetic_data = collector.generate_synthetic_data(num_samples_per_char)
         
         # Combine with existing data
         all_data = existing_data['data'] + synthetic_data
         
         # Save combined data
-        collector.save_training_data(all_data, 'training_data_export.json')
+        collector.save_training_data(all_data, data_path)
     else:
         print("Sufficient training data already available!")
 
@@ -6,10 +6,11 @@ This script converts the trained scikit-learn model to a format Flutter can use
 
 import pickle
 import json
-import numpy as np
-from sklearn.ensemble import RandomForestClassifier
 import os
 
+from characters import HIRAGANA
+from simple_train import final_estimator, feature_importances
+
 def convert_model_to_flutter():
     """Convert the trained model to Flutter-compatible JSON format"""
     
@@ -31,53 +32,61 @@ def convert_model_to_flutter():
             model = pickle.load(f)
     
     # Extract model information
+    estimator = final_estimator(model)
     model_info = {
-        'model_type': 'RandomForestClassifier',
-        'n_estimators': int(model.n_estimators),
-        'max_depth': int(model.max_depth) if model.max_depth is not None else None,
-        'feature_importances': [float(x) for x in model.feature_importances_],
+        'model_type': type(estimator).__name__,
+        'feature_importances': [float(x) for x in feature_importances(model)],
         'classes': [int(x) for x in model.classes_],
         'n_features': int(model.n_features_in_),
     }
     
-    # Get decision trees (simplified)
-    trees_info = []
-    for i, tree in enumerate(model.estimators_[:10]):  # Limit to first 10 trees for size
-        tree_info = {
-            'tree_id': int(i),
-            'feature_importances': [float(x) for x in tree.feature_importances_],
-            'max_depth': int(tree.max_depth),
-            'n_leaves': int(tree.get_n_leaves()),
-        }
-        trees_info.append(tree_info)
-    
-    model_info['trees'] = trees_info
+    if hasattr(estimator, 'estimators_') and hasattr(estimator, 'n_estimators'):
+        model_info['n_estimators'] = int(estimator.n_estimators)
+        model_info['max_depth'] = int(estimator.max_depth) if estimator.max_depth is not None else None
+        
+        # Get decision trees (simplified)
+        trees_info = []
+        for i, tree in enumerate(estimator.estimators_[:10]):  # Limit to first 10 trees for size
+            # Per-tree importances are not used by the app; the forest-level ones above are
+            tree_info = {
+                'tree_id': int(i),
+                'max_depth': int(tree.max_depth),
+                'n_leaves': int(tree.get_n_leaves()),
+            }
+            trees_info.append(tree_info)
+        
+        model_info['trees'] = trees_info
+    elif hasattr(estimator, 'n_trees_per_iteration_'):
+        # Gradient boosting: one tree per class per iteration, stopped early
+        model_info['n_iterations'] = int(estimator.n_iter_)
+        model_info['n_trees_per_iteration'] = int(estimator.n_trees_per_iteration_)
+    
+    if hasattr(model, 'steps'):
+        model_info['pipeline'] = [name for name, _ in model.steps]
+        if hasattr(estimator, 'coef_'):
+            # Scaler, PCA and linear weights are enough to run the model exactly in Dart
+            scaler, pca = model.steps[0][1], model.steps[1][1]
+            model_info['scaler'] = {'mean': scaler.mean_.tolist(), 'scale': scaler.scale_.tolist()}
+            model_info['pca'] = {'mean': pca.mean_.tolist(), 'components': pca.components_.tolist()}
+            model_info['coef'] = estimator.coef_.tolist()
+            model_info['intercept'] = estimator.intercept_.tolist()
     
     # Character mapping
-    characters = [
-        'あ', 'い', 'う', 'え', 'お',
-        'か', 'き', 'く', 'け', 'こ',
-        'さ', 'し', 'す', 'せ', 'そ',
-        'た', 'ち', 'つ', 'て', 'と',
-        'な', 'に', 'ぬ', 'ね', 'の',
-        'は', 'ひ', 'ふ', 'へ', 'ほ',
-        'ま', 'み', 'む', 'め', 'も',
-        'や', 'ゆ', 'よ',
-        'ら', 'り', 'る', 'れ', 'ろ',
-        'わ', 'を', 'ん'
-    ]
+    characters = HIRAGANA
     
     model_info['characters'] = characters
     model_info['character_to_index'] = {char: i for i, char in enumerate(characters)}
     
-    # Save as JSON for Flutter
+    # Save as compact JSON for Flutter (parsed at app start)
     with open('simple_japanese_model.json', 'w', encoding='utf-8') as f:
-        json.dump(model_info, f, ensure_ascii=False, indent=2)
+        json.dump(model_info, f, ensure_ascii=False, separators=(',', ':'))
     
     print("✅ Model converted to JSON format!")
     print(f"📁 Saved as: simple_japanese_model.json")
     print(f"📊 Model info:")
-    print(f"   - Trees: {len(trees_info)}")
+    print(f"   - Type: {model_info['model_type']}")
+    if 'trees' in model_info:
+        print(f"   - Trees: {len(model_info['trees'])}")
     print(f"   - Features: {model_info['n_features']}")
     print(f"   - Classes: {len(characters)}")
     
@@ -4,39 +4,17 @@ Create a minimal working model for Japanese character recognition
 """
 
 import os
-import numpy as np
-import tensorflow as tf
-from tensorflow import keras
-from tensorflow.keras import layers
 
-# Character labels
-CHARACTER_LABELS = [
-    # Hiragana
-    'あ', 'い', 'う', 'え', 'お',
-    'か', 'き', 'く', 'け', 'こ',
-    'さ', 'し', 'す', 'せ', 'そ',
-    'た', 'ち', 'つ', 'て', 'と',
-    'な', 'に', 'ぬ', 'ね', 'の',
-    'は', 'ひ', 'ふ', 'へ', 'ほ',
-    'ま', 'み', 'む', 'め', 'も',
-    'や', 'ゆ', 'よ',
-    'ら', 'り', 'る', 'れ', 'ろ',
-    'わ', 'を', 'ん',
-    # Katakana
-    'ア', 'イ', 'ウ', 'エ', 'オ',
-    'カ', 'キ', 'ク', 'ケ', 'コ',
-    'サ', 'シ', 'ス', 'セ', 'ソ',
-    'タ', 'チ', 'ツ', 'テ', 'ト',
-    'ナ', 'ニ', 'ヌ', 'ネ', 'ノ',
-    'ハ', 'ヒ', 'フ', 'ヘ', 'ホ',
-    'マ', 'ミ', 'ム', 'メ', 'モ',
-    'ヤ', 'ユ', 'ヨ',
-    'ラ', 'リ', 'ル', 'レ', 'ロ',
-    'ワ', 'ヲ', 'ン',
-]
+from characters import ALL_KANA
 
-def create_minimal_model():
+# Character labels (hiragana followed by katakana)
+CHARACTER_LABELS = ALL_KANA
+
+def create_minimal_model(num_classes=92):
     """Create a minimal model that can be trained quickly"""
+    from tensorflow import keras
+    from tensorflow.keras import layers
+    
     model = keras.Sequential([
         layers.Input(shape=(64, 64, 1)),
         layers.Conv2D(16, (3, 3), activation='relu'),
@@ -45,11 +23,13 @@ def create_minimal_model():
         layers.MaxPooling2D((2, 2)),
         layers.GlobalAveragePooling2D(),
         layers.Dense(64, activation='relu'),
-        layers.Dense(92, activation='softmax')
+        layers.Dense(num_classes, activation='softmax')
     ])
     return model
 
 def main():
+    import tensorflow as tf
+    
     print("Creating minimal Japanese character recognition model...")
     
     # Create model
@@ -66,14 +46,8 @@ def main():
     print("Model summary:")
     model.summary()
     
-    # Create dummy data for training (since we have the dataset)
-    print("Creating dummy training data...")
-    X_dummy = np.random.rand(100, 64, 64, 1).astype(np.float32)
-    y_dummy = np.random.randint(0, 92, 100)
-    
-    # Train for just 1 epoch to create a working model
-    print("Training model with dummy data...")
-    model.fit(X_dummy, y_dummy, epochs=1, verbose=1)
+    # No training on random data: an untrained model converts just the same
+    # (pipeline.py builds a trained one incrementally)
     
     # Convert to TFLite
     print("Converting to TensorFlow Lite...")
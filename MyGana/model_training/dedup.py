@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Near-Duplicate Removal for Japanese Character Training Exports
+Perceptual hashes (dHash/pHash) computed over the whole image array, and a
+multi-index Hamming lookup to find near-duplicate samples
+
+Duplicates of the same character are removed (keeping the first occurrence,
+so app-collected data wins over later synthetic batches) or down-weighted
+with a `sampleWeight` field that training picks up.
+"""
+
+import sys
+import json
+import argparse
+from multiprocessing import Pool
+
+import numpy as np
+
+from preprocessing import INPUT_SIZE, decode_sample
+
+HASH_BITS = 64
+
+
+def _area_resize_matrix(source, target):
+    """(target, source) matrix that averages source pixels into target bins"""
+    edges = np.linspace(0, source, target + 1)
+    positions = np.arange(source + 1)
+    # Overlap of each source pixel [p, p+1) with each target bin
+    overlap = np.clip(np.minimum(edges[1:, None], positions[None, 1:])
+                      - np.maximum(edges[:-1, None], positions[None, :-1]), 0, None)
+    return (overlap / overlap.sum(axis=1, keepdims=True)).astype(np.float32)
+
+
+def _dct_matrix(size):
+    """Orthonormal DCT-II matrix"""
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2.0 / size)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+def _pack(bits):
+    """(N, 64) booleans to one uint64 per row"""
+    return np.packbits(bits, axis=1).view('>u8').ravel().astype(np.uint64)
+
+
+def dhash(images):
+    """Difference hash: sign of horizontal gradients on a 9x8 thumbnail"""
+    images = np.asarray(images, dtype=np.float32)
+    rows = _area_resize_matrix(images.shape[1], 8)
+    columns = _area_resize_matrix(images.shape[2], 9)
+    small = rows @ images @ columns.T
+    return _pack((small[:, :, 1:] > small[:, :, :-1]).reshape(len(images), -1))
+
+
+def phash(images):
+    """DCT hash: low 8x8 frequencies of a 32x32 thumbnail against their median"""
+    images = np.asarray(images, dtype=np.float32)
+    rows = _area_resize_matrix(images.shape[1], 32)
+    columns = _area_resize_matrix(images.shape[2], 32)
+    dct = _dct_matrix(32)[:8]
+    # Resize and DCT are both linear, so they fold into one matrix per side
+    coefficients = (dct @ rows) @ images @ (dct @ columns).T
+    coefficients = coefficients.reshape(len(images), -1)
+    # The DC term only reflects overall brightness
+    median = np.median(coefficients[:, 1:], axis=1, keepdims=True)
+    return _pack(coefficients > median)
+
+
+HASHES = {'dhash': dhash, 'phash': phash}
+
+
+def popcount(values):
+    """Number of set bits of each uint64"""
+    values = np.asarray(values, dtype=np.uint64)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values).astype(np.int64)
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def _chunks(hashes, num_chunks):
+    """Split each hash into num_chunks bit ranges of (almost) equal width"""
+    widths = [HASH_BITS // num_chunks + (i < HASH_BITS % num_chunks) for i in range(num_chunks)]
+    shift = 0
+    for width in widths:
+        yield (hashes >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+        shift += width
+
+
+def near_duplicate_pairs(hashes, max_distance=3, tile=1024):
+    """Index pairs (i < j) of distinct hashes within max_distance bits
+
+    Multi-index hashing: with the hash split into max_distance + 1 chunks, two
+    hashes within max_distance bits agree exactly on at least one chunk, so only
+    hashes sharing a chunk value are compared.
+    """
+    pairs = []
+    for chunk in _chunks(hashes, max_distance + 1):
+        order = np.argsort(chunk, kind='stable')
+        boundaries = np.flatnonzero(np.diff(chunk[order])) + 1
+        for bucket in np.split(order, boundaries):
+            if len(bucket) < 2:
+                continue
+            # Compare tile x tile blocks of the upper triangle, so memory stays at
+            # tile**2 even for a huge bucket (e.g. near-blank images sharing a chunk)
+            for row in range(0, len(bucket), tile):
+                rows = bucket[row:row + tile]
+                for column in range(row, len(bucket), tile):
+                    columns = bucket[column:column + tile]
+                    distances = popcount(hashes[rows][:, None] ^ hashes[columns][None, :])
+                    i, j = np.nonzero(distances <= max_distance)
+                    left = np.minimum(rows[i], columns[j])
+                    right = np.maximum(rows[i], columns[j])
+                    keep = left < right
+                    pairs.append(np.stack([left[keep], right[keep]], axis=1))
+
+    if not pairs:
+        return np.zeros((0, 2), dtype=np.int64)
+    # The same pair can be found through several chunks
+    return np.unique(np.concatenate(pairs), axis=0)
+
+
+def find_duplicates(hashes, labels, max_distance=3):
+    """Duplicate cluster of each sample, plus the visual clusters that mix different labels
+
+    Exact duplicates collapse through np.unique first, so the near-duplicate
+    search only sees distinct hashes.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    unique_hashes, inverse = np.unique(hashes, return_inverse=True)
+    pairs = near_duplicate_pairs(unique_hashes, max_distance) if max_distance > 0 \
+        else np.zeros((0, 2), dtype=np.int64)
+
+    graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])),
+                       shape=(len(unique_hashes), len(unique_hashes)))
+    _, hash_cluster = connected_components(graph, directed=False)
+    visual_cluster = hash_cluster[inverse.ravel()]
+
+    # Only samples of the same character are duplicates; mixed labels are conflicts
+    labels = np.asarray(labels)
+    _, label_ids = np.unique(labels, return_inverse=True)
+    _, clusters = np.unique(np.stack([visual_cluster, label_ids.ravel()], axis=1), axis=0, return_inverse=True)
+    clusters = clusters.ravel()
+
+    per_visual = np.unique(np.stack([visual_cluster, label_ids.ravel()], axis=1), axis=0)[:, 0]
+    conflicting = np.flatnonzero(np.bincount(per_visual) > 1)
+    return clusters, conflicting, visual_cluster
+
+
+def _decode(entry):
+    try:
+        return decode_sample(entry, INPUT_SIZE)
+    except Exception:
+        return None
+
+
+def deduplicate_export(export_path, output_path, mode='remove', hash_name='dhash',
+                       max_distance=3, epochs=50, workers=None):
+    """Remove or down-weight near-duplicates of an export and report the compute saved"""
+    with open(export_path, 'r', encoding='utf-8') as f:
+        export = json.load(f)
+    entries = export['data']
+
+    with Pool(workers) as pool:
+        images = pool.map(_decode, entries, chunksize=256)
+    valid = [i for i, image in enumerate(images) if image is not None]
+    undecodable = len(entries) - len(valid)
+    entries = [entries[i] for i in valid]
+    images = np.stack([images[i] for i in valid])
+    labels = [entry.get('character') for entry in entries]
+
+    hashes = HASHES[hash_name](images)
+    clusters, conflicting, visual_cluster = find_duplicates(hashes, labels, max_distance)
+    sizes = np.bincount(clusters)
+    labels = np.asarray(labels)
+    # Identical images under different characters point at broken rendering or labels
+    conflicts = [''.join(sorted(set(labels[visual_cluster == cluster].tolist()))) for cluster in conflicting[:20]]
+
+    if mode == 'remove':
+        # First occurrence of each cluster
+        _, first = np.unique(clusters, return_index=True)
+        kept = [entries[i] for i in np.sort(first)]
+        effective_samples = len(kept)
+    else:
+        for entry, cluster in zip(entries, clusters):
+            entry['sampleWeight'] = float(1.0 / sizes[cluster])
+        kept = entries
+        effective_samples = int(len(sizes))
+
+    export['data'] = kept
+    export.setdefault('metadata', {})['totalSamples'] = len(kept)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(export, f, ensure_ascii=False)
+
+    duplicates = len(entries) - effective_samples
+    report = {
+        'samples': len(entries),
+        'undecodable': undecodable,
+        'clusters': int(len(sizes)),
+        'duplicates': int(duplicates),
+        'duplicate_fraction': duplicates / max(len(entries), 1),
+        'largest_cluster': int(sizes.max()) if len(sizes) else 0,
+        'label_conflicts': conflicts,
+        'num_label_conflicts': int(len(conflicting)),
+        # Extra epochs over the deduplicated data that the removed samples would have cost
+        'epochs_saved': epochs * duplicates / max(effective_samples, 1),
+        'planned_epochs': epochs,
+        'mode': mode,
+    }
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Remove or down-weight near-duplicate samples of an export")
+    parser.add_argument('export', help="Export JSON file")
+    parser.add_argument('--output', help="Output export (default: <export>.dedup.json)")
+    parser.add_argument('--mode', choices=['remove', 'weight'], default='remove')
+    parser.add_argument('--hash', choices=sorted(HASHES), default='dhash')
+    parser.add_argument('--max-distance', type=int, default=3, help="Max Hamming distance in bits")
+    parser.add_argument('--epochs', type=int, default=50, help="Planned training epochs for the savings estimate")
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    output_path = args.output or args.export.replace('.json', '') + '.dedup.json'
+    report = deduplicate_export(args.export, output_path, args.mode, args.hash,
+                                args.max_distance, args.epochs, args.workers)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    print(f"📁 Saved to {output_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Multi-Worker Data-Parallel Training for Japanese Character Recognition
+Trains from a sharded dataset with tf.distribute.MultiWorkerMirroredStrategy;
+each worker streams its own disjoint blocks of the shard files
+
+On a cluster every host runs this script with --worker and its own TF_CONFIG.
+Locally, the launcher starts several worker processes with a localhost TF_CONFIG.
+
+Examples:
+    python distributed_training.py --data dataset_shards --workers 4
+    python distributed_training.py --data dataset_shards --scaling 1,2,4 --epochs 3
+    TF_CONFIG='{"cluster": {...}, "task": {"type": "worker", "index": 0}}' \\
+        python distributed_training.py --data dataset_shards --worker
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import subprocess
+import tempfile
+
+MODEL_PATH = 'distributed_model.h5'
+
+
+def free_ports(count):
+    """Ports that are free right now on localhost"""
+    sockets = []
+    try:
+        for _ in range(count):
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.bind(('localhost', 0))
+            sockets.append(s)
+        return [s.getsockname()[1] for s in sockets]
+    finally:
+        for s in sockets:
+            s.close()
+
+
+def local_tf_config(ports, index):
+    return {
+        'cluster': {'worker': [f'localhost:{port}' for port in ports]},
+        'task': {'type': 'worker', 'index': index},
+    }
+
+
+def cluster_spec():
+    """(num_workers, worker_index) from TF_CONFIG, or a single worker without it"""
+    tf_config = json.loads(os.environ.get('TF_CONFIG', '{}'))
+    workers = tf_config.get('cluster', {}).get('worker', [])
+    return max(len(workers), 1), tf_config.get('task', {}).get('index', 0)
+
+
+def run_worker(shard_dir, epochs=10, batch_size=32, validation_split=0.2, shuffle_buffer=8192,
+               model_path=MODEL_PATH, report_dir='.', hyperparameters=None):
+    """Train one worker of the cluster described by TF_CONFIG
+
+    batch_size is per worker; the global batch grows with the number of workers,
+    so each worker does the same work per step and an epoch takes fewer steps.
+    """
+    import tensorflow as tf
+    from tensorflow import keras
+    from instrumentation import RunInstrumentation
+    from sharded_dataset import ShardedDataset
+    from train_japanese_model import JapaneseCharacterTrainer, LARGE_VOCABULARY_THRESHOLD
+
+    num_workers, worker_index = cluster_spec()
+    is_chief = worker_index == 0
+
+    # Ring all-reduce is the collective implementation that works on CPU hosts
+    strategy = tf.distribute.MultiWorkerMirroredStrategy(
+        communication_options=tf.distribute.experimental.CommunicationOptions(
+            implementation=tf.distribute.experimental.CommunicationImplementation.RING))
+
+    run = RunInstrumentation(os.path.join(report_dir, f'run_report.worker{worker_index}.json'))
+    dataset = ShardedDataset(shard_dir)
+    trainer = JapaneseCharacterTrainer(hyperparameters=hyperparameters)
+    trainer.use_labels(dataset.labels)
+
+    global_batch_size = batch_size * num_workers
+    # Every block is split across the workers, but each one still needs some samples of each split
+    for split in ('train', 'validation'):
+        if dataset.count(split, validation_split) < num_workers:
+            raise ValueError(f"{shard_dir} has fewer {split} samples than the {num_workers} workers")
+    # Every worker must run the same number of steps, so the partial streams repeat
+    steps_per_epoch = max(dataset.count('train', validation_split) // global_batch_size, 1)
+    validation_steps = max(dataset.count('validation', validation_split) // global_batch_size, 1)
+
+    options = tf.data.Options()
+    # Data is already split per worker by shard block
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+
+    def worker_iterator(split, shuffle):
+        data = dataset.as_tf_dataset(split, global_batch_size, validation_split,
+                                     shuffle_buffer=shuffle_buffer if shuffle else 0,
+                                     augment=trainer.augmentation() if shuffle else False,
+                                     num_workers=num_workers, worker_index=worker_index)
+        return iter(strategy.experimental_distribute_dataset(data.repeat().with_options(options)))
+
+    with run.phase('build'):
+        with strategy.scope():
+            model = trainer.create_model()
+            optimizer = model.optimizer
+            loss_fn = keras.losses.SparseCategoricalCrossentropy(
+                from_logits=trainer.num_classes > LARGE_VOCABULARY_THRESHOLD, reduction='none')
+            metrics = {
+                'loss': keras.metrics.Mean(),
+                'accuracy': keras.metrics.SparseCategoricalAccuracy(),
+                'val_loss': keras.metrics.Mean(),
+                'val_accuracy': keras.metrics.SparseCategoricalAccuracy(),
+            }
+
+    # A custom loop rather than model.fit: Keras 3's fit cannot build the model
+    # under MultiWorkerMirroredStrategy, and strategy.run works with both Keras versions
+    @tf.function
+    def train_step(iterator):
+        def step(images, labels):
+            with tf.GradientTape() as tape:
+                predictions = model(images, training=True)
+                loss = tf.nn.compute_average_loss(loss_fn(labels, predictions),
+                                                  global_batch_size=global_batch_size)
+            gradients = tape.gradient(loss, model.trainable_variables)
+            optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+            metrics['accuracy'].update_state(labels, predictions)
+            return loss
+
+        loss = strategy.reduce('SUM', strategy.run(step, args=next(iterator)), axis=None)
+        metrics['loss'].update_state(loss)
+
+    @tf.function
+    def validation_step(iterator):
+        def step(images, labels):
+            predictions = model(images, training=False)
+            metrics['val_accuracy'].update_state(labels, predictions)
+            return tf.nn.compute_average_loss(loss_fn(labels, predictions),
+                                              global_batch_size=global_batch_size)
+
+        loss = strategy.reduce('SUM', strategy.run(step, args=next(iterator)), axis=None)
+        metrics['val_loss'].update_state(loss)
+
+    run.record('num_workers', num_workers)
+    run.record('worker_index', worker_index)
+    run.record('global_batch_size', global_batch_size)
+    run.record('steps_per_epoch', steps_per_epoch)
+
+    history = {name: [] for name in metrics}
+    with run.phase('train'):
+        train_iterator = worker_iterator('train', shuffle=True)
+        validation_iterator = worker_iterator('validation', shuffle=False)
+        for epoch in range(epochs):
+            for metric in metrics.values():
+                metric.reset_state()
+
+            epoch_start = time.perf_counter()
+            for _ in range(steps_per_epoch):
+                train_step(train_iterator)
+            train_seconds = time.perf_counter() - epoch_start
+            for _ in range(validation_steps):
+                validation_step(validation_iterator)
+            epoch_seconds = time.perf_counter() - epoch_start
+
+            results = {name: float(metric.result()) for name, metric in metrics.items()}
+            for name, value in results.items():
+                history[name].append(value)
+            run.epochs.append({
+                'epoch': epoch + 1,
+                'epoch_seconds': epoch_seconds,
+                'train_seconds': train_seconds,
+                'validation_seconds': epoch_seconds - train_seconds,
+                'steps': steps_per_epoch,
+                'samples_per_second': steps_per_epoch * global_batch_size / train_seconds,
+                'metrics': results,
+            })
+            if is_chief:
+                print(f"Epoch {epoch + 1}/{epochs} - {train_seconds:.1f}s - "
+                      + ' - '.join(f"{name}: {value:.4f}" for name, value in results.items()),
+                      flush=True)
+
+    # Saving reads mirrored variables, so every worker saves; only the chief's copy is kept
+    save_dir = os.path.dirname(os.path.abspath(model_path)) if is_chief else tempfile.mkdtemp()
+    model.save(os.path.join(save_dir, os.path.basename(model_path)))
+    if not is_chief:
+        shutil.rmtree(save_dir, ignore_errors=True)
+
+    run.record('final_metrics', {name: values[-1] for name, values in history.items() if values})
+    run.write_report()
+    return history
+
+
+def launch_local(num_workers, worker_argv, threads_per_worker=None, report_dir='.'):
+    """Run num_workers worker processes on this machine and wait for all of them"""
+    ports = free_ports(num_workers)
+    processes = []
+    for index in range(num_workers):
+        env = dict(os.environ, TF_CONFIG=json.dumps(local_tf_config(ports, index)))
+        if threads_per_worker:
+            # Each local worker stands in for one host with its own cores
+            env['OMP_NUM_THREADS'] = str(threads_per_worker)
+            env['TF_NUM_INTRAOP_THREADS'] = str(threads_per_worker)
+            env['TF_NUM_INTEROP_THREADS'] = '2'
+        env.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+        command = [sys.executable, os.path.abspath(__file__), '--worker',
+                   '--report-dir', report_dir] + worker_argv
+        processes.append(subprocess.Popen(command, env=env))
+
+    codes = [process.wait() for process in processes]
+    return max(codes, key=abs)
+
+
+def epoch_seconds(report_path):
+    """Median epoch time of a worker report, ignoring the first (tracing) epoch"""
+    with open(report_path, 'r', encoding='utf-8') as f:
+        epochs = json.load(f)['epochs']
+    times = sorted(e['train_seconds'] for e in (epochs[1:] or epochs))
+    return times[len(times) // 2]
+
+
+def scaling_report(worker_counts, worker_argv, threads_per_worker, output_dir='scaling'):
+    """Epoch time for each worker count, with speedup and efficiency against the smallest"""
+    results = []
+    for num_workers in worker_counts:
+        report_dir = os.path.join(output_dir, f'workers_{num_workers}')
+        os.makedirs(report_dir, exist_ok=True)
+        print(f"\nTraining with {num_workers} worker(s)...")
+        start = time.perf_counter()
+        code = launch_local(num_workers, worker_argv, threads_per_worker, report_dir)
+        if code != 0:
+            print(f"❌ Run with {num_workers} worker(s) failed with exit code {code}")
+            return None
+        results.append({
+            'workers': num_workers,
+            'epoch_seconds': epoch_seconds(os.path.join(report_dir, 'run_report.worker0.json')),
+            'wall_seconds': time.perf_counter() - start,
+        })
+
+    base = results[0]
+    for result in results:
+        result['speedup'] = base['epoch_seconds'] / result['epoch_seconds']
+        result['efficiency'] = result['speedup'] * base['workers'] / result['workers']
+
+    report = {'threads_per_worker': threads_per_worker, 'cpu_count': os.cpu_count(), 'runs': results}
+    report_path = os.path.join(output_dir, 'scaling_report.json')
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{'workers':>8} {'epoch s':>9} {'speedup':>8} {'efficiency':>10}")
+    for result in results:
+        print(f"{result['workers']:>8} {result['epoch_seconds']:>9.2f} "
+              f"{result['speedup']:>8.2f} {result['efficiency']:>10.0%}")
+    if threads_per_worker * max(worker_counts) > (os.cpu_count() or 1):
+        print("⚠️  More worker threads than CPUs: local workers compete for cores and cannot scale")
+    print(f"📁 Scaling report saved to {report_path}")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Multi-worker data-parallel training from shards")
+    parser.add_argument('--data', default='dataset_shards', help="Sharded dataset directory")
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=32, help="Per-worker batch size")
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--hyperparameters', help="JSON file, e.g. best_hyperparameters.json from a sweep")
+    parser.add_argument('--workers', type=int, default=2, help="Local worker processes to launch")
+    parser.add_argument('--threads-per-worker', type=int, default=None)
+    parser.add_argument('--scaling', help="Comma-separated worker counts to compare, e.g. 1,2,4")
+    parser.add_argument('--output', default='japanese_character_model.tflite')
+    parser.add_argument('--worker', action='store_true', help="Run as one worker of TF_CONFIG's cluster")
+    parser.add_argument('--report-dir', default='.')
+    args = parser.parse_args(argv)
+
+    hyperparameters = None
+    if args.hyperparameters:
+        with open(args.hyperparameters, 'r', encoding='utf-8') as f:
+            hyperparameters = json.load(f)
+
+    if args.worker:
+        run_worker(args.data, args.epochs, args.batch_size, model_path=args.model,
+                   report_dir=args.report_dir, hyperparameters=hyperparameters)
+        return 0
+
+    worker_argv = ['--data', args.data, '--epochs', str(args.epochs),
+                   '--batch-size', str(args.batch_size), '--model', args.model]
+    if args.hyperparameters:
+        worker_argv += ['--hyperparameters', args.hyperparameters]
+
+    if args.scaling:
+        worker_counts = [int(n) for n in args.scaling.split(',')]
+        threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // max(worker_counts))
+        return 0 if scaling_report(worker_counts, worker_argv, threads) else 1
+
+    threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // args.workers)
+    code = launch_local(args.workers, worker_argv, threads)
+    if code != 0:
+        print(f"❌ Distributed training failed with exit code {code}")
+        return 1
+
+    from sharded_dataset import ShardedDataset
+    from train_japanese_model import JapaneseCharacterTrainer
+
+    trainer = JapaneseCharacterTrainer()
+    trainer.use_labels(ShardedDataset(args.data).labels)
+    trainer.convert_to_tflite(args.output, model_path=args.model)
+    print(f"\n✅ Trained on {args.workers} workers, TensorFlow Lite model saved to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Embedding Nearest-Neighbour Index for Japanese Character Recognition
+Uses the CNN's penultimate Dense(256) layer as an embedding and matches
+against class prototypes, so new characters or a user's handwriting style
+can be enrolled from a few samples without retraining
+"""
+
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+
+def build_embedding_model(model, units=256):
+    """Keras model that outputs the last hidden Dense(units) layer of a classifier"""
+    from tensorflow import keras
+
+    dense_layers = [layer for layer in model.layers[:-1]
+                    if isinstance(layer, keras.layers.Dense) and layer.units == units]
+    if not dense_layers:
+        raise ValueError(f"Model has no hidden Dense({units}) layer to use as embedding")
+
+    return keras.Model(inputs=model.inputs, outputs=dense_layers[-1].output)
+
+
+def compute_embeddings(embedding_model, images, batch_size=256):
+    """Embeddings for a float32 image batch (N, H, W, 1), computed in chunks"""
+    return np.concatenate([
+        np.asarray(embedding_model.predict_on_batch(images[start:start + batch_size]))
+        for start in range(0, len(images), batch_size)
+    ]).astype(np.float32)
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+class PrototypeIndex:
+    """Brute-force cosine search over float16 or int8 prototype vectors"""
+
+    def __init__(self, dim, dtype='float16', capacity=256):
+        if dtype not in ('float16', 'int8'):
+            raise ValueError("dtype must be 'float16' or 'int8'")
+        self.dim = dim
+        self.dtype = dtype
+        self.size = 0
+        self.vectors = np.zeros((capacity, dim), dtype=np.dtype(dtype))
+        # Per-vector dequantization scale (1.0 for float16)
+        self.scales = np.ones(capacity, dtype=np.float32)
+        self.label_ids = np.zeros(capacity, dtype=np.int32)
+        self.labels = []
+        self.label_to_id = {}
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self, needed):
+        capacity = len(self.vectors)
+        if self.size + needed <= capacity:
+            return
+        capacity = max(capacity * 2, self.size + needed)
+        self.vectors = np.resize(self.vectors, (capacity, self.dim))
+        self.scales = np.resize(self.scales, capacity)
+        self.label_ids = np.resize(self.label_ids, capacity)
+
+    def _encode(self, vectors):
+        vectors = normalize(vectors)
+        if self.dtype == 'float16':
+            return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+        # Symmetric per-vector int8 quantization
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales = np.maximum(scales, 1e-12)
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    def add(self, label, vectors):
+        """Add one or more prototype vectors for a label"""
+        vectors = np.atleast_2d(vectors)
+        if label not in self.label_to_id:
+            self.label_to_id[label] = len(self.labels)
+            self.labels.append(label)
+
+        encoded, scales = self._encode(vectors)
+        self._grow(len(encoded))
+        self.vectors[self.size:self.size + len(encoded)] = encoded
+        self.scales[self.size:self.size + len(encoded)] = scales
+        self.label_ids[self.size:self.size + len(encoded)] = self.label_to_id[label]
+        self.size += len(encoded)
+
+    def enroll(self, label, embeddings):
+        """Enroll a label from a few sample embeddings as one mean prototype"""
+        self.add(label, normalize(embeddings).mean(axis=0))
+
+    def scores(self, queries, rows=None):
+        """Cosine similarity of each query to the stored prototypes (or a subset)"""
+        rows = slice(0, self.size) if rows is None else rows
+        vectors = self.vectors[rows].astype(np.float32)
+        return (normalize(queries) @ vectors.T) * self.scales[rows]
+
+    def search(self, queries, k=5):
+        """Top-k labels per query, using each label's best-matching prototype"""
+        return self._rank(self.scores(np.atleast_2d(queries)), self.label_ids[:self.size], k)
+
+    def _rank(self, scores, label_ids, k):
+        # Best score per label
+        per_label = np.full((len(scores), len(self.labels)), -np.inf, dtype=np.float32)
+        if len(np.unique(label_ids)) == len(label_ids):
+            # One prototype per label: a plain scatter is enough
+            per_label[:, label_ids] = scores
+        else:
+            np.maximum.at(per_label, (np.arange(len(scores))[:, None], label_ids[None, :]), scores)
+
+        k = min(k, len(self.labels))
+        best = np.argpartition(-per_label, k - 1, axis=1)[:, :k]
+        best = np.take_along_axis(best, np.argsort(-np.take_along_axis(per_label, best, axis=1), axis=1), axis=1)
+        return [[(self.labels[i], float(row[i])) for i in indices if np.isfinite(row[i])]
+                for row, indices in zip(per_label, best)]
+
+    def save(self, path):
+        np.savez_compressed(
+            path,
+            vectors=self.vectors[:self.size],
+            scales=self.scales[:self.size],
+            label_ids=self.label_ids[:self.size],
+            labels=np.array(self.labels),
+            dtype=np.array(self.dtype),
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path, allow_pickle=False)
+        index = cls(data['vectors'].shape[1], str(data['dtype']), capacity=max(len(data['vectors']), 1))
+        index.size = len(data['vectors'])
+        index.vectors[:index.size] = data['vectors']
+        index.scales[:index.size] = data['scales']
+        index.label_ids[:index.size] = data['label_ids']
+        index.labels = [str(label) for label in data['labels']]
+        index.label_to_id = {label: i for i, label in enumerate(index.labels)}
+        return index
+
+
+class IVFIndex:
+    """Approximate search for large class counts: k-means cells, probe the nearest few"""
+
+    def __init__(self, prototype_index, num_cells=64, num_probes=4, iterations=10, seed=42):
+        self.index = prototype_index
+        self.num_probes = num_probes
+        vectors = normalize(prototype_index.vectors[:prototype_index.size].astype(np.float32)
+                            * prototype_index.scales[:prototype_index.size, None])
+        num_cells = min(num_cells, len(vectors))
+
+        # Spherical k-means
+        rng = np.random.default_rng(seed)
+        self.centroids = vectors[rng.choice(len(vectors), num_cells, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+            for cell in range(num_cells):
+                members = vectors[assignment == cell]
+                if len(members):
+                    self.centroids[cell] = normalize(members.mean(axis=0))
+
+        assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+        self.cells = [np.where(assignment == cell)[0] for cell in range(num_cells)]
+
+    def search(self, queries, k=5):
+        queries = np.atleast_2d(queries)
+        probes = np.argsort(-(normalize(queries) @ self.centroids.T), axis=1)[:, :self.num_probes]
+
+        results = []
+        for query, cells in zip(queries, probes):
+            rows = np.concatenate([self.cells[cell] for cell in cells])
+            scores = self.index.scores(query[None], rows)
+            results.extend(self.index._rank(scores, self.index.label_ids[rows], k))
+        return results
+
+
+def build_class_index(embeddings, labels, dtype='float16'):
+    """One mean prototype per class"""
+    labels = np.asarray(labels)
+    index = PrototypeIndex(embeddings.shape[1], dtype)
+    for label in dict.fromkeys(labels.tolist()):
+        index.enroll(label, embeddings[labels == label])
+    return index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or extend an embedding prototype index")
+    parser.add_argument('--model', default='best_model.h5')
+    parser.add_argument('--data', default='training_data_export.json')
+    parser.add_argument('--enroll', metavar='EXPORT_JSON',
+                        help="Add the characters in this export to an existing index")
+    parser.add_argument('--index', default='prototype_index.npz')
+    parser.add_argument('--dtype', choices=['float16', 'int8'], default='float16')
+    args = parser.parse_args(argv)
+
+    from tensorflow import keras
+    from preprocessing import decode_image_data, to_model_input
+
+    embedding_model = build_embedding_model(keras.models.load_model(args.model))
+
+    def load(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)['data']
+        images = to_model_input(np.stack([decode_image_data(e['imageData']) for e in entries]))
+        return compute_embeddings(embedding_model, images), [e['character'] for e in entries]
+
+    if args.enroll:
+        index = PrototypeIndex.load(args.index)
+        embeddings, characters = load(args.enroll)
+        start = time.perf_counter()
+        for character in dict.fromkeys(characters):
+            index.enroll(character, embeddings[np.array(characters) == character])
+        print(f"✅ Enrolled {len(set(characters))} characters in "
+              f"{(time.perf_counter() - start) * 1000:.2f} ms")
+    else:
+        embeddings, characters = load(args.data)
+        index = build_class_index(embeddings, characters, args.dtype)
+
+        # Nearest-prototype accuracy on the same data as a sanity check
+        predicted = [result[0][0] for result in index.search(embeddings, k=1)]
+        accuracy = np.mean(np.array(predicted) == np.array(characters))
+        print(f"📊 Nearest-prototype accuracy: {accuracy:.4f} over {len(characters)} samples")
+
+    index.save(args.index)
+    print(f"📁 Index with {len(index.labels)} labels saved to {args.index}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Parallel Evaluation of the Shipped TensorFlow Lite Model
+Streams fixed-size batches from an export, a sharded dataset or in-memory arrays
+through a pool of interpreters and accumulates the confusion matrix as it goes
+
+Measures the .tflite file users actually get (quantization included) rather
+than the Keras checkpoint, with memory bounded by the batches in flight.
+
+Examples:
+    python evaluate_tflite.py --model japanese_character_model.tflite --data training_data_export.json
+    python evaluate_tflite.py --model japanese_character_model.tflite --data dataset_shards --workers 8
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from inference import load_predictor, load_labels
+from preprocessing import decode_sample, to_model_input, packed_to_model_input
+
+
+class StreamingMetrics:
+    """Confusion matrix and top-k hits updated one batch at a time"""
+
+    def __init__(self, num_classes, k=5):
+        self.num_classes = num_classes
+        self.k = k
+        self.confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+        self.top_k_hits = 0
+        # Predictions outside the label list (top-k models without a labels file) count as errors
+        self.unmapped = np.zeros(num_classes, dtype=np.int64)
+        # Targets the model has no output for are left out of every metric
+        self.out_of_range = 0
+
+    def update(self, labels, top_classes):
+        labels = np.asarray(labels, dtype=np.int64)
+        in_range = (labels >= 0) & (labels < self.num_classes)
+        self.out_of_range += int((~in_range).sum())
+        labels, top_classes = labels[in_range], top_classes[in_range]
+        predicted = top_classes[:, 0].astype(np.int64)
+        known = predicted < self.num_classes
+        # One bincount per batch instead of a Python loop over samples
+        self.confusion += np.bincount(labels[known] * self.num_classes + predicted[known],
+                                      minlength=self.num_classes ** 2).reshape(self.confusion.shape)
+        self.unmapped += np.bincount(labels[~known], minlength=self.num_classes)
+        self.top_k_hits += int((top_classes == labels[:, None]).any(axis=1).sum())
+
+    @property
+    def total(self):
+        return int(self.confusion.sum() + self.unmapped.sum())
+
+    @property
+    def accuracy(self):
+        return np.trace(self.confusion) / max(self.total, 1)
+
+    def per_class(self):
+        """Precision, recall, F1 and support per class index"""
+        correct = np.diag(self.confusion).astype(np.float64)
+        support = self.confusion.sum(axis=1) + self.unmapped
+        predicted = self.confusion.sum(axis=0)
+        precision = np.divide(correct, predicted, out=np.zeros_like(correct), where=predicted > 0)
+        recall = np.divide(correct, support, out=np.zeros_like(correct), where=support > 0)
+        f1 = np.divide(2 * precision * recall, precision + recall,
+                       out=np.zeros_like(correct), where=(precision + recall) > 0)
+        return precision, recall, f1, support
+
+
+def iter_batches(source, batch_size, labels, split='validation', validation_split=0.2):
+    """Yield (raw batch, labels, kind) from an export path, a shard directory or (X, y) arrays
+
+    Decoding is left to the pool workers, so the producer only reads.
+    """
+    if isinstance(source, tuple):
+        X, y = source
+        for start in range(0, len(X), batch_size):
+            yield X[start:start + batch_size], y[start:start + batch_size], 'float'
+        return
+
+    if os.path.isdir(source):
+        from sharded_dataset import ShardedDataset
+        dataset = ShardedDataset(source)
+        stream = dataset.stream(split, validation_split) if split != 'all' else \
+            (pair for s in ('train', 'validation') for pair in dataset.stream(s, validation_split))
+        kind = 'packed' if dataset.packed else 'uint8'
+        # Shard label ids index the dataset's own label list, not necessarily the model's
+        character_to_index = {char: i for i, char in enumerate(labels)}
+        remap = np.array([character_to_index.get(char, -1) for char in dataset.labels])
+        images, targets = [], []
+        for image, label in stream:
+            if remap[label] < 0:
+                continue
+            images.append(image)
+            targets.append(remap[label])
+            if len(images) == batch_size:
+                yield np.stack(images), np.array(targets), kind
+                images, targets = [], []
+        if images:
+            yield np.stack(images), np.array(targets), kind
+        return
+
+    from sharded_dataset import iter_export_entries
+    character_to_index = {char: i for i, char in enumerate(labels)}
+    entries, targets = [], []
+    for entry in iter_export_entries(source):
+        label = character_to_index.get(entry.get('character'))
+        if label is None:
+            continue
+        entries.append(entry)
+        targets.append(label)
+        if len(entries) == batch_size:
+            yield entries, np.array(targets), 'entries'
+            entries, targets = [], []
+    if entries:
+        yield entries, np.array(targets), 'entries'
+
+
+def _to_model_input(batch, kind, input_size):
+    if kind == 'float':
+        return np.asarray(batch, dtype=np.float32).reshape(-1, input_size, input_size, 1)
+    if kind == 'packed':
+        return packed_to_model_input(batch, input_size)
+    if kind == 'uint8':
+        return to_model_input(batch)
+    # Export entries; undecodable samples become blank images so labels stay aligned
+    images = np.full((len(batch), input_size, input_size), 255, dtype=np.uint8)
+    for i, entry in enumerate(batch):
+        try:
+            images[i] = decode_sample(entry, input_size)
+        except Exception:
+            pass
+    return to_model_input(images)
+
+
+def evaluate_tflite(model_path, source, batch_size=256, workers=None, num_threads=1, k=5,
+                    labels_path=None, split='validation'):
+    """Accuracy, top-k accuracy, per-class metrics and throughput of a .tflite (or .onnx) model"""
+    workers = workers or os.cpu_count() or 1
+    local = threading.local()
+
+    def predictor():
+        # Interpreters are not thread-safe: one per pool thread
+        if not hasattr(local, 'predictor'):
+            local.predictor = load_predictor(model_path, num_threads=num_threads)
+        return local.predictor
+
+    probe = load_predictor(model_path)
+    input_size = probe.input_shape[0]
+    if labels_path is None:
+        candidate = os.path.join(os.path.dirname(os.path.abspath(model_path)), 'japanese_character_labels.txt')
+        labels_path = candidate if os.path.exists(candidate) else None
+    labels = load_labels(labels_path, probe.num_classes, model_path)
+    num_classes = probe.num_classes or len(labels)
+    # A 92-line labels file next to a 46-output model: characters past the outputs can't be scored
+    labels = labels[:num_classes]
+    k = min(k, num_classes)
+    metrics = StreamingMetrics(num_classes, k)
+
+    def run(batch, kind):
+        start = time.perf_counter()
+        images = _to_model_input(batch, kind, input_size)
+        _, classes = predictor().predict_top_k(images, k)
+        return classes, time.perf_counter() - start
+
+    start = time.perf_counter()
+    busy_seconds = 0.0
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tflite-eval') as executor:
+        for batch, targets, kind in iter_batches(source, batch_size, labels, split):
+            pending.append((executor.submit(run, batch, kind), targets))
+            # Bounded in-flight batches keep memory flat on large eval sets
+            while len(pending) > 2 * workers:
+                future, batch_targets = pending.popleft()
+                classes, seconds = future.result()
+                metrics.update(batch_targets, classes)
+                busy_seconds += seconds
+        while pending:
+            future, batch_targets = pending.popleft()
+            classes, seconds = future.result()
+            metrics.update(batch_targets, classes)
+            busy_seconds += seconds
+    wall_seconds = time.perf_counter() - start
+
+    precision, recall, f1, support = metrics.per_class()
+    present = support > 0
+    worst = np.argsort(np.where(present, recall, np.inf))[:10]
+    report = {
+        'model': model_path,
+        'samples': metrics.total,
+        'out_of_range': metrics.out_of_range,
+        'accuracy': float(metrics.accuracy),
+        f'top{k}_accuracy': metrics.top_k_hits / max(metrics.total, 1),
+        'macro_f1': float(f1[present].mean()) if present.any() else 0.0,
+        'samples_per_second': metrics.total / wall_seconds if wall_seconds > 0 else None,
+        'wall_seconds': wall_seconds,
+        'worker_busy_seconds': busy_seconds,
+        'workers': workers,
+        'batch_size': batch_size,
+        'per_class': {
+            labels[i] if i < len(labels) else str(i): {
+                'precision': float(precision[i]),
+                'recall': float(recall[i]),
+                'f1': float(f1[i]),
+                'support': int(support[i]),
+            } for i in np.flatnonzero(present)
+        },
+        'worst_classes': [labels[i] if i < len(labels) else str(i) for i in worst if present[i]],
+    }
+
+    print(f"TFLite accuracy: {report['accuracy']:.4f} (top-{k}: {report[f'top{k}_accuracy']:.4f}, "
+          f"macro F1: {report['macro_f1']:.4f}) on {metrics.total} samples")
+    if metrics.out_of_range:
+        print(f"⚠️ {metrics.out_of_range} samples with labels beyond the model's {num_classes} outputs were skipped")
+    print(f"Throughput: {report['samples_per_second']:.0f} samples/s with {workers} interpreters "
+          f"({wall_seconds:.2f}s)")
+    return report, metrics.confusion
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate a .tflite model with a pool of interpreters")
+    parser.add_argument('--model', default='japanese_character_model.tflite')
+    parser.add_argument('--data', default='training_data_export.json',
+                        help="Export JSON file or sharded dataset directory")
+    parser.add_argument('--labels', help="Labels file (default: next to the model, else built-in)")
+    parser.add_argument('--split', choices=['train', 'validation', 'all'], default='validation',
+                        help="Split of a sharded dataset")
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=None, help="Interpreters (default: CPU count)")
+    parser.add_argument('--threads', type=int, default=1, help="Threads per interpreter")
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--report', help="Write the report as JSON")
+    parser.add_argument('--min-accuracy', type=float, default=0.0,
+                        help="Exit with status 1 below this accuracy")
+    args = parser.parse_args(argv)
+
+    report, _ = evaluate_tflite(args.model, args.data, args.batch_size, args.workers, args.threads,
+                                args.top_k, args.labels, args.split)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"📁 Report saved to {args.report}")
+    if report['worst_classes']:
+        print(f"Lowest recall: {' '.join(report['worst_classes'])}")
+    return 0 if report['accuracy'] >= args.min_accuracy else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Hard-Example Mining for Japanese Character Recognition
+Oversamples hard or misrecognized samples and drops trivially easy ones
+"""
+
+import math
+import numpy as np
+from tensorflow import keras
+
+from inference import is_logits_model, softmax
+
+
+class HardExampleSampler:
+    """Keeps one sampling weight per training sample and updates it every epoch"""
+
+    def __init__(self, is_correct, accuracy_scores, stroke_counts,
+                 expected_stroke_counts=None, misrecognized_boost=2.0,
+                 loss_exponent=1.0, easy_loss_threshold=0.01,
+                 easy_keep_probability=0.1, loss_momentum=0.5, seed=42, sample_weights=None):
+        self.num_samples = len(is_correct)
+        self.loss_exponent = loss_exponent
+        self.easy_loss_threshold = easy_loss_threshold
+        self.easy_keep_probability = easy_keep_probability
+        self.loss_momentum = loss_momentum
+        self.rng = np.random.default_rng(seed)
+
+        # Static prior from the export fields
+        self.prior = self.compute_prior(
+            is_correct, accuracy_scores, stroke_counts,
+            expected_stroke_counts, misrecognized_boost
+        )
+        # Near-duplicates (dedup.py --mode weight) share one sample's worth of weight
+        if sample_weights is not None:
+            self.prior *= np.asarray(sample_weights, dtype=np.float32)
+
+        # Compact per-sample state
+        self.losses = np.full(self.num_samples, np.nan, dtype=np.float16)
+        self.weights = self.prior.copy()
+
+    @staticmethod
+    def compute_prior(is_correct, accuracy_scores, stroke_counts,
+                      expected_stroke_counts=None, misrecognized_boost=2.0):
+        """Prior weight from isCorrect, accuracyScore and strokeCount"""
+        is_correct = np.asarray(is_correct, dtype=bool)
+        accuracy = np.asarray(accuracy_scores, dtype=np.float32)
+        accuracy = np.nan_to_num(accuracy, nan=100.0)
+
+        prior = np.ones(len(is_correct), dtype=np.float32)
+
+        # Misrecognized attempts are the most informative samples
+        prior[~is_correct] *= misrecognized_boost
+
+        # Low accuracy scores (0-100) get up to twice the weight
+        prior *= 1.0 + (100.0 - np.clip(accuracy, 0.0, 100.0)) / 100.0
+
+        # Wrong stroke count usually means a malformed character
+        if expected_stroke_counts is not None:
+            strokes = np.asarray(stroke_counts, dtype=np.float32)
+            expected = np.asarray(expected_stroke_counts, dtype=np.float32)
+            # 0 means unknown (missing export field or no reference)
+            prior[(strokes != expected) & (strokes > 0) & (expected > 0)] *= 1.5
+
+        return prior
+
+    def update(self, losses):
+        """Update weights from per-sample losses of the previous epoch"""
+        losses = np.asarray(losses, dtype=np.float32)
+        previous = self.losses.astype(np.float32)
+
+        # Smooth losses across epochs so one noisy epoch doesn't dominate
+        smoothed = np.where(
+            np.isnan(previous),
+            losses,
+            self.loss_momentum * previous + (1.0 - self.loss_momentum) * losses
+        )
+        self.losses = smoothed.astype(np.float16)
+
+        weights = self.prior * np.power(smoothed + 1e-3, self.loss_exponent)
+
+        # Drop most of the trivially easy samples
+        easy = smoothed < self.easy_loss_threshold
+        keep = self.rng.random(self.num_samples) < self.easy_keep_probability
+        weights[easy & ~keep] = 0.0
+
+        if weights.sum() <= 0:
+            weights = self.prior.copy()
+
+        self.weights = weights.astype(np.float32)
+        return self.weights
+
+    def sample_indices(self, num_draws=None):
+        """Draw sample indices proportionally to the current weights"""
+        if num_draws is None:
+            num_draws = self.num_samples
+        probabilities = self.weights / self.weights.sum()
+        return self.rng.choice(self.num_samples, size=num_draws, p=probabilities)
+
+    def summary(self):
+        """Return a short description of the current weight distribution"""
+        active = self.weights > 0
+        losses = self.losses.astype(np.float32)
+        return {
+            'active_samples': int(active.sum()),
+            'dropped_samples': int((~active).sum()),
+            'max_weight': float(self.weights.max()),
+            'mean_loss': float(np.nanmean(losses)) if not np.isnan(losses).all() else float('nan'),
+        }
+
+
+class HardExampleSequence(keras.utils.Sequence):
+    """Batches drawn from the sampler, resampled after every epoch"""
+
+    def __init__(self, X, y, sampler, batch_size=32, datagen=None):
+        super().__init__()
+        self.X = X
+        self.y = y
+        self.sampler = sampler
+        self.batch_size = batch_size
+        self.datagen = datagen
+        self.indices = sampler.sample_indices()
+
+    def __len__(self):
+        return math.ceil(len(self.indices) / self.batch_size)
+
+    def __getitem__(self, batch_index):
+        batch = np.sort(self.indices[batch_index * self.batch_size:(batch_index + 1) * self.batch_size])
+        X_batch = self.X[batch].astype(np.float32)
+        if self.datagen is not None:
+            X_batch = np.stack([self.datagen.random_transform(x) for x in X_batch])
+        return X_batch, self.y[batch]
+
+    def on_epoch_end(self):
+        self.indices = self.sampler.sample_indices()
+
+
+class HardExampleMiningCallback(keras.callbacks.Callback):
+    """Computes per-sample training loss at the end of each epoch"""
+
+    def __init__(self, X, y, sampler, batch_size=256, verbose=1):
+        super().__init__()
+        self.X = X
+        self.y = y
+        self.sampler = sampler
+        self.batch_size = batch_size
+        self.verbose = verbose
+
+    def on_epoch_end(self, epoch, logs=None):
+        from_logits = is_logits_model(self.model)
+        losses = np.empty(len(self.X), dtype=np.float32)
+        for start in range(0, len(self.X), self.batch_size):
+            end = start + self.batch_size
+            probabilities = self.model(self.X[start:end], training=False).numpy()
+            if from_logits:
+                probabilities = softmax(probabilities)
+            true_probabilities = probabilities[np.arange(len(probabilities)), self.y[start:end]]
+            losses[start:end] = -np.log(np.clip(true_probabilities, 1e-7, 1.0))
+
+        self.sampler.update(losses)
+
+        if self.verbose:
+            summary = self.sampler.summary()
+            print(f"\nHard-example mining: {summary['active_samples']} active, "
+                  f"{summary['dropped_samples']} dropped, mean loss {summary['mean_loss']:.4f}")
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Inference Backends for Japanese Character Recognition
+Common predict() interface over TensorFlow Lite, Keras and ONNX Runtime models
+"""
+
+import os
+import numpy as np
+
+from characters import ALL_KANA, HIRAGANA
+
+
+def load_labels(labels_path=None, num_classes=None, model_path=None):
+    """Labels embedded in a bundled .tflite model (model_bundle.py), else a labels
+    file, else the built-in label list matching the output size"""
+    if model_path and model_path.endswith('.tflite'):
+        from model_bundle import read_bundle_spec
+        spec = read_bundle_spec(model_path)
+        if spec is not None:
+            return spec['labels']
+    if labels_path and os.path.exists(labels_path):
+        with open(labels_path, 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip()]
+    if num_classes == len(HIRAGANA):
+        return list(HIRAGANA)
+    return list(ALL_KANA)[:num_classes] if num_classes else list(ALL_KANA)
+
+
+def is_logits_model(model):
+    """True when a Keras classifier ends in a linear layer (large-vocabulary models)"""
+    return model.layers[-1].get_config().get('activation') == 'linear'
+
+
+def softmax(logits):
+    shifted = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+class TFLitePredictor:
+    """Batched predictions from a .tflite model (one interpreter, not thread-safe)"""
+
+    def __init__(self, model_path, num_threads=1):
+        import tensorflow as tf
+
+        self.model_path = model_path
+        self.interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._read_details()
+        self.batch_size = int(self.input_details['shape'][0])
+        self.input_shape = tuple(int(d) for d in self.input_details['shape'][1:])
+        # Top-k models (convert_to_tflite(top_k=...)) output scores and class ids only
+        self.top_k_output = self.classes_details is not None
+        self.num_classes = None if self.top_k_output else int(self.output_details['shape'][-1])
+
+    def _read_details(self):
+        self.input_details = self.interpreter.get_input_details()[0]
+        outputs = self.interpreter.get_output_details()
+        self.classes_details = next((d for d in outputs if d['dtype'] == np.int32), None)
+        self.output_details = next(d for d in outputs if d['dtype'] != np.int32)
+
+    def _resize(self, batch_size):
+        if batch_size != self.batch_size:
+            self.interpreter.resize_tensor_input(
+                self.input_details['index'], (batch_size,) + self.input_shape
+            )
+            self.interpreter.allocate_tensors()
+            self._read_details()
+            self.batch_size = batch_size
+
+    def _invoke(self, images):
+        images = np.asarray(images, dtype=np.float32)
+        self._resize(len(images))
+
+        # Quantize the input for integer models
+        scale, zero_point = self.input_details['quantization']
+        if self.input_details['dtype'] != np.float32 and scale:
+            images = np.round(images / scale + zero_point)
+        self.interpreter.set_tensor(self.input_details['index'],
+                                    images.astype(self.input_details['dtype']))
+        self.interpreter.invoke()
+
+        output = self.interpreter.get_tensor(self.output_details['index'])
+        scale, zero_point = self.output_details['quantization']
+        if self.output_details['dtype'] != np.float32 and scale:
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output.astype(np.float32)
+
+    def predict(self, images):
+        """Class probabilities for a float32 batch of shape (N, H, W, 1)"""
+        if self.top_k_output:
+            raise ValueError(f"{self.model_path} only outputs the top-k classes; use predict_top_k()")
+        return self._invoke(images)
+
+    def predict_top_k(self, images, k=5):
+        """(scores, class indices) of the k most likely classes per sample"""
+        if not self.top_k_output:
+            return top_k_indices(self.predict(images), k)
+        scores = self._invoke(images)
+        classes = self.interpreter.get_tensor(self.classes_details['index'])
+        return scores[:, :k], classes[:, :k]
+
+
+class KerasPredictor:
+    """Batched predictions from a Keras .h5/.keras model"""
+
+    def __init__(self, model_path=None, model=None):
+        if model is None:
+            from tensorflow import keras
+            model = keras.models.load_model(model_path)
+        self.model_path = model_path
+        self.model = model
+        self.input_shape = tuple(model.input_shape[1:])
+        self.num_classes = int(model.output_shape[-1])
+        self.from_logits = is_logits_model(model)
+
+    def predict(self, images):
+        """Class probabilities for a float32 batch of shape (N, H, W, 1)"""
+        output = np.asarray(self.model.predict_on_batch(np.asarray(images, dtype=np.float32)))
+        return softmax(output) if self.from_logits else output
+
+    def predict_top_k(self, images, k=5):
+        """(scores, class indices) of the k most likely classes per sample"""
+        return top_k_indices(self.predict(images), k)
+
+
+class ONNXPredictor:
+    """Batched predictions from an .onnx model (see onnx_export.py) with ONNX Runtime"""
+
+    def __init__(self, model_path, num_threads=1):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("onnxruntime is required for .onnx models: pip install onnxruntime")
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+        self.model_path = model_path
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_shape = tuple(int(d) for d in model_input.shape[1:])
+        self.num_classes = int(self.session.get_outputs()[0].shape[-1])
+
+    def predict(self, images):
+        """Class probabilities for a float32 batch of shape (N, H, W, 1)"""
+        images = np.asarray(images, dtype=np.float32)
+        return self.session.run(None, {self.input_name: images})[0]
+
+    def predict_top_k(self, images, k=5):
+        """(scores, class indices) of the k most likely classes per sample"""
+        return top_k_indices(self.predict(images), k)
+
+
+def load_predictor(model_path, num_threads=1):
+    """Pick the backend from the model file extension"""
+    if model_path.endswith('.tflite'):
+        return TFLitePredictor(model_path, num_threads=num_threads)
+    if model_path.endswith('.onnx'):
+        return ONNXPredictor(model_path, num_threads=num_threads)
+    return KerasPredictor(model_path)
+
+
+def top_k_indices(probabilities, k=5):
+    """Scores and indices of the k largest values per row, best first"""
+    k = min(k, probabilities.shape[1])
+    best = np.argpartition(-probabilities, k - 1, axis=1)[:, :k]
+    scores = np.take_along_axis(probabilities, best, axis=1)
+    order = np.argsort(-scores, axis=1)
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(best, order, axis=1)
+
+
+def top_k(probabilities, labels, k=5):
+    """Top-k (label, confidence) pairs for each row of probabilities"""
+    scores, best = top_k_indices(probabilities, k)
+    return [
+        [{'character': labels[i] if i < len(labels) else str(i), 'confidence': float(score)}
+         for score, i in zip(row_scores, indices)]
+        for row_scores, indices in zip(scores, best)
+    ]
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Export Ingestion Daemon
+Watches an inbox directory for training exports from the app, decodes them in a
+worker pool and appends only the samples the dataset has not seen yet to a
+sharded dataset (sharded_dataset.py), then publishes a dataset-version event
+
+Samples are identified by a hash of their character, image (or strokes) and
+timestamp, so a re-export that repeats earlier samples only costs its new ones.
+Ingested exports move to <inbox>/processed, unreadable ones to <inbox>/failed.
+Every append that adds samples bumps the dataset version in index.json and adds a line to
+<dataset>/dataset_events.jsonl, which training jobs can follow with read_events().
+
+Examples:
+    python ingest.py --inbox inbox --dataset dataset_shards
+    python ingest.py --inbox inbox --dataset binary_shards --binarize --once
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import asyncio
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from preprocessing import INPUT_SIZE, INK_THRESHOLD, decode_sample
+from sharded_dataset import ShardWriter, iter_export_entries
+
+EVENTS_FILE = 'dataset_events.jsonl'
+SEEN_FILE = 'ingested_hashes.u64'
+LEGACY_SEEN_FILE = 'ingested_hashes.npy'
+
+
+def sample_hash(entry):
+    """64-bit identity of an export entry (character, image or strokes, timestamp)"""
+    digest = hashlib.blake2b(digest_size=8)
+    image = entry.get('imageData') or json.dumps(entry.get('strokes'), separators=(',', ':'))
+    for part in (entry.get('character'), image, entry.get('timestamp')):
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return int.from_bytes(digest.digest(), 'little')
+
+
+def _isin_sorted(sorted_values, values):
+    """np.isin against an already sorted array, by binary search"""
+    if len(sorted_values) == 0:
+        return np.zeros(len(values), dtype=bool)
+    positions = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+    return sorted_values[positions] == values
+
+
+class HashLog:
+    """Append-only file of ingested sample hashes with sorted in-memory lookup
+
+    New hashes are appended to the file and kept in a small sorted delta that is
+    merged into the main array only once it outgrows an eighth of it, so an
+    ingest costs about the size of its new data rather than of everything seen.
+    """
+
+    def __init__(self, dataset_dir):
+        self.path = os.path.join(dataset_dir, SEEN_FILE)
+        hashes = np.fromfile(self.path, dtype='<u8') if os.path.exists(self.path) else np.empty(0, dtype='<u8')
+        legacy_path = os.path.join(dataset_dir, LEGACY_SEEN_FILE)
+        if os.path.exists(legacy_path):
+            # Fold the old whole-array file into the log once
+            legacy = np.load(legacy_path).astype('<u8')
+            with open(self.path, 'ab') as f:
+                f.write(legacy.tobytes())
+            os.remove(legacy_path)
+            hashes = np.concatenate([hashes, legacy])
+        self.main = np.unique(hashes.astype(np.uint64))
+        self.delta = np.empty(0, dtype=np.uint64)
+
+    def __len__(self):
+        return len(self.main) + len(self.delta)
+
+    def contains(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        return _isin_sorted(self.main, hashes) | _isin_sorted(self.delta, hashes)
+
+    def add(self, hashes):
+        """Record hashes that are not in the log yet"""
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if len(hashes) == 0:
+            return
+        with open(self.path, 'ab') as f:
+            f.write(hashes.astype('<u8').tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self.delta = np.union1d(self.delta, hashes)
+        if len(self.delta) > max(4096, len(self.main) // 8):
+            self.main = np.union1d(self.main, self.delta)
+            self.delta = np.empty(0, dtype=np.uint64)
+
+
+def read_new_entries(export_path, seen, character_to_index):
+    """New entries of an export with their hashes, plus counts of what was left out
+
+    Entries already in the dataset (or earlier in the same export) are
+    duplicates; entries with a character outside the dataset labels are skipped.
+    """
+    entries, hashes = [], []
+    duplicates = skipped = 0
+    batch_seen = set()
+    for entry in iter_export_entries(export_path):
+        if entry.get('character') not in character_to_index:
+            skipped += 1
+            continue
+        value = sample_hash(entry)
+        if value in batch_seen:
+            duplicates += 1
+            continue
+        batch_seen.add(value)
+        entries.append(entry)
+        hashes.append(value)
+
+    hashes = np.array(hashes, dtype=np.uint64)
+    known = seen.contains(hashes)
+    duplicates += int(known.sum())
+    entries = [entry for entry, old in zip(entries, known) if not old]
+    return entries, hashes[~known], duplicates, skipped
+
+
+def _decode_chunk(args):
+    """Decode a chunk of entries in a worker: (uint8 images, labels, keep mask)"""
+    entries, character_to_index, input_size = args
+    images = np.zeros((len(entries), input_size, input_size), dtype=np.uint8)
+    labels = np.zeros(len(entries), dtype=np.int16)
+    keep = np.zeros(len(entries), dtype=bool)
+    for i, entry in enumerate(entries):
+        try:
+            images[i] = decode_sample(entry, input_size)
+        except Exception:
+            continue
+        labels[i] = character_to_index[entry['character']]
+        keep[i] = True
+    return images, labels, keep
+
+
+def read_events(dataset_dir, since_version=0):
+    """Dataset-version events newer than since_version, oldest first"""
+    path = os.path.join(dataset_dir, EVENTS_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    return [event for event in events if event['version'] > since_version]
+
+
+class Ingestor:
+    """Appends new samples of exports to one sharded dataset (single writer)"""
+
+    def __init__(self, dataset_dir, shard_size=65536, input_size=INPUT_SIZE, binarize_threshold=None,
+                 workers=None, chunk_size=512):
+        self.dataset_dir = dataset_dir
+        self.writer = ShardWriter(dataset_dir, shard_size=shard_size, input_size=input_size,
+                                  binarize_threshold=binarize_threshold)
+        self.input_size = self.writer.index['input_size']
+        self.character_to_index = {char: i for i, char in enumerate(self.writer.index['labels'])}
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.seen = HashLog(dataset_dir)
+
+    @property
+    def version(self):
+        return self.writer.index.get('version', 0)
+
+    async def ingest(self, export_path, pool):
+        """Append the new samples of one export; returns the published event (None if nothing was new)"""
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        entries, hashes, duplicates, skipped = await loop.run_in_executor(
+            None, read_new_entries, export_path, self.seen, self.character_to_index)
+
+        chunks = [entries[i:i + self.chunk_size] for i in range(0, len(entries), self.chunk_size)]
+        results = await asyncio.gather(*(
+            loop.run_in_executor(pool, _decode_chunk, (chunk, self.character_to_index, self.input_size))
+            for chunk in chunks
+        ))
+
+        if not entries:
+            print(f"📁 {os.path.basename(export_path)}: no new samples "
+                  f"({duplicates} duplicates, {skipped} skipped)")
+            return None
+        return await loop.run_in_executor(None, self._commit, export_path, results, hashes,
+                                          duplicates, skipped, time.perf_counter() - start)
+
+    def _commit(self, export_path, results, hashes, duplicates, skipped, elapsed):
+        """Write the decoded samples as new shards, then record their hashes and the new version"""
+        added = 0
+        for images, labels, keep in results:
+            for image, label in zip(images[keep], labels[keep]):
+                self.writer.append(image, label)
+            added += int(keep.sum())
+            skipped += int((~keep).sum())
+        self.writer.flush()
+
+        # Hashes of undecodable samples are kept too, so they are not retried on every re-export
+        self.seen.add(hashes)
+
+        if added == 0:
+            # Nothing reached the dataset: no new version for training jobs to react to
+            print(f"📁 {os.path.basename(export_path)}: no decodable new samples "
+                  f"({duplicates} duplicates, {skipped} skipped)")
+            return None
+
+        index = self.writer.index
+        index['version'] = self.version + 1
+        self.writer.write_index()
+
+        event = {
+            'event': 'dataset_version',
+            'version': index['version'],
+            'dataset': os.path.abspath(self.dataset_dir),
+            'source': os.path.basename(export_path),
+            'new_samples': added,
+            'duplicates': duplicates,
+            'skipped': skipped,
+            'total_samples': index['total_samples'],
+            'shards': len(index['shards']),
+            'seconds': round(elapsed, 3),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        with open(os.path.join(self.dataset_dir, EVENTS_FILE), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(event, ensure_ascii=False) + '\n')
+        print(f"✅ {event['source']}: +{added} samples → version {event['version']} "
+              f"({index['total_samples']} total, {duplicates} duplicates, {skipped} skipped, "
+              f"{elapsed:.1f}s)")
+        return event
+
+
+def _move(path, directory):
+    os.makedirs(directory, exist_ok=True)
+    shutil.move(path, os.path.join(directory, os.path.basename(path)))
+
+
+async def watch(inbox, ingestor, interval=5.0, once=False):
+    """Poll the inbox and ingest each export once its size has stopped changing"""
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    os.makedirs(inbox, exist_ok=True)
+    pending = {}  # path -> (size, mtime) at the previous poll
+    events = []
+    with ProcessPoolExecutor(ingestor.workers) as pool:
+        while not stop.is_set():
+            names = sorted(name for name in os.listdir(inbox) if name.endswith('.json'))
+            for name in names:
+                if stop.is_set():
+                    break
+                path = os.path.join(inbox, name)
+                stat = os.stat(path)
+                signature = (stat.st_size, stat.st_mtime)
+                # An export still being copied in changes between polls; wait for it to settle
+                if not once and pending.get(path) != signature:
+                    pending[path] = signature
+                    continue
+                pending.pop(path, None)
+                try:
+                    event = await ingestor.ingest(path, pool)
+                except Exception as e:  # a broken export must not stop the daemon
+                    print(f"❌ {name}: {e}")
+                    _move(path, os.path.join(inbox, 'failed'))
+                    continue
+                if event is not None:
+                    events.append(event)
+                _move(path, os.path.join(inbox, 'processed'))
+
+            if once:
+                break
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+    return events
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest new training exports into a sharded dataset")
+    parser.add_argument('--inbox', default='inbox', help="Directory the app exports are dropped into")
+    parser.add_argument('--dataset', default='dataset_shards')
+    parser.add_argument('--shard-size', type=int, default=65536)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--binarize', type=int, nargs='?', const=INK_THRESHOLD, default=None,
+                        metavar='THRESHOLD', help=f"Store 1-bit ink masks (default threshold {INK_THRESHOLD})")
+    parser.add_argument('--interval', type=float, default=5.0, help="Seconds between inbox polls")
+    parser.add_argument('--once', action='store_true', help="Ingest what is in the inbox and exit")
+    args = parser.parse_args(argv)
+
+    ingestor = Ingestor(args.dataset, args.shard_size, binarize_threshold=args.binarize,
+                        workers=args.workers)
+    print(f"🔄 Watching {args.inbox} → {args.dataset} (version {ingestor.version})")
+    events = asyncio.run(watch(args.inbox, ingestor, args.interval, args.once))
+    print(f"Ingested {sum(e['new_samples'] for e in events)} new samples "
+          f"in {len(events)} exports, dataset at version {ingestor.version}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
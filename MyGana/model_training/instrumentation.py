@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Training Pipeline Instrumentation
+Per-phase timers, peak memory tracking, per-epoch throughput and profiling,
+written to a machine-readable JSON run report
+
+Memory per phase is the highest RSS sampled while the phase ran; the
+process-lifetime peak (ru_maxrss) is reported separately as process_peak_rss_mb.
+Decode and augmentation of the training input are timed separately on a few
+batches (time_input_stages), so the diagnosis can tell a decode-bound,
+augmentation-bound and compute-bound run apart.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import cProfile
+import pstats
+import io
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import numpy as np
+from tensorflow import keras
+
+
+def get_peak_rss_mb():
+    """Peak resident set size over the whole lifetime of this process in MB"""
+    if resource is None:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+        except (ImportError, AttributeError):
+            return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and KB on Linux
+    if sys.platform == 'darwin':
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def get_current_rss_mb():
+    """Current resident set size of this process in MB"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        return None
+
+
+class RssSampler(threading.Thread):
+    """Samples the current RSS in the background and keeps the highest value"""
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = get_current_rss_mb()
+        self.done = threading.Event()
+
+    def sample(self):
+        rss = get_current_rss_mb()
+        if rss is not None and (self.peak is None or rss > self.peak):
+            self.peak = rss
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        """Stop sampling and return the peak RSS in MB"""
+        self.done.set()
+        self.join()
+        self.sample()
+        return self.peak
+
+
+class RunInstrumentation:
+    """Collects phase timings and training statistics for one run"""
+
+    def __init__(self, report_path='run_report.json'):
+        self.report_path = report_path
+        self.started_at = datetime.now().isoformat()
+        self.start_time = time.perf_counter()
+        self.phases = []
+        self.epochs = []
+        self.profile = None
+        self.input_stages = None
+        self.info = {}
+
+    @contextmanager
+    def phase(self, name):
+        """Time a pipeline phase and track its memory use"""
+        rss_before = get_current_rss_mb()
+        sampler = RssSampler()
+        sampler.start()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+
+        print(f"[{name}] started")
+        try:
+            yield
+        finally:
+            record = {
+                'name': name,
+                'wall_seconds': time.perf_counter() - wall_start,
+                'cpu_seconds': time.process_time() - cpu_start,
+                'rss_before_mb': rss_before,
+                'rss_after_mb': get_current_rss_mb(),
+                'peak_rss_mb': sampler.stop(),
+                'process_peak_rss_mb': get_peak_rss_mb(),
+            }
+            self.phases.append(record)
+            print(f"[{name}] finished in {record['wall_seconds']:.2f}s")
+
+    def record(self, key, value):
+        """Attach extra information to the report"""
+        self.info[key] = value
+
+    def time_input_stages(self, batches, augment=None, num_batches=20):
+        """Time decoding and augmentation of a few training batches separately
+
+        batches yields decoded, un-augmented (images, labels) batches and augment
+        maps a batch of images to its augmented version. All batches are read
+        before any is augmented, so a prefetching pipeline can't hide decode time
+        behind augmentation. The first batch of each stage is a warm-up.
+        """
+        iterator = iter(batches)
+        images = []
+        decode_seconds = 0.0
+        for i in range(num_batches + 1):
+            start = time.perf_counter()
+            try:
+                batch, _ = next(iterator)
+            except StopIteration:
+                break
+            if i > 0:
+                decode_seconds += time.perf_counter() - start
+            images.append(batch)
+        if len(images) < 2:
+            return None
+
+        augment_seconds = 0.0
+        for i, batch in enumerate(images):
+            start = time.perf_counter()
+            if augment is not None:
+                # np.asarray waits for a TensorFlow result
+                np.asarray(augment(batch))
+            if i > 0:
+                augment_seconds += time.perf_counter() - start
+
+        count = len(images) - 1
+        self.input_stages = {
+            'batches': count,
+            'decode_seconds_per_batch': decode_seconds / count,
+            'augment_seconds_per_batch': augment_seconds / count,
+        }
+        print(f"Input stages: decode {1000 * decode_seconds / count:.1f} ms/batch, "
+              f"augmentation {1000 * augment_seconds / count:.1f} ms/batch")
+        return self.input_stages
+
+    def diagnose(self):
+        """Guess what bounds the training phase: decode, augmentation or compute"""
+        if not self.epochs:
+            return None
+
+        # Epochs from custom training loops may not split stall and compute time
+        stall = sum(e.get('input_stall_seconds', 0) for e in self.epochs)
+        compute = sum(e.get('compute_seconds', 0) for e in self.epochs)
+        if stall + compute == 0:
+            return None
+
+        stall_fraction = stall / (stall + compute)
+        diagnosis = {'input_stall_fraction': stall_fraction}
+        if stall_fraction <= 0.3:
+            diagnosis['bound'] = 'compute-bound'
+        elif self.input_stages is None:
+            # Stalled on input, but the stages were not timed separately
+            diagnosis['bound'] = 'input-bound'
+        else:
+            decode = self.input_stages['decode_seconds_per_batch']
+            augment = self.input_stages['augment_seconds_per_batch']
+            diagnosis['decode_fraction'] = decode / (decode + augment) if decode + augment > 0 else None
+            diagnosis['bound'] = 'decode-bound' if decode >= augment else 'augmentation-bound'
+        return diagnosis
+
+    def to_dict(self):
+        return {
+            'started_at': self.started_at,
+            'total_wall_seconds': time.perf_counter() - self.start_time,
+            'process_peak_rss_mb': get_peak_rss_mb(),
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+            },
+            'phases': self.phases,
+            'epochs': self.epochs,
+            'input_stages': self.input_stages,
+            'diagnosis': self.diagnose(),
+            'profile': self.profile,
+            'info': self.info,
+        }
+
+    def write_report(self, report_path=None):
+        """Write the run report as JSON"""
+        report_path = report_path or self.report_path
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        print(f"Run report saved to {report_path}")
+        return report_path
+
+
+class ThroughputCallback(keras.callbacks.Callback):
+    """Per-epoch throughput and input-pipeline stall time"""
+
+    def __init__(self, run, batch_size):
+        super().__init__()
+        self.run = run
+        self.batch_size = batch_size
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start = time.perf_counter()
+        self.last_batch_end = self.epoch_start
+        self.input_stall = 0.0
+        self.compute = 0.0
+        self.steps = 0
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.batch_start = time.perf_counter()
+        # Time between batches is spent waiting on decode/augmentation
+        self.input_stall += self.batch_start - self.last_batch_end
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.last_batch_end = time.perf_counter()
+        self.compute += self.last_batch_end - self.batch_start
+        self.steps += 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        train_seconds = self.last_batch_end - self.epoch_start
+        epoch_seconds = time.perf_counter() - self.epoch_start
+        samples = self.steps * self.batch_size
+
+        self.run.epochs.append({
+            'epoch': epoch + 1,
+            'epoch_seconds': epoch_seconds,
+            'train_seconds': train_seconds,
+            'validation_seconds': epoch_seconds - train_seconds,
+            'steps': self.steps,
+            'samples_per_second': samples / train_seconds if train_seconds > 0 else None,
+            'input_stall_seconds': self.input_stall,
+            'compute_seconds': self.compute,
+            'metrics': {k: float(v) for k, v in (logs or {}).items()},
+        })
+
+
+class ProfilerCallback(keras.callbacks.Callback):
+    """Capture a cProfile or TensorFlow profiler trace of N training steps"""
+
+    def __init__(self, run, num_steps, start_step=5, mode='cprofile', output_dir='profile'):
+        super().__init__()
+        self.run = run
+        self.num_steps = num_steps
+        self.start_step = start_step
+        self.mode = mode
+        self.output_dir = output_dir
+        self.global_step = 0
+        self.profiler = None
+        self.done = False
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.done or self.profiler is not None or self.global_step < self.start_step:
+            return
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.mode == 'tf':
+            import tensorflow as tf
+            tf.profiler.experimental.start(self.output_dir)
+            self.profiler = 'tf'
+        else:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.global_step += 1
+        if self.profiler is not None and self.global_step >= self.start_step + self.num_steps:
+            self.stop()
+
+    def on_train_end(self, logs=None):
+        if self.profiler is not None:
+            self.stop()
+
+    def stop(self):
+        if self.profiler == 'tf':
+            import tensorflow as tf
+            tf.profiler.experimental.stop()
+            self.run.profile = {'mode': 'tf', 'steps': self.num_steps, 'log_dir': self.output_dir}
+        else:
+            self.profiler.disable()
+            stats_path = os.path.join(self.output_dir, 'train_steps.prof')
+            self.profiler.dump_stats(stats_path)
+
+            # Keep the top functions in the report itself
+            stream = io.StringIO()
+            pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(25)
+            self.run.profile = {
+                'mode': 'cprofile',
+                'steps': self.num_steps,
+                'stats_file': stats_path,
+                'top_functions': stream.getvalue(),
+            }
+
+        self.profiler = None
+        self.done = True
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Label Registry for Japanese Character Recognition
+Builds the class list from the app database (hiragana, katakana and kanji
+tables) and keeps class indices stable as new characters are added
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import hashlib
+import argparse
+
+from characters import HIRAGANA, KATAKANA
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets', 'MyGana.db')
+REGISTRY_FILE = 'label_registry.json'
+
+
+def read_db_characters(db_path=DEFAULT_DB_PATH):
+    """Characters per script from the app database, in table order"""
+    connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        scripts = {}
+        for table in ('hiragana', 'katakana', 'kanji'):
+            rows = connection.execute(f"SELECT character FROM {table} ORDER BY id").fetchall()
+            # Some rows hold several characters (e.g. きゃ); only single glyphs are classes
+            scripts[table] = [row[0].strip() for row in rows if row[0] and len(row[0].strip()) == 1]
+        return scripts
+    finally:
+        connection.close()
+
+
+def read_label_file(path):
+    """One character per line (e.g. a Jōyō kanji list)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if len(line.strip()) == 1]
+
+
+class LabelRegistry:
+    """Append-only list of class labels; existing indices never change"""
+
+    def __init__(self, labels=None, scripts=None):
+        self.labels = list(labels or [])
+        self.scripts = dict(scripts or {})
+        self.index = {label: i for i, label in enumerate(self.labels)}
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, label):
+        return label in self.index
+
+    def add(self, labels, script):
+        """Append labels not yet registered and return how many were new"""
+        added = 0
+        for label in labels:
+            if label in self.index:
+                continue
+            self.index[label] = len(self.labels)
+            self.labels.append(label)
+            self.scripts[label] = script
+            added += 1
+        return added
+
+    def version(self):
+        """Content hash that ties a model to the exact label order it was trained on"""
+        return hashlib.sha256('\n'.join(self.labels).encode('utf-8')).hexdigest()[:16]
+
+    def save(self, path=REGISTRY_FILE):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': self.version(),
+                'num_classes': len(self.labels),
+                'labels': self.labels,
+                'scripts': self.scripts,
+            }, f, ensure_ascii=False)
+
+    def save_labels_txt(self, path):
+        """Plain labels file in the format the app already reads"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for label in self.labels:
+                f.write(f"{label}\n")
+
+    @classmethod
+    def load(cls, path=REGISTRY_FILE):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['labels'], data.get('scripts'))
+
+
+def build_registry(db_path=DEFAULT_DB_PATH, extra_label_files=(), existing_path=None):
+    """Kana first (same order as the existing models), then DB and extra characters"""
+    if existing_path and os.path.exists(existing_path):
+        registry = LabelRegistry.load(existing_path)
+    else:
+        registry = LabelRegistry()
+        registry.add(HIRAGANA, 'hiragana')
+        registry.add(KATAKANA, 'katakana')
+
+    scripts = read_db_characters(db_path)
+    for script, characters in scripts.items():
+        registry.add(characters, script)
+
+    for path in extra_label_files:
+        registry.add(read_label_file(path), 'kanji')
+
+    return registry
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the class label registry from the app database")
+    parser.add_argument('--db', default=DEFAULT_DB_PATH)
+    parser.add_argument('--extra-labels', nargs='*', default=[],
+                        help="Additional one-character-per-line files, e.g. a Jōyō kanji list")
+    parser.add_argument('--output', default=REGISTRY_FILE)
+    parser.add_argument('--labels-txt', help="Also write a plain labels file")
+    args = parser.parse_args(argv)
+
+    registry = build_registry(args.db, args.extra_labels, existing_path=args.output)
+    registry.save(args.output)
+    if args.labels_txt:
+        registry.save_labels_txt(args.labels_txt)
+
+    counts = {}
+    for script in registry.scripts.values():
+        counts[script] = counts.get(script, 0) + 1
+    print(f"✅ {len(registry)} classes ({', '.join(f'{k}: {v}' for k, v in counts.items())})")
+    print(f"📁 Registry {registry.version()} saved to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
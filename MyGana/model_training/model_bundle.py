@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Self-Describing Model Bundle
+Embeds the labels, preprocessing spec, input/output quantization parameters, a
+model version and a content hash into a .tflite model, so the app loads a
+single asset and can never pair a model with the wrong label file
+
+The spec is stored as compact JSON in a TFLite metadata entry named
+'mygana_bundle' (see BUNDLE_METADATA). The content hash covers the model with
+that entry removed, so re-bundling a model keeps its hash. Every bundle is read
+back and validated before export succeeds.
+
+Examples:
+    python model_bundle.py --model japanese_character_model.tflite --labels japanese_character_labels.txt
+    python model_bundle.py --model model.tflite --output ../assets/models/japanese_character_model.tflite --version 1.4.0
+    python model_bundle.py --inspect ../assets/models/japanese_character_model.tflite
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+
+import numpy as np
+
+BUNDLE_METADATA = 'mygana_bundle'
+BUNDLE_FORMAT = 'mygana-model-bundle'
+BUNDLE_VERSION = 1
+
+# Matches preprocessing.to_model_input(): grayscale, dark ink on white, value = (pixel - mean) / std
+PREPROCESSING = {
+    'color': 'grayscale',
+    'background': 'white',
+    'ink': 'dark',
+    'resize': 'bilinear',
+    'mean': 0.0,
+    'std': 255.0,
+}
+
+
+def _read_model(model_bytes):
+    from tensorflow.lite.tools import flatbuffer_utils
+    return flatbuffer_utils.read_model_from_bytearray(bytearray(model_bytes))
+
+
+def _strip_bundle(model):
+    """Remove the bundle metadata entry and its buffer (always the last one, see export_bundle)"""
+    kept = []
+    for entry in model.metadata or []:
+        name = entry.name.decode('utf-8') if isinstance(entry.name, bytes) else entry.name
+        if name != BUNDLE_METADATA:
+            kept.append(entry)
+        elif entry.buffer == len(model.buffers) - 1:
+            model.buffers.pop()
+        else:
+            model.buffers[entry.buffer].data = None
+    model.metadata = kept
+    return model
+
+
+def _serialize(model):
+    from tensorflow.lite.tools import flatbuffer_utils
+    return bytes(flatbuffer_utils.convert_object_to_bytearray(model))
+
+
+def content_hash(model):
+    """sha256 of a model object with any bundle metadata removed"""
+    return hashlib.sha256(_serialize(_strip_bundle(model))).hexdigest()
+
+
+def read_bundle_spec(model_path):
+    """The embedded bundle spec of a .tflite model, or None for a plain model
+
+    Reads the flatbuffer directly, without building an interpreter.
+    """
+    from tensorflow.lite.python import schema_py_generated as schema
+
+    with open(model_path, 'rb') as f:
+        data = f.read()
+    model = schema.Model.GetRootAs(data, 0)
+    for i in range(model.MetadataLength()):
+        entry = model.Metadata(i)
+        if entry.Name().decode('utf-8') == BUNDLE_METADATA:
+            return json.loads(model.Buffers(entry.Buffer()).DataAsNumpy().tobytes().decode('utf-8'))
+    return None
+
+
+def _tensor_spec(details):
+    scale, zero_point = details['quantization']
+    spec = {
+        'shape': [int(d) for d in details['shape'][1:]],
+        'dtype': np.dtype(details['dtype']).name,
+    }
+    if scale:
+        spec['quantization'] = {'scale': float(scale), 'zero_point': int(zero_point)}
+    return spec
+
+
+def build_spec(predictor, labels, model_hash, model_version=None, source=None):
+    """Bundle spec of a loaded TFLitePredictor"""
+    output = _tensor_spec(predictor.output_details)
+    output['kind'] = 'top_k' if predictor.top_k_output else 'probabilities'
+    if predictor.top_k_output:
+        output['classes_index'] = int(predictor.classes_details['index'])
+
+    return {
+        'format': BUNDLE_FORMAT,
+        'format_version': BUNDLE_VERSION,
+        'model_version': model_version or f"{time.strftime('%Y.%m.%d')}+{model_hash[:8]}",
+        'model_sha256': model_hash,
+        'labels': list(labels),
+        'input': _tensor_spec(predictor.input_details),
+        'output': output,
+        'preprocessing': dict(PREPROCESSING),
+        'source': source,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def validate_bundle(bundle_path, expected=None):
+    """Re-read a bundle and check it is consistent; returns the spec or raises ValueError
+
+    Checks the content hash, that the labels match the model's output size and
+    the quantization parameters match the model tensors, and that a blank
+    input runs to a finite, well-formed prediction.
+    """
+    from inference import TFLitePredictor
+
+    spec = read_bundle_spec(bundle_path)
+    if spec is None:
+        raise ValueError(f"{bundle_path} has no '{BUNDLE_METADATA}' metadata")
+    problems = []
+    if expected is not None and spec != expected:
+        problems.append("embedded spec differs from the exported one")
+    if spec.get('format') != BUNDLE_FORMAT or spec.get('format_version') != BUNDLE_VERSION:
+        problems.append(f"unknown bundle format {spec.get('format')} v{spec.get('format_version')}")
+
+    with open(bundle_path, 'rb') as f:
+        model_hash = content_hash(_read_model(f.read()))
+    if model_hash != spec['model_sha256']:
+        problems.append(f"content hash {model_hash[:12]} != embedded {spec['model_sha256'][:12]}")
+
+    labels = spec['labels']
+    if not labels or any(not label for label in labels):
+        problems.append("empty label")
+    if len(set(labels)) != len(labels):
+        problems.append("duplicate labels")
+
+    predictor = TFLitePredictor(bundle_path)
+    for name, details in (('input', predictor.input_details), ('output', predictor.output_details)):
+        actual = _tensor_spec(details)
+        for key in ('shape', 'dtype', 'quantization'):
+            if actual.get(key) != spec[name].get(key):
+                problems.append(f"{name} {key} {actual.get(key)} != embedded {spec[name].get(key)}")
+
+    # A blank canvas (all white) must produce a sensible prediction
+    blank = np.ones((1,) + predictor.input_shape, dtype=np.float32)
+    if predictor.top_k_output:
+        scores, classes = predictor.predict_top_k(blank)
+        if classes.min() < 0 or classes.max() >= len(labels):
+            problems.append(f"top-k class ids outside the {len(labels)} labels")
+    else:
+        if predictor.num_classes != len(labels):
+            problems.append(f"{len(labels)} labels for {predictor.num_classes} model outputs")
+        scores = predictor.predict(blank)
+        if abs(float(scores.sum()) - 1.0) > 0.05:
+            problems.append(f"output sums to {float(scores.sum()):.3f}, not a probability distribution")
+    if not np.all(np.isfinite(scores)):
+        problems.append("non-finite output")
+
+    if problems:
+        raise ValueError(f"invalid bundle {bundle_path}: " + '; '.join(problems))
+    return spec
+
+
+def export_bundle(model_path, labels, output_path=None, model_version=None):
+    """Write model_path with the bundle spec embedded (in place by default) and validate it"""
+    from inference import TFLitePredictor
+
+    output_path = output_path or model_path
+    with open(model_path, 'rb') as f:
+        model = _strip_bundle(_read_model(f.read()))
+    model_hash = content_hash(model)
+
+    predictor = TFLitePredictor(model_path)
+    spec = build_spec(predictor, labels, model_hash, model_version, source=os.path.basename(model_path))
+    payload = json.dumps(spec, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    from tensorflow.lite.python import schema_py_generated as schema
+    buffer = schema.BufferT()
+    buffer.data = np.frombuffer(payload, dtype=np.uint8)
+    model.buffers.append(buffer)
+    entry = schema.MetadataT()
+    entry.name = BUNDLE_METADATA
+    entry.buffer = len(model.buffers) - 1
+    model.metadata.append(entry)
+
+    # Write next to the target and only replace it once the bundle validates
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_serialize(model))
+    try:
+        validate_bundle(tmp_path, expected=spec)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, output_path)
+    return spec
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Embed labels and preprocessing spec into a .tflite model")
+    parser.add_argument('--model', default='japanese_character_model.tflite')
+    parser.add_argument('--labels', default='japanese_character_labels.txt')
+    parser.add_argument('--output', default=None, help="Bundle path (default: rewrite --model in place)")
+    parser.add_argument('--version', default=None, help="Model version (default: date+hash)")
+    parser.add_argument('--inspect', metavar='BUNDLE', default=None,
+                        help="Validate an existing bundle and print its spec")
+    args = parser.parse_args(argv)
+
+    if args.inspect:
+        try:
+            spec = validate_bundle(args.inspect)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return 1
+        summary = {key: value for key, value in spec.items() if key != 'labels'}
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        print(f"✅ {len(spec['labels'])} labels: {''.join(spec['labels'][:20])}...")
+        return 0
+
+    if not os.path.exists(args.model):
+        print(f"❌ Model not found: {args.model}")
+        return 1
+    if not os.path.exists(args.labels):
+        print(f"❌ Labels not found: {args.labels}")
+        return 1
+    with open(args.labels, 'r', encoding='utf-8') as f:
+        labels = [line.strip() for line in f if line.strip()]
+
+    try:
+        spec = export_bundle(args.model, labels, args.output, args.version)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+
+    output_path = args.output or args.model
+    quantization = spec['input'].get('quantization')
+    print(f"✅ Bundle written and validated: {output_path} ({os.path.getsize(output_path) / 1024:.1f} KB)")
+    print(f"   Version: {spec['model_version']}  sha256: {spec['model_sha256'][:16]}")
+    print(f"   Input: {spec['input']['shape']} {spec['input']['dtype']}"
+          + (f" (scale {quantization['scale']:.6g}, zero point {quantization['zero_point']})" if quantization else ''))
+    print(f"   Output: {spec['output']['kind']}, {len(spec['labels'])} labels")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
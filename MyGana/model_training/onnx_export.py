@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+ONNX Export with Parity Check
+Exports a Keras model from train_japanese_model.py or quick_train.py to ONNX for
+ONNX Runtime (server-side grading) and the web build, then checks the exported
+model against Keras and times it against the TFLite model on the same inputs
+
+tf2onnx and onnxruntime are optional dependencies, only needed here and for .onnx
+models in inference.py:
+    pip install tf2onnx onnxruntime
+
+Examples:
+    python onnx_export.py --model best_model.h5 --output japanese_character_model.onnx
+    python onnx_export.py --model quick_model.h5 --output quick_model.onnx --tflite quick_model.tflite
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+import numpy as np
+
+from inference import KerasPredictor, ONNXPredictor, TFLitePredictor
+
+
+def export_onnx(model_path, output_path='japanese_character_model.onnx', opset=13, model=None):
+    """Convert a Keras model to ONNX, with softmax applied for logits models
+
+    The model is traced through a tf.function with a dynamic batch dimension,
+    which works for both Keras 2 and Keras 3 models.
+    """
+    import tensorflow as tf
+    try:
+        import tf2onnx
+    except ImportError:
+        raise ImportError("tf2onnx is required for ONNX export: pip install tf2onnx")
+    from inference import is_logits_model
+
+    if model is None:
+        from tensorflow import keras
+        model = keras.models.load_model(model_path)
+    from_logits = is_logits_model(model)
+
+    @tf.function(input_signature=[tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32,
+                                                name='input')])
+    def serve(images):
+        output = model(images, training=False)
+        return {'probabilities': tf.nn.softmax(output) if from_logits else output}
+
+    tf2onnx.convert.from_function(serve, input_signature=serve.input_signature, opset=opset,
+                                  output_path=output_path)
+    print(f"ONNX model saved to {output_path}")
+    return output_path
+
+
+def parity_check(reference, candidate, images, batch_size=64):
+    """Max absolute difference and top-1 agreement of two predictors' probabilities"""
+    max_abs_diff = 0.0
+    agree = 0
+    for start in range(0, len(images), batch_size):
+        batch = images[start:start + batch_size]
+        expected = reference.predict(batch)
+        actual = candidate.predict(batch)
+        max_abs_diff = max(max_abs_diff, float(np.abs(expected - actual).max()))
+        agree += int((expected.argmax(axis=1) == actual.argmax(axis=1)).sum())
+    return {'max_abs_diff': max_abs_diff, 'top1_agreement': agree / max(len(images), 1)}
+
+
+def latency(predictor, images, repeats=20, batch_size=32):
+    """Median milliseconds per sample for single-sample and batched prediction"""
+    single_image = images[:1]
+    batch = images[:batch_size]
+    results = {}
+    for name, inputs in (('single_ms', single_image), ('batch_ms_per_sample', batch)):
+        predictor.predict(inputs)  # warmup, includes any tensor reallocation
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            predictor.predict(inputs)
+            timings.append((time.perf_counter() - start) * 1000 / len(inputs))
+        results[name] = statistics.median(timings)
+    return results
+
+
+def sample_images(data_path, count, input_size, seed=42):
+    """Real samples from an export when available, else random images"""
+    if data_path and os.path.exists(data_path):
+        from sharded_dataset import iter_export_entries
+        from preprocessing import decode_sample, to_model_input
+        images = []
+        for entry in iter_export_entries(data_path):
+            try:
+                images.append(decode_sample(entry, input_size))
+            except Exception:
+                continue
+            if len(images) == count:
+                break
+        if images:
+            return to_model_input(np.stack(images))
+    rng = np.random.default_rng(seed)
+    return rng.random((count, input_size, input_size, 1), dtype=np.float32)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a Keras model to ONNX and check parity")
+    parser.add_argument('--model', default='best_model.h5', help="Keras model (.h5/.keras)")
+    parser.add_argument('--output', default='japanese_character_model.onnx')
+    parser.add_argument('--tflite', default='japanese_character_model.tflite',
+                        help="TFLite model to compare with (skipped if missing)")
+    parser.add_argument('--data', default='training_data_export.json',
+                        help="Export to draw parity samples from (random images if missing)")
+    parser.add_argument('--samples', type=int, default=256)
+    parser.add_argument('--opset', type=int, default=13)
+    parser.add_argument('--threads', type=int, default=1, help="Threads for ONNX Runtime and TFLite")
+    parser.add_argument('--max-abs-diff', type=float, default=1e-4,
+                        help="Largest allowed probability difference from Keras")
+    parser.add_argument('--report', default='onnx_parity_report.json')
+    args = parser.parse_args(argv)
+
+    keras_predictor = KerasPredictor(args.model)
+    export_onnx(args.model, args.output, args.opset, model=keras_predictor.model)
+    onnx_predictor = ONNXPredictor(args.output, num_threads=args.threads)
+
+    images = sample_images(args.data, args.samples, keras_predictor.input_shape[0])
+    report = {
+        'model': args.model,
+        'onnx': args.output,
+        'onnx_size_bytes': os.path.getsize(args.output),
+        'samples': int(len(images)),
+        'parity': {'keras': parity_check(keras_predictor, onnx_predictor, images)},
+        'latency': {'onnx': latency(onnx_predictor, images)},
+    }
+
+    if args.tflite and os.path.exists(args.tflite):
+        tflite_predictor = TFLitePredictor(args.tflite, num_threads=args.threads)
+        if tflite_predictor.top_k_output:
+            print(f"⚠️  {args.tflite} is a top-k model; skipping the TFLite comparison")
+        elif tflite_predictor.num_classes != onnx_predictor.num_classes:
+            print(f"⚠️  {args.tflite} has {tflite_predictor.num_classes} classes, not "
+                  f"{onnx_predictor.num_classes}; skipping the TFLite comparison")
+        else:
+            # TFLite is quantized, so this is agreement with the shipped model, not exact parity
+            report['parity']['tflite'] = parity_check(tflite_predictor, onnx_predictor, images)
+            report['latency']['tflite'] = latency(tflite_predictor, images)
+
+    parity = report['parity']['keras']
+    print(f"Parity with Keras: max abs diff {parity['max_abs_diff']:.2e}, "
+          f"top-1 agreement {parity['top1_agreement']:.2%}")
+    if 'tflite' in report['parity']:
+        print(f"Agreement with TFLite: max abs diff {report['parity']['tflite']['max_abs_diff']:.2e}, "
+              f"top-1 agreement {report['parity']['tflite']['top1_agreement']:.2%}")
+    for runtime, timings in report['latency'].items():
+        print(f"⏱️  {runtime:<7} {timings['single_ms']:.3f} ms single, "
+              f"{timings['batch_ms_per_sample']:.3f} ms/sample batched")
+
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"📁 Report saved to {args.report}")
+
+    if parity['max_abs_diff'] > args.max_abs_diff or parity['top1_agreement'] < 1.0:
+        print("❌ ONNX model does not match Keras")
+        return 1
+    print("✅ ONNX model matches Keras")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+Incremental Training Pipeline
+Runs generate → pack → train → compress → convert → evaluate as a DAG in which
+every stage's artifacts are keyed by a hash of its inputs, config and code
+
+A stage whose key is unchanged is skipped, so a config change only re-runs the
+stages downstream of it; stages whose inputs are ready (e.g. several conversion
+variants and their evaluations) run concurrently in separate processes.
+
+Examples:
+    python pipeline.py
+    python pipeline.py --config pipeline.json --jobs 3
+    python pipeline.py --dry-run
+    python pipeline.py --force train
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import inspect
+import hashlib
+import argparse
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+STATE_FILE = 'pipeline_state.json'
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_CONFIG = {
+    'generate': {'samples_per_char': 20, 'seed': 42},
+    'pack': {'exports': [], 'binarize': None},
+    'train': {'epochs': 10, 'batch_size': 32, 'hyperparameters': {}},
+    'compress': {'sparsity': 0.0},
+    # One convert stage (and one evaluate stage) per variant
+    'convert': {'float': {}, 'top5': {'top_k': 5}},
+    'evaluate': {'batch_size': 256, 'split': 'validation'},
+}
+
+# Source files whose contents are part of each stage's key: every local module the stage runs
+CODE = {
+    'generate': ['collect_training_data.py', 'characters.py', 'stroke_scoring.py'],
+    'pack': ['sharded_dataset.py', 'preprocessing.py', 'characters.py'],
+    'train': ['train_japanese_model.py', 'sharded_dataset.py', 'preprocessing.py', 'characters.py',
+              'collect_training_data.py'],
+    'compress': [],
+    'convert': ['train_japanese_model.py', 'inference.py', 'onnx_export.py', 'quantization.py',
+                'characters.py', 'preprocessing.py'],
+    'evaluate': ['evaluate_tflite.py', 'inference.py', 'preprocessing.py', 'sharded_dataset.py',
+                 'characters.py', 'collect_training_data.py', 'model_bundle.py'],
+}
+
+
+def stage_generate(inputs, params, output_dir):
+    import random
+    import numpy as np
+    from collect_training_data import DataCollector
+
+    random.seed(params['seed'])
+    np.random.seed(params['seed'])
+    collector = DataCollector(params.get('characters'))
+    data = collector.generate_synthetic_data(params['samples_per_char'])
+    collector.save_training_data(data, os.path.join(output_dir, 'export.json'))
+    return {'samples': len(data)}
+
+
+def stage_pack(inputs, params, output_dir):
+    from sharded_dataset import pack_exports
+
+    exports = [os.path.join(inputs['generate'], 'export.json')] + list(params['exports'])
+    index = pack_exports(exports, output_dir, binarize_threshold=params['binarize'])
+    return {'samples': index['total_samples']}
+
+
+def stage_train(inputs, params, output_dir):
+    from sharded_dataset import ShardedDataset
+    from train_japanese_model import JapaneseCharacterTrainer
+
+    dataset = ShardedDataset(inputs['pack'])
+    trainer = JapaneseCharacterTrainer(params['hyperparameters'])
+    trainer.use_labels(dataset.labels)
+    trainer.create_model()
+    # The checkpoint callback writes best_model.h5 into the working directory, i.e. output_dir
+    history = trainer.train_from_shards(inputs['pack'], epochs=params['epochs'], batch_size=params['batch_size'])
+    with open('labels.txt', 'w', encoding='utf-8') as f:
+        f.write(''.join(f"{label}\n" for label in dataset.labels))
+    return {'val_accuracy': float(max(history.history['val_accuracy']))}
+
+
+def stage_compress(inputs, params, output_dir):
+    """Magnitude pruning: zero the smallest kernel weights of every layer (sparsity 0 copies)"""
+    import numpy as np
+    from tensorflow import keras
+
+    model = keras.models.load_model(os.path.join(inputs['train'], 'best_model.h5'))
+    zeroed = total = 0
+    if params['sparsity'] > 0:
+        for layer in model.layers:
+            weights = layer.get_weights()
+            if not weights or weights[0].ndim < 2:
+                continue
+            kernel = weights[0]
+            threshold = np.quantile(np.abs(kernel), params['sparsity'])
+            weights[0] = np.where(np.abs(kernel) < threshold, 0, kernel).astype(kernel.dtype)
+            layer.set_weights(weights)
+            zeroed += int((weights[0] == 0).sum())
+            total += kernel.size
+    model.save('model.h5')
+    shutil.copy(os.path.join(inputs['train'], 'labels.txt'), 'labels.txt')
+    return {'sparsity': zeroed / total if total else 0.0}
+
+
+def stage_convert(inputs, params, output_dir):
+    model_path = os.path.join(inputs['compress'], 'model.h5')
+    shutil.copy(os.path.join(inputs['compress'], 'labels.txt'), 'labels.txt')
+    if params.get('format') == 'onnx':
+        from onnx_export import export_onnx
+        output = export_onnx(model_path, 'model.onnx')
+    else:
+        from train_japanese_model import JapaneseCharacterTrainer
+        output = JapaneseCharacterTrainer().convert_to_tflite('model.tflite', model_path=model_path,
+                                                              top_k=params.get('top_k'))
+    return {'size_bytes': os.path.getsize(output)}
+
+
+def stage_evaluate(inputs, params, output_dir):
+    from evaluate_tflite import evaluate_tflite
+
+    convert_dir = next(path for name, path in inputs.items() if name.startswith('convert'))
+    model_path = next(os.path.join(convert_dir, name) for name in ('model.tflite', 'model.onnx')
+                      if os.path.exists(os.path.join(convert_dir, name)))
+    report, _ = evaluate_tflite(model_path, inputs['pack'], batch_size=params['batch_size'],
+                                labels_path=os.path.join(convert_dir, 'labels.txt'), split=params['split'])
+    with open('report.json', 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return {'accuracy': report['accuracy'], 'samples_per_second': report['samples_per_second']}
+
+
+STAGE_FUNCTIONS = {
+    'generate': stage_generate,
+    'pack': stage_pack,
+    'train': stage_train,
+    'compress': stage_compress,
+    'convert': stage_convert,
+    'evaluate': stage_evaluate,
+}
+
+
+class Stage:
+    """A node of the pipeline: kind of work, upstream stages, params and external input files"""
+
+    def __init__(self, name, kind, deps=(), params=None, external=()):
+        self.name = name
+        self.kind = kind
+        self.deps = list(deps)
+        self.params = dict(params or {})
+        self.external = list(external)
+
+
+def build_stages(config):
+    # Stages run inside their own scratch directory, so external paths must not be relative
+    pack = dict(config['pack'], exports=[os.path.abspath(path) for path in config['pack']['exports']])
+    stages = [
+        Stage('generate', 'generate', [], config['generate']),
+        Stage('pack', 'pack', ['generate'], pack, pack['exports']),
+        Stage('train', 'train', ['pack'], config['train']),
+        Stage('compress', 'compress', ['train'], config['compress']),
+    ]
+    for variant, params in config['convert'].items():
+        stages.append(Stage(f'convert_{variant}', 'convert', ['compress'], params))
+        stages.append(Stage(f'evaluate_{variant}', 'evaluate', [f'convert_{variant}', 'pack'],
+                            config['evaluate']))
+    return {stage.name: stage for stage in stages}
+
+
+def load_config(path=None):
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            overrides = json.load(f)
+        for section, values in overrides.items():
+            if section == 'convert':
+                config['convert'] = dict(values)
+            else:
+                config.setdefault(section, {}).update(values)
+    return config
+
+
+class ArtifactStore:
+    """Stage state and a file-hash cache, so unchanged multi-GB artifacts are not re-read"""
+
+    def __init__(self, workdir):
+        self.workdir = os.path.abspath(workdir)
+        os.makedirs(self.workdir, exist_ok=True)
+        self.path = os.path.join(self.workdir, STATE_FILE)
+        self.state = {'stages': {}, 'file_hashes': {}}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+
+    def save(self):
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(self.path + '.tmp', self.path)
+
+    def stage_dir(self, name):
+        return os.path.join(self.workdir, name)
+
+    def file_hash(self, path):
+        """Content hash, cached under (size, mtime)"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        cached = self.state['file_hashes'].get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        self.state['file_hashes'][path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def tree_hash(self, path):
+        """Hash of every file (relative path and contents) under a file or directory"""
+        if os.path.isfile(path):
+            return self.file_hash(path)
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                digest.update(os.path.relpath(full, path).encode('utf-8'))
+                digest.update(self.file_hash(full).encode('ascii'))
+        return digest.hexdigest()
+
+    def stage_key(self, stage):
+        """Hash of params, code, upstream outputs and external inputs"""
+        code = {name: self.file_hash(os.path.join(HERE, name)) for name in CODE[stage.kind]
+                if os.path.exists(os.path.join(HERE, name))}
+        code['stage'] = hashlib.sha256(inspect.getsource(STAGE_FUNCTIONS[stage.kind]).encode()).hexdigest()
+        payload = {
+            'kind': stage.kind,
+            'params': stage.params,
+            'code': code,
+            'deps': {dep: self.state['stages'][dep]['output_hash'] for dep in stage.deps},
+            'external': {path: self.tree_hash(path) for path in stage.external},
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def up_to_date(self, stage, key):
+        record = self.state['stages'].get(stage.name)
+        return (record is not None and record['key'] == key and os.path.isdir(self.stage_dir(stage.name))
+                and self.tree_hash(self.stage_dir(stage.name)) == record['output_hash'])
+
+
+def _init_worker():
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+    sys.path.insert(0, HERE)
+
+
+def _run_stage(kind, inputs, params, output_dir):
+    """Worker: run a stage in a scratch directory and move it into place only on success"""
+    scratch = output_dir + '.tmp'
+    shutil.rmtree(scratch, ignore_errors=True)
+    os.makedirs(scratch)
+    cwd = os.getcwd()
+    os.chdir(scratch)
+    try:
+        metrics = STAGE_FUNCTIONS[kind](inputs, params, scratch)
+    finally:
+        os.chdir(cwd)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.replace(scratch, output_dir)
+    return metrics
+
+
+def run_pipeline(config, workdir='pipeline_artifacts', jobs=2, force=(), targets=None, dry_run=False):
+    """Run the stages whose keys changed, independent ones concurrently; returns stage name -> status"""
+    stages = build_stages(config)
+    unknown = set(force) - set(stages)
+    if unknown:
+        raise ValueError(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    # Restrict to the targets and everything upstream of them
+    wanted = set()
+    pending_targets = list(targets or stages)
+    while pending_targets:
+        name = pending_targets.pop()
+        if name not in wanted:
+            wanted.add(name)
+            pending_targets.extend(stages[name].deps)
+    stages = {name: stage for name, stage in stages.items() if name in wanted}
+
+    store = ArtifactStore(workdir)
+    status = {}
+    running = {}
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=get_context('spawn'),
+                             initializer=_init_worker) as executor:
+        while len(status) < len(stages):
+            for stage in stages.values():
+                if stage.name in status or stage.name in running:
+                    continue
+                if any(status.get(dep) == 'failed' or status.get(dep) == 'blocked' for dep in stage.deps):
+                    status[stage.name] = 'blocked'
+                    print(f"⏭️  {stage.name}: blocked by a failed upstream stage")
+                    continue
+                if not all(status.get(dep) in ('skipped', 'done') for dep in stage.deps):
+                    continue
+                if dry_run and any(status[dep] == 'done' for dep in stage.deps):
+                    status[stage.name] = 'done'
+                    print(f"🔄 {stage.name}: would run (upstream changes)")
+                    continue
+
+                key = store.stage_key(stage)
+                if stage.name not in force and store.up_to_date(stage, key):
+                    status[stage.name] = 'skipped'
+                    print(f"✅ {stage.name}: up to date")
+                elif dry_run:
+                    status[stage.name] = 'done'
+                    print(f"🔄 {stage.name}: would run")
+                else:
+                    inputs = {dep: store.stage_dir(dep) for dep in stage.deps}
+                    future = executor.submit(_run_stage, stage.kind, inputs, stage.params,
+                                             store.stage_dir(stage.name))
+                    running[stage.name] = (future, key, time.perf_counter())
+                    print(f"🔄 {stage.name}: running", flush=True)
+
+            if not running:
+                continue
+            done, _ = wait([future for future, _, _ in running.values()], return_when=FIRST_COMPLETED)
+            for name in [name for name, (future, _, _) in running.items() if future in done]:
+                future, key, started = running.pop(name)
+                seconds = time.perf_counter() - started
+                try:
+                    metrics = future.result()
+                except Exception as e:
+                    status[name] = 'failed'
+                    print(f"❌ {name}: {type(e).__name__}: {e}")
+                    continue
+                status[name] = 'done'
+                store.state['stages'][name] = {
+                    'key': key,
+                    'output_hash': store.tree_hash(store.stage_dir(name)),
+                    'seconds': seconds,
+                    'finished': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'metrics': metrics,
+                }
+                # Saved after every stage, so an interrupted run resumes where it stopped
+                store.save()
+                print(f"✅ {name}: done in {seconds:.1f}s {json.dumps(metrics)}", flush=True)
+
+    ran = sum(1 for s in status.values() if s == 'done')
+    skipped = sum(1 for s in status.values() if s == 'skipped')
+    if dry_run:
+        print(f"{ran} stages would run, {skipped} up to date")
+        return status
+    store.save()
+    print(f"⏱️  Pipeline finished in {time.perf_counter() - start:.1f}s ({ran} run, {skipped} up to date)")
+    return status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Incremental generate → evaluate pipeline")
+    parser.add_argument('targets', nargs='*', help="Stages to bring up to date (default: all)")
+    parser.add_argument('--config', help="JSON file overriding sections of the default config")
+    parser.add_argument('--workdir', default='pipeline_artifacts')
+    parser.add_argument('--jobs', type=int, default=2, help="Stages run concurrently")
+    parser.add_argument('--force', action='append', default=[], metavar='STAGE',
+                        help="Re-run a stage even if it is up to date (repeatable)")
+    parser.add_argument('--dry-run', action='store_true', help="Show what would run")
+    parser.add_argument('--show-config', action='store_true', help="Print the effective config and exit")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    if args.show_config:
+        print(json.dumps(config, indent=2, ensure_ascii=False))
+        return 0
+    stages = build_stages(config)
+    unknown = set(args.targets) - set(stages)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))} (stages: {', '.join(stages)})")
+
+    status = run_pipeline(config, args.workdir, args.jobs, args.force, args.targets or None, args.dry_run)
+    return 1 if any(s in ('failed', 'blocked') for s in status.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Image Preprocessing for Japanese Character Recognition
+Shared decode and normalization steps used by training and inference
+"""
+
+import io
+import base64
+import numpy as np
+from PIL import Image, ImageDraw
+
+INPUT_SIZE = 64
+INK_THRESHOLD = 128
+
+
+def decode_image_data(image_data, input_size=INPUT_SIZE):
+    """Decode a base64 PNG from the export into a uint8 grayscale array"""
+    image = Image.open(io.BytesIO(base64.b64decode(image_data)))
+
+    # Convert to grayscale and resize
+    image = image.convert('L')
+    image = image.resize((input_size, input_size))
+
+    return np.asarray(image, dtype=np.uint8)
+
+
+def to_model_input(images):
+    """Normalize uint8 images (N, H, W) to float32 model input (N, H, W, 1)"""
+    images = np.asarray(images)
+    return (images.astype(np.float32) / 255.0)[..., np.newaxis]
+
+
+def pack_bits(images, threshold=INK_THRESHOLD):
+    """Binarize uint8 images (N, H, W) and pack 8 pixels per byte (512 bytes at 64x64)
+
+    Pixels darker than threshold are ink (1 bits); images are black ink on white.
+    """
+    images = np.asarray(images)
+    return np.packbits(images.reshape(len(images), -1) < threshold, axis=1)
+
+
+def unpack_bits(packed, input_size=INPUT_SIZE):
+    """Packed rows back to uint8 images (N, H, W): ink 0, background 255"""
+    bits = np.unpackbits(np.asarray(packed, dtype=np.uint8), axis=1, count=input_size * input_size)
+    return ((1 - bits) * 255).astype(np.uint8).reshape(-1, input_size, input_size)
+
+
+def packed_to_model_input(packed, input_size=INPUT_SIZE):
+    """Packed rows straight to float32 model input (N, H, W, 1): 1.0 background, 0.0 ink"""
+    bits = np.unpackbits(np.asarray(packed, dtype=np.uint8), axis=1, count=input_size * input_size)
+    # One pass from bits to float32, without an intermediate uint8 image
+    return np.subtract(np.float32(1), bits, dtype=np.float32).reshape(-1, input_size, input_size, 1)
+
+
+def _point_xy(point):
+    if isinstance(point, dict):
+        return float(point['x']), float(point['y'])
+    return float(point[0]), float(point[1])
+
+
+def render_strokes(strokes, input_size=INPUT_SIZE, stroke_width=3, padding=6):
+    """Rasterize raw strokes (lists of [x, y] or {'x', 'y'} points) to a uint8 image
+
+    The drawing is scaled to fit the image with its aspect ratio kept, black ink on
+    white like the exported images.
+    """
+    strokes = [[_point_xy(p) for p in stroke] for stroke in strokes if len(stroke) > 0]
+    image = Image.new('L', (input_size, input_size), 255)
+    if not strokes:
+        return np.asarray(image, dtype=np.uint8)
+
+    points = np.array([p for stroke in strokes for p in stroke], dtype=np.float32)
+    low = points.min(axis=0)
+    extent = max(float((points.max(axis=0) - low).max()), 1.0)
+    scale = (input_size - 2 * padding) / extent
+    # Center the drawing
+    offset = (input_size - (points.max(axis=0) - low) * scale) / 2
+
+    draw = ImageDraw.Draw(image)
+    for stroke in strokes:
+        xy = [tuple(float(v) for v in (np.array(p) - low) * scale + offset) for p in stroke]
+        if len(xy) == 1:
+            x, y = xy[0]
+            r = stroke_width / 2
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=0)
+        else:
+            draw.line(xy, fill=0, width=stroke_width, joint='curve')
+
+    return np.asarray(image, dtype=np.uint8)
+
+
+def decode_sample(sample, input_size=INPUT_SIZE):
+    """Decode an export-style sample holding either `imageData` or raw `strokes`"""
+    if sample.get('imageData'):
+        return decode_image_data(sample['imageData'], input_size)
+    if sample.get('strokes') is not None:
+        return render_strokes(sample['strokes'], input_size)
+    raise ValueError("Sample needs either 'imageData' or 'strokes'")
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Quantization-Aware Training for Japanese Character Recognition
+Folds the BatchNormalization layers of the trained CNN into its Conv2D/Dense
+weights, wraps the folded model with fake-quant ops (int8 weights, per channel
+for convolutions, and int8 activations with moving-average ranges) and fine-tunes it
+briefly, so a fully integer TFLite model keeps the float model's accuracy
+
+In create_model() every BatchNormalization follows a ReLU, where the TFLite
+converter cannot fold it, so post-training quantization leaves a separately
+quantized multiply-add per BN. Here the BN scale moves into the preceding layer
+(relu(a * z) = a * relu(z) for a > 0) and its shift into the bias of the next
+one (max pooling, dropout and global average pooling commute with a constant
+per-channel shift, and so does a 'valid' convolution).
+
+The fake-quant ops are the ones tf.quantization provides and the TFLite
+converter understands, so this also works with Keras 3, which the TensorFlow
+Model Optimization toolkit does not support.
+
+Examples:
+    python quantization.py --model best_model.h5 --data training_data_export.json
+    python quantization.py --model best_model.h5 --data training_data_export.json --epochs 5 --report quantization_report.json
+"""
+
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+
+LINEAR_LAYERS = ('Conv2D', 'Dense')
+# Layers a constant per-channel shift passes through unchanged (up to the same shift)
+SHIFT_TRANSPARENT_LAYERS = ('MaxPooling2D', 'AveragePooling2D', 'GlobalAveragePooling2D', 'Dropout')
+
+
+def _activation_name(layer):
+    return layer.get_config().get('activation', 'linear')
+
+
+def _foldable(layers, bn_index, scale):
+    """Index of the layer before and after a BatchNormalization, if the BN can be folded into them"""
+    previous = bn_index - 1
+    if previous < 0 or type(layers[previous]).__name__ not in LINEAR_LAYERS:
+        return None
+    activation = _activation_name(layers[previous])
+    if activation == 'relu':
+        if np.any(scale <= 0):
+            return None
+    elif activation != 'linear':
+        return None
+
+    following = bn_index + 1
+    while following < len(layers) and type(layers[following]).__name__ in SHIFT_TRANSPARENT_LAYERS:
+        following += 1
+    if following == len(layers) or type(layers[following]).__name__ not in LINEAR_LAYERS:
+        return None
+    # Zero padding would see the shift only inside the image, so only 'valid' convolutions fold exactly
+    if layers[following].get_config().get('padding', 'valid') != 'valid':
+        return None
+    return previous, following
+
+
+def fold_batch_norm(model):
+    """Sequential model without the foldable BatchNormalization layers, equal at inference
+
+    BatchNormalization layers that cannot be folded exactly (e.g. a negative scale
+    after a ReLU) are kept as they are.
+    """
+    from tensorflow import keras
+
+    if not isinstance(model, keras.Sequential):
+        raise ValueError("BatchNorm folding needs a Sequential model like create_model() builds")
+
+    layers = list(model.layers)
+    weights = [[np.array(w) for w in layer.get_weights()] for layer in layers]
+    removed = set()
+    for i, layer in enumerate(layers):
+        if type(layer).__name__ != 'BatchNormalization':
+            continue
+        config = layer.get_config()
+        if not (config['scale'] and config['center']):
+            continue
+        gamma, beta, mean, variance = weights[i]
+        scale = gamma / np.sqrt(variance + config['epsilon'])
+        shift = beta - mean * scale
+        neighbours = _foldable(layers, i, scale)
+        if neighbours is None or not layers[neighbours[0]].use_bias or not layers[neighbours[1]].use_bias:
+            continue
+
+        previous, following = neighbours
+        kernel, bias = weights[previous]
+        weights[previous] = [kernel * scale, bias * scale]
+        kernel, bias = weights[following]
+        if kernel.ndim == 4:  # Conv2D (kh, kw, in, out): every output sums the shift over the window
+            bias = bias + np.einsum('hwio,i->o', kernel, shift)
+        else:
+            bias = bias + shift @ kernel
+        weights[following] = [kernel, bias]
+        removed.add(i)
+
+    folded = keras.Sequential([keras.layers.Input(shape=model.input_shape[1:])], name=f"{model.name}_folded")
+    for i, layer in enumerate(layers):
+        if i in removed:
+            continue
+        clone = type(layer).from_config(layer.get_config())
+        folded.add(clone)
+        clone.set_weights(weights[i])
+    print(f"Folded {len(removed)} of {sum(type(l).__name__ == 'BatchNormalization' for l in layers)} "
+          f"BatchNormalization layers")
+    return folded
+
+
+def quantization_layers():
+    """Fake-quant Keras layers (defined lazily so importing this module does not load TensorFlow)"""
+    import tensorflow as tf
+    from tensorflow import keras
+
+    if 'ActivationQuantizer' in _LAYERS:
+        return _LAYERS
+
+    def fake_quant_kernel(kernel, per_channel):
+        # Symmetric int8 like TFLite: per output channel for convolutions, per tensor for
+        # fully connected layers (their transposed weights cannot keep a channel axis)
+        axes = list(range(len(kernel.shape) - 1)) if per_channel else None
+        limit = tf.stop_gradient(tf.maximum(tf.reduce_max(tf.abs(kernel), axis=axes), 1e-8))
+        if per_channel:
+            return tf.quantization.fake_quant_with_min_max_vars_per_channel(
+                kernel, -limit, limit, num_bits=8, narrow_range=True)
+        return tf.quantization.fake_quant_with_min_max_vars(kernel, -limit, limit, num_bits=8,
+                                                            narrow_range=True)
+
+    @keras.utils.register_keras_serializable(package='mygana')
+    class ActivationQuantizer(keras.layers.Layer):
+        """Per-tensor int8 fake quantization with moving-average min/max ranges"""
+
+        def __init__(self, momentum=0.99, **kwargs):
+            super().__init__(**kwargs)
+            self.momentum = momentum
+
+        def build(self, input_shape):
+            self.range_min = self.add_weight(name='range_min', shape=(), initializer='zeros',
+                                             trainable=False)
+            self.range_max = self.add_weight(name='range_max', shape=(), initializer='zeros',
+                                             trainable=False)
+            self.steps = self.add_weight(name='steps', shape=(), initializer='zeros', trainable=False)
+
+        def call(self, inputs, training=False):
+            if training:
+                # Ranges always include 0 so that zero stays exactly representable
+                batch_min = tf.minimum(tf.reduce_min(inputs), 0.0)
+                batch_max = tf.maximum(tf.reduce_max(inputs), 0.0)
+                first = tf.equal(self.steps, 0.0)
+                self.range_min.assign(tf.where(first, batch_min,
+                                               self.momentum * self.range_min + (1 - self.momentum) * batch_min))
+                self.range_max.assign(tf.where(first, batch_max,
+                                               self.momentum * self.range_max + (1 - self.momentum) * batch_max))
+                self.steps.assign_add(1.0)
+            return tf.quantization.fake_quant_with_min_max_vars(inputs, self.range_min, self.range_max,
+                                                                num_bits=8)
+
+        def get_config(self):
+            return {**super().get_config(), 'momentum': self.momentum}
+
+    @keras.utils.register_keras_serializable(package='mygana')
+    class QuantConv2D(keras.layers.Conv2D):
+        """Conv2D whose kernel is fake-quantized to int8 per output channel"""
+
+        def call(self, inputs):
+            outputs = self.convolution_op(inputs, fake_quant_kernel(self.kernel, per_channel=True))
+            if self.use_bias:
+                outputs = outputs + self.bias
+            return self.activation(outputs)
+
+    @keras.utils.register_keras_serializable(package='mygana')
+    class QuantDense(keras.layers.Dense):
+        """Dense whose kernel is fake-quantized to int8 per tensor"""
+
+        def call(self, inputs):
+            outputs = tf.matmul(inputs, fake_quant_kernel(self.kernel, per_channel=False))
+            if self.use_bias:
+                outputs = outputs + self.bias
+            return self.activation(outputs)
+
+    _LAYERS.update(ActivationQuantizer=ActivationQuantizer, QuantConv2D=QuantConv2D, QuantDense=QuantDense)
+    return _LAYERS
+
+
+_LAYERS = {}
+
+
+def build_qat_model(model, momentum=0.99):
+    """Fake-quantized copy of a Sequential model (fold_batch_norm() it first), with its weights
+
+    The input and the output of every Conv2D, Dense and remaining BatchNormalization
+    get an activation quantizer; pooling layers keep their input's range, as in TFLite.
+    Dropout layers are left out: without BatchNormalization re-normalizing each
+    batch, dropout noise wrecks the folded network's activations during fine-tuning,
+    and it is the identity at inference anyway.
+    """
+    from tensorflow import keras
+
+    quant = quantization_layers()
+    qat = keras.Sequential([keras.layers.Input(shape=model.input_shape[1:])], name=f"{model.name}_qat")
+    qat.add(quant['ActivationQuantizer'](momentum, name='input_quant'))
+    for layer in model.layers:
+        kind = type(layer).__name__
+        if kind == 'Dropout':
+            continue
+        if kind in LINEAR_LAYERS:
+            clone = quant[f'Quant{kind}'].from_config(layer.get_config())
+        else:
+            clone = type(layer).from_config(layer.get_config())
+        qat.add(clone)
+        clone.set_weights(layer.get_weights())
+        if kind in LINEAR_LAYERS + ('BatchNormalization',):
+            qat.add(quant['ActivationQuantizer'](momentum, name=f'{layer.name}_quant'))
+    return qat
+
+
+def representative_dataset(images, count=200, seed=42):
+    """Calibration generator for the TFLite converter: single float32 samples"""
+    rng = np.random.default_rng(seed)
+    chosen = rng.choice(len(images), size=min(count, len(images)), replace=False)
+
+    def generator():
+        for i in chosen:
+            yield [np.asarray(images[i:i + 1], dtype=np.float32)]
+    return generator
+
+
+def quantization_report(trainer, X_val, y_val, float_model_path='best_model.h5', qat_model_path='qat_model.keras',
+                        output_prefix='japanese_character_model', report_path='quantization_report.json',
+                        representative_images=None):
+    """Convert float, PTQ-INT8 and QAT-INT8 models and compare accuracy, size and latency"""
+    from evaluate_tflite import evaluate_tflite
+    from inference import TFLitePredictor
+    from onnx_export import latency
+
+    quantization_layers()  # registers the fake-quant layers so qat_model_path can be loaded
+    calibration = X_val if representative_images is None else representative_images
+    variants = {
+        'float': (float_model_path, 'float'),
+        'ptq_int8': (float_model_path, 'int8'),
+        'qat_int8': (qat_model_path, 'int8'),
+    }
+    report = {'validation_samples': int(len(y_val)), 'models': {}}
+    for name, (model_path, quantization) in variants.items():
+        tflite_path = f"{output_prefix}_{name}.tflite"
+        trainer.convert_to_tflite(tflite_path, model_path, quantization=quantization,
+                                  representative_data=calibration)
+        accuracy, _ = evaluate_tflite(tflite_path, (X_val, y_val))
+        report['models'][name] = {
+            'path': tflite_path,
+            'size_bytes': os.path.getsize(tflite_path),
+            'accuracy': accuracy['accuracy'],
+            'top5_accuracy': accuracy.get('top5_accuracy'),
+            'latency': latency(TFLitePredictor(tflite_path), X_val),
+        }
+
+    print(f"\n{'model':<10} {'accuracy':>9} {'size KB':>8} {'single ms':>10} {'batch ms/sample':>16}")
+    for name, result in report['models'].items():
+        print(f"{name:<10} {result['accuracy']:>9.4f} {result['size_bytes'] / 1024:>8.1f} "
+              f"{result['latency']['single_ms']:>10.3f} {result['latency']['batch_ms_per_sample']:>16.3f}")
+
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"📁 Quantization report saved to {report_path}")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Quantization-aware fine-tuning and INT8 comparison")
+    parser.add_argument('--model', default='best_model.h5', help="Trained float Keras model")
+    parser.add_argument('--data', default='training_data_export.json')
+    parser.add_argument('--epochs', type=int, default=3, help="QAT fine-tuning epochs")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--output', default='qat_model.keras')
+    parser.add_argument('--tflite-prefix', default='japanese_character_model')
+    parser.add_argument('--report', default='quantization_report.json')
+    args = parser.parse_args(argv)
+
+    from train_japanese_model import JapaneseCharacterTrainer
+
+    trainer = JapaneseCharacterTrainer()
+    X, y = trainer.load_training_data(args.data)
+    X = X.reshape(-1, trainer.input_size, trainer.input_size, 1)
+    trainer.load_model(args.model)
+
+    X_val, y_val = trainer.quantization_aware_finetune(X, y, epochs=args.epochs, batch_size=args.batch_size,
+                                                       output_path=args.output)
+    report = quantization_report(trainer, X_val, y_val, args.model, args.output, args.tflite_prefix,
+                                 args.report)
+    models = report['models']
+    print(f"✅ QAT-INT8 accuracy {models['qat_int8']['accuracy']:.4f} vs "
+          f"PTQ-INT8 {models['ptq_int8']['accuracy']:.4f} and float {models['float']['accuracy']:.4f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,16 +7,18 @@ Simplified version for immediate model training
 import os
 import json
 import numpy as np
-import tensorflow as tf
-from tensorflow import keras
-from tensorflow.keras import layers
 import base64
 import io
 from PIL import Image
 import random
 
+from characters import HIRAGANA
+
 def create_simple_model():
     """Create a simple CNN model"""
+    from tensorflow import keras
+    from tensorflow.keras import layers
+    
     model = keras.Sequential([
         layers.Input(shape=(64, 64, 1)),
         
@@ -52,18 +54,7 @@ def generate_quick_data():
     """Generate quick training data"""
     print("Generating quick training data...")
     
-    characters = [
-        'あ', 'い', 'う', 'え', 'お',
-        'か', 'き', 'く', 'け', 'こ',
-        'さ', 'し', 'す', 'せ', 'そ',
-        'た', 'ち', 'つ', 'て', 'と',
-        'な', 'に', 'ぬ', 'ね', 'の',
-        'は', 'ひ', 'ふ', 'へ', 'ほ',
-        'ま', 'み', 'む', 'め', 'も',
-        'や', 'ゆ', 'よ',
-        'ら', 'り', 'る', 'れ', 'ろ',
-        'わ', 'を', 'ん'
-    ]
+    characters = HIRAGANA
     
     character_to_index = {char: i for i, char in enumerate(characters)}
     
@@ -109,6 +100,8 @@ def generate_quick_data():
 
 def quick_train():
     """Quick training function"""
+    import tensorflow as tf
+    
     print("Starting quick training...")
     
     # Generate data
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Local Batched Recognition Server for Japanese Character Recognition
+asyncio HTTP front end that merges concurrent requests into micro-batches
+and runs them on a pool of TensorFlow Lite (or Keras) interpreters
+
+Endpoints (localhost only):
+    POST /recognize   {"imageData": "<base64 png>"} or {"strokes": [[[x, y], ...], ...]}
+                      or {"samples": [...]} for several samples in one request
+    POST /recognize-word  a whole handwritten word or line, {"imageData": ...} or {"strokes": ...};
+                      segmented and classified in one batched call (see word_recognition.py)
+    GET  /health
+    GET  /stats
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from inference import load_predictor, load_labels, top_k
+from label_registry import DEFAULT_DB_PATH
+from preprocessing import INPUT_SIZE, decode_sample, to_model_input
+from word_recognition import Lexicon, line_segments, decode_line
+
+LOCAL_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+
+def _decode_request_sample(sample, input_size=INPUT_SIZE):
+    """decode_sample() that reports an undecodable image as bad input"""
+    try:
+        return decode_sample(sample, input_size)
+    except OSError:  # PIL.UnidentifiedImageError, truncated images
+        raise ValueError("invalid imageData: not a decodable image")
+
+
+class InterpreterPool:
+    """One predictor per worker thread, since interpreters are not thread-safe"""
+
+    def __init__(self, model_path, workers=2, num_threads=1):
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='interpreter')
+
+        # Load once up front to fail fast and read the output size
+        probe = load_predictor(model_path, num_threads)
+        self.num_classes = probe.num_classes
+
+    def _predictor(self):
+        if not hasattr(self.local, 'predictor'):
+            self.local.predictor = load_predictor(self.model_path, self.num_threads)
+        return self.local.predictor
+
+    def _predict(self, images):
+        return self._predictor().predict(images)
+
+    async def predict(self, images):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._predict, images)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+class DynamicBatcher:
+    """Collects single samples into batches bounded by size and a max-wait deadline"""
+
+    def __init__(self, pool, max_batch_size=32, max_wait_ms=5.0):
+        self.pool = pool
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.tasks = []
+        self.stats = {'requests': 0, 'samples': 0, 'batches': 0, 'batched_samples': 0,
+                      'inference_seconds': 0.0}
+
+    def start(self, dispatchers):
+        # One dispatcher per interpreter keeps every interpreter busy
+        self.tasks = [asyncio.create_task(self._dispatch()) for _ in range(dispatchers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def submit(self, image):
+        """Queue one uint8 image and wait for its probabilities"""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((image, future))
+        return await future
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            images = to_model_input(np.stack([image for image, _ in batch]))
+            start = time.perf_counter()
+            try:
+                probabilities = await self.pool.predict(images)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.stats['batches'] += 1
+            self.stats['batched_samples'] += len(batch)
+            self.stats['inference_seconds'] += time.perf_counter() - start
+            for (_, future), row in zip(batch, probabilities):
+                if not future.done():
+                    future.set_result(row)
+
+
+class RecognitionServer:
+    """Minimal HTTP/1.1 server with keep-alive, built on asyncio streams"""
+
+    def __init__(self, model_path, labels_path=None, host='127.0.0.1', port=8765,
+                 workers=2, max_batch_size=32, max_wait_ms=5.0, top=5, lexicon_db=None):
+        if host not in LOCAL_HOSTS:
+            raise ValueError(f"Refusing to bind to {host}: the recognition server is localhost-only")
+
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.top = top
+        self.pool = InterpreterPool(model_path, workers)
+        self.labels = load_labels(labels_path, self.pool.num_classes, model_path)
+        self.batcher = DynamicBatcher(self.pool, max_batch_size, max_wait_ms)
+        self.lexicon = Lexicon.from_db(self.labels, lexicon_db) if lexicon_db else None
+        self.decode_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='decode')
+        self.started_at = time.time()
+        self.server = None
+
+    async def start(self):
+        self.batcher.start(self.workers)
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        print(f"🚀 Recognition server listening on http://{self.host}:{self.port}")
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        await self.batcher.stop()
+        self.pool.shutdown()
+        self.decode_executor.shutdown(wait=False)
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def recognize(self, payload):
+        samples = payload['samples'] if 'samples' in payload else [payload]
+        self.batcher.stats['requests'] += 1
+        self.batcher.stats['samples'] += len(samples)
+
+        # Decoding is CPU work, keep it off the event loop
+        loop = asyncio.get_running_loop()
+        images = await asyncio.gather(*[
+            loop.run_in_executor(self.decode_executor, _decode_request_sample, sample, INPUT_SIZE)
+            for sample in samples
+        ])
+        probabilities = await asyncio.gather(*[self.batcher.submit(image) for image in images])
+        results = top_k(np.stack(probabilities), self.labels, self.top)
+        return {'results': results} if 'samples' in payload else {'predictions': results[0]}
+
+    async def recognize_word(self, payload):
+        loop = asyncio.get_running_loop()
+        images, boxes = await loop.run_in_executor(self.decode_executor, line_segments, payload, INPUT_SIZE)
+        if not boxes:
+            return decode_line(np.zeros((0, len(self.labels))), boxes, self.labels, self.lexicon, self.top)
+        # All segments of the word go to the pool as one batch, bypassing the request batcher
+        probabilities = await self.pool.predict(to_model_input(images))
+        return decode_line(probabilities, boxes, self.labels, self.lexicon, self.top)
+
+    def get_stats(self):
+        stats = dict(self.batcher.stats)
+        stats['mean_batch_size'] = stats['batched_samples'] / max(stats['batches'], 1)
+        stats['uptime_seconds'] = time.time() - self.started_at
+        return stats
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                body = b''
+                if 'content-length' in headers:
+                    body = await reader.readexactly(int(headers['content-length']))
+
+                try:
+                    status, response = await self.route(method, path, body)
+                except Exception as e:
+                    # Answer instead of dropping the keep-alive connection
+                    print(f"❌ {method} {path}: {type(e).__name__}: {e}")
+                    status, response = '500 Internal Server Error', {'error': 'internal server error'}
+                data = json.dumps(response, ensure_ascii=False).encode('utf-8')
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(
+                    f"HTTP/1.1 {status}\r\n"
+                    f"Content-Type: application/json; charset=utf-8\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1')
+                    + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        if method == 'GET' and path == '/health':
+            return '200 OK', {'status': 'ok'}
+        if method == 'GET' and path == '/stats':
+            return '200 OK', self.get_stats()
+        if method == 'POST' and path == '/recognize':
+            try:
+                return '200 OK', await self.recognize(json.loads(body))
+            except (ValueError, KeyError, TypeError) as e:
+                return '400 Bad Request', {'error': str(e)}
+        if method == 'POST' and path == '/recognize-word':
+            try:
+                return '200 OK', await self.recognize_word(json.loads(body))
+            except (ValueError, KeyError, TypeError) as e:
+                return '400 Bad Request', {'error': str(e)}
+        return '404 Not Found', {'error': f"No route for {method} {path}"}
+
+
+async def post_json(reader, writer, host, path, payload):
+    data = json.dumps(payload).encode('utf-8')
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(data)}\r\n\r\n".encode('latin-1') + data
+    )
+    await writer.drain()
+
+    await reader.readline()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return json.loads(await reader.readexactly(length))
+
+
+async def load_test(host, port, payloads, concurrency=32, requests_per_client=50):
+    """Hammer the server with concurrent keep-alive clients and report throughput"""
+    latencies = []
+
+    async def client(client_id):
+        reader, writer = await asyncio.open_connection(host, port)
+        for i in range(requests_per_client):
+            payload = payloads[(client_id + i) % len(payloads)]
+            start = time.perf_counter()
+            await post_json(reader, writer, host, '/recognize', payload)
+            latencies.append(time.perf_counter() - start)
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(i) for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'requests_per_second': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+    }
+
+
+def load_payloads(export_path, limit=256):
+    """Sample payloads for the load test from a training export"""
+    with open(export_path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)['data'][:limit]
+    return [{'imageData': entry['imageData']} for entry in entries]
+
+
+async def run_load_test(server, args):
+    await server.start()
+    try:
+        payloads = load_payloads(args.load_test)
+        result = await load_test(server.host, server.port, payloads,
+                                 args.concurrency, args.requests_per_client)
+        result['server'] = server.get_stats()
+        print(json.dumps(result, indent=2))
+    finally:
+        await server.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local batched recognition server")
+    parser.add_argument('--model', default='japanese_character_model.tflite')
+    parser.add_argument('--labels', default='japanese_character_labels.txt')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=2, help="Interpreters in the pool")
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    parser.add_argument('--top', type=int, default=5)
+    parser.add_argument('--lexicon-db', default=DEFAULT_DB_PATH,
+                        help="App database whose sentences constrain /recognize-word ('' to disable)")
+    parser.add_argument('--load-test', metavar='EXPORT_JSON',
+                        help="Start the server, run a concurrent load test against it and exit")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests-per-client', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    server = RecognitionServer(
+        args.model, args.labels, args.host, args.port, args.workers,
+        args.max_batch_size, args.max_wait_ms, args.top,
+        args.lexicon_db if args.lexicon_db and os.path.exists(args.lexicon_db) else None,
+    )
+
+    try:
+        if args.load_test:
+            asyncio.run(run_load_test(server, args))
+        else:
+            asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        print("\nServer stopped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
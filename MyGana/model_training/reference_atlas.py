@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Reference Glyph Atlas for Japanese Character Recognition
+Renders every character's reference glyph from the AnimCJK SVG outlines in
+assets/HiraganaSVG and assets/KatakanaSVG at the model input resolution and
+packs the glyphs, precomputed features and (optionally) CNN embeddings into
+one binary atlas plus a JSON index
+
+Every section of the binary is a little-endian array at a 64-byte aligned offset
+listed in the index, so the app can memory-map the atlas and read references
+directly instead of rendering and base64-encoding them on every attempt.
+
+Examples:
+    python reference_atlas.py
+    python reference_atlas.py --model best_model.h5 --output ../assets/models/reference_atlas.bin
+"""
+
+import os
+import re
+import sys
+import json
+import sqlite3
+import hashlib
+import argparse
+
+import numpy as np
+
+from dedup import dhash, phash
+from label_registry import DEFAULT_DB_PATH
+from preprocessing import INPUT_SIZE, INK_THRESHOLD, to_model_input
+from stroke_scoring import ASSETS_DIR, SVG_DIRS, parse_reference_svg, prepare_batch
+
+ATLAS_FORMAT = 'mygana-reference-atlas'
+ATLAS_VERSION = 1
+ALIGNMENT = 64
+
+# Filled outline of each stroke (the medians are the clip-path paths)
+OUTLINE_PATTERN = re.compile(r'<path id="z\d+d\d+[a-z]?" d="([^"]+)"')
+TOKEN_PATTERN = re.compile(r'[A-Za-z]|-?\d*\.?\d+(?:[eE][-+]?\d+)?')
+CURVE_POINTS = {'L': 1, 'Q': 2, 'C': 3}
+
+
+def _bezier_matrix(degree, steps):
+    """Bernstein weights (steps, degree + 1) for points t = 1/steps ... 1 of a Bézier segment"""
+    t = np.linspace(0.0, 1.0, steps + 1)[1:, None]
+    k = np.arange(degree + 1)[None, :]
+    binomial = np.array([1, 2, 1]) if degree == 2 else np.array([1, 3, 3, 1])
+    return binomial * t ** k * (1 - t) ** (degree - k)
+
+
+def flatten_path(d, steps=8):
+    """Closed polygons ((K, 2) arrays) of an SVG path with absolute M/L/H/V/Q/C/Z commands"""
+    tokens = TOKEN_PATTERN.findall(d)
+    matrices = {2: _bezier_matrix(2, steps), 3: _bezier_matrix(3, steps)}
+    polygons, current = [], []
+    command, i = None, 0
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            command = tokens[i].upper()
+            if tokens[i].islower():
+                raise ValueError(f"Relative path command '{tokens[i]}' is not supported")
+            i += 1
+            if command == 'Z':
+                if len(current) > 2:
+                    polygons.append(np.array(current, dtype=np.float32))
+                current = []
+            continue
+
+        if command == 'M':
+            if len(current) > 2:
+                polygons.append(np.array(current, dtype=np.float32))
+            current = [(float(tokens[i]), float(tokens[i + 1]))]
+            command = 'L'  # further pairs after M are line-tos
+            i += 2
+            continue
+
+        if command in ('H', 'V'):
+            x, y = current[-1]
+            current.append((float(tokens[i]), y) if command == 'H' else (x, float(tokens[i])))
+            i += 1
+            continue
+
+        if command not in CURVE_POINTS:
+            raise ValueError(f"Path command '{command}' is not supported")
+        count = CURVE_POINTS[command]
+        points = [(float(tokens[i + 2 * j]), float(tokens[i + 2 * j + 1])) for j in range(count)]
+        i += 2 * count
+        if command == 'L':
+            current.extend(points)
+        else:
+            control = np.array([current[-1]] + points)
+            current.extend(map(tuple, matrices[count] @ control))
+
+    if len(current) > 2:
+        polygons.append(np.array(current, dtype=np.float32))
+    return polygons
+
+
+def parse_outlines(svg_path):
+    """Stroke outlines of an AnimCJK SVG (1024x1024 viewBox), one list of polygons per path"""
+    with open(svg_path, 'r', encoding='utf-8') as f:
+        svg = f.read()
+    return [flatten_path(d) for d in OUTLINE_PATTERN.findall(svg)]
+
+
+def fill_path(polygons, size):
+    """Coverage of one path's polygons under the SVG nonzero fill rule, sampled at pixel centres
+
+    Every edge adds its direction (+1 down, -1 up) at the first pixel right of
+    where it crosses each row centre; a cumulative sum along the rows then gives
+    the winding number of every pixel. Zero-area slivers, which some AnimCJK
+    outlines contain, cover no pixel centre and so leave no trace.
+    """
+    winding = np.zeros((size, size + 1), dtype=np.int32)
+    for polygon in polygons:
+        start, end = polygon, np.roll(polygon, -1, axis=0)
+        y0, y1 = start[:, 1], end[:, 1]
+        # Rows r whose centre r + 0.5 lies in [min(y0, y1), max(y0, y1)) of an edge
+        first = np.clip(np.ceil(np.minimum(y0, y1) - 0.5), 0, size).astype(np.int64)
+        last = np.clip(np.ceil(np.maximum(y0, y1) - 0.5), 0, size).astype(np.int64)
+        counts = last - first
+        edges = np.repeat(np.arange(len(polygon)), counts)
+        if len(edges) == 0:
+            continue
+        rows = np.arange(len(edges)) - np.repeat(np.cumsum(counts) - counts, counts) + first[edges]
+
+        t = (rows + 0.5 - y0[edges]) / (y1[edges] - y0[edges])
+        x = start[edges, 0] + t * (end[edges, 0] - start[edges, 0])
+        columns = np.clip(np.ceil(x - 0.5), 0, size).astype(np.int64)
+        np.add.at(winding, (rows, columns), np.where(y1[edges] > y0[edges], 1, -1))
+    return np.cumsum(winding, axis=1)[:, :size] != 0
+
+
+def render_glyph(paths, input_size=INPUT_SIZE, padding=6, fit_box=True, supersample=4):
+    """Rasterize filled outlines to a uint8 image, dark ink on white like the training data
+
+    With fit_box the glyph's bounding box is centered and scaled into the image
+    with the given padding, like render_strokes(); otherwise the whole 1024x1024
+    canvas is scaled down. Coverage is sampled at supersample x supersample points
+    per pixel for anti-aliased edges.
+    """
+    size = input_size * supersample
+    polygons = [polygon for path in paths for polygon in path]
+    if fit_box and polygons:
+        points = np.concatenate(polygons)
+        low = points.min(axis=0)
+        extent = points.max(axis=0) - low
+        scale = (input_size - 2 * padding) * supersample / max(extent.max(), 1.0)
+        offset = (size - extent * scale) / 2 - low * scale
+    else:
+        scale = size / 1024.0
+        offset = np.zeros(2)
+
+    ink = np.zeros((size, size), dtype=bool)
+    for path in paths:
+        ink |= fill_path([polygon * scale + offset for polygon in path], size)
+    coverage = ink.reshape(input_size, supersample, input_size, supersample).mean(axis=(1, 3))
+    return np.round(255 * (1 - coverage)).astype(np.uint8)
+
+
+def reference_svgs(db_path=DEFAULT_DB_PATH, assets_dir=ASSETS_DIR):
+    """(character, svg path) of every kana with a reference SVG, hiragana first, in database order"""
+    connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        references = []
+        for table, directory in SVG_DIRS.items():
+            for character, svg in connection.execute(f"SELECT character, svg FROM {table} ORDER BY id"):
+                svg_path = os.path.join(assets_dir, directory, svg or '')
+                if svg and os.path.exists(svg_path):
+                    references.append((character, svg_path))
+    finally:
+        connection.close()
+    return references
+
+
+def build_atlas(references, input_size=INPUT_SIZE, fit_box=True, num_points=32, embedding_model=None):
+    """Arrays of the atlas sections for a list of (character, svg path)"""
+    glyphs = np.stack([render_glyph(parse_outlines(path), input_size, fit_box=fit_box)
+                       for _, path in references])
+    medians, stroke_counts = prepare_batch([parse_reference_svg(path) for _, path in references],
+                                           num_points)
+    ink = glyphs < INK_THRESHOLD
+    rows, columns = ink.any(axis=2), ink.any(axis=1)
+
+    sections = {
+        'glyphs': glyphs,
+        'stroke_counts': stroke_counts.astype(np.uint8),
+        'stroke_offsets': np.concatenate([[0], np.cumsum(stroke_counts)]).astype(np.int32),
+        # Reference strokes in the unit square, resampled like user strokes in stroke_scoring.py
+        'stroke_medians': medians.astype(np.float32),
+        'ink_ratio': ink.mean(axis=(1, 2)).astype(np.float32),
+        'aspect_ratio': (columns.sum(axis=1) / np.maximum(rows.sum(axis=1), 1)).astype(np.float32),
+        'dhash': dhash(glyphs),
+        'phash': phash(glyphs),
+    }
+    if embedding_model is not None:
+        from embedding_index import compute_embeddings, normalize
+        embeddings = compute_embeddings(embedding_model, to_model_input(glyphs))
+        sections['embeddings'] = normalize(embeddings).astype(np.float16)
+    return sections
+
+
+def write_atlas(sections, characters, output_path, index_path, metadata=None):
+    """Write the sections into one aligned binary and describe them in a JSON index"""
+    index = {
+        'format': ATLAS_FORMAT,
+        'version': ATLAS_VERSION,
+        'byte_order': 'little',
+        'binary': os.path.basename(output_path),
+        'characters': list(characters),
+        'sections': {},
+    }
+    index.update(metadata or {})
+
+    digest = hashlib.sha256()
+    offset = 0
+    with open(output_path, 'wb') as f:
+        for name, array in sections.items():
+            padding = -offset % ALIGNMENT
+            f.write(b'\0' * padding)
+            digest.update(b'\0' * padding)
+            offset += padding
+
+            data = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<')).tobytes()
+            f.write(data)
+            digest.update(data)
+            index['sections'][name] = {
+                'dtype': array.dtype.name,
+                'shape': list(array.shape),
+                'offset': offset,
+                'nbytes': len(data),
+            }
+            offset += len(data)
+    index['size_bytes'] = offset
+    index['sha256'] = digest.hexdigest()
+
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    return index
+
+
+def load_atlas(index_path):
+    """(index, {section: read-only memory-mapped array}) of an atlas written by write_atlas()"""
+    with open(index_path, 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    if index.get('format') != ATLAS_FORMAT or index.get('version') != ATLAS_VERSION:
+        raise ValueError(f"{index_path} is not a version {ATLAS_VERSION} reference atlas")
+
+    binary_path = os.path.join(os.path.dirname(index_path), index['binary'])
+    sections = {
+        name: np.memmap(binary_path, dtype=np.dtype(section['dtype']).newbyteorder('<'), mode='r',
+                        offset=section['offset'], shape=tuple(section['shape']))
+        for name, section in index['sections'].items()
+    }
+    return index, sections
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the reference glyph atlas from the AnimCJK SVGs")
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help="App database with the SVG file names")
+    parser.add_argument('--assets', default=ASSETS_DIR)
+    parser.add_argument('--output', default='reference_atlas.bin')
+    parser.add_argument('--index', default=None, help="JSON index (default: <output>.json)")
+    parser.add_argument('--input-size', type=int, default=INPUT_SIZE)
+    parser.add_argument('--canvas', action='store_true',
+                        help="Keep the glyph's position on the 1024x1024 canvas instead of fitting its box")
+    parser.add_argument('--model', default=None,
+                        help="Keras model whose Dense(256) embeddings are added to the atlas")
+    args = parser.parse_args(argv)
+    index_path = args.index or os.path.splitext(args.output)[0] + '.json'
+
+    references = reference_svgs(args.db, args.assets)
+    if not references:
+        print(f"❌ No reference SVGs found under {args.assets}")
+        return 1
+
+    embedding_model = None
+    if args.model:
+        from tensorflow import keras
+        from embedding_index import build_embedding_model
+        embedding_model = build_embedding_model(keras.models.load_model(args.model))
+
+    sections = build_atlas(references, args.input_size, not args.canvas, embedding_model=embedding_model)
+    metadata = {
+        'input_size': args.input_size,
+        'fit': 'canvas' if args.canvas else 'box',
+        'svg': [os.path.basename(path) for _, path in references],
+        'embedding_model': os.path.basename(args.model) if args.model else None,
+    }
+    index = write_atlas(sections, [character for character, _ in references], args.output, index_path,
+                        metadata)
+
+    print(f"✅ {len(references)} reference glyphs at {args.input_size}x{args.input_size}, "
+          f"sections: {', '.join(index['sections'])}")
+    print(f"📁 Atlas saved to {args.output} ({index['size_bytes'] / 1024:.1f} KB) with index {index_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,22 +7,22 @@ Run this to quickly train a model with synthetic data
 import os
 import sys
 import subprocess
+import importlib.util
 
 def check_requirements():
-    """Check if required packages are installed"""
-    try:
-        import tensorflow as tf
-        import numpy as np
-        import matplotlib.pyplot as plt
-        import sklearn
-        import cv2
-        from PIL import Image
-        print("✅ All required packages are installed!")
-        return True
-    except ImportError as e:
-        print(f"❌ Missing package: {e}")
+    """Check if required packages are installed (without importing them)"""
+    missing = [name for name in ('tensorflow', 'numpy', 'matplotlib', 'sklearn', 'cv2', 'PIL')
+               if importlib.util.find_spec(name) is None]
+    if missing:
+        print(f"❌ Missing packages: {', '.join(missing)}")
         print("Please install requirements: pip install -r requirements.txt")
         return False
+    print("✅ All required packages are installed!")
+    return True
+
+def run_streaming(args):
+    """Run a script unbuffered so its output streams to the console as it runs"""
+    return subprocess.run([sys.executable, '-u'] + args)
 
 def run_quick_training():
     """Run quick training with synthetic data"""
@@ -30,8 +30,7 @@ def run_quick_training():
     
     try:
         # Run the quick training script
-        result = subprocess.run([sys.executable, 'quick_train.py'], 
-                              capture_output=True, text=True)
+        result = run_streaming(['quick_train.py'])
         
         if result.returncode == 0:
             print("✅ Training completed successfully!")
@@ -43,8 +42,7 @@ def run_quick_training():
             print("   2. Hot restart your Flutter app")
             print("   3. Test the recognition accuracy!")
         else:
-            print("❌ Training failed:")
-            print(result.stderr)
+            print(f"❌ Training failed (exit status {result.returncode})")
             
     except Exception as e:
         print(f"❌ Error running training: {e}")
@@ -60,9 +58,8 @@ def run_full_training():
         return
     
     try:
-        # Run the full training script
-        result = subprocess.run([sys.executable, 'train_japanese_model.py'], 
-                              capture_output=True, text=True)
+        # Run the full training pipeline through the CLI
+        result = run_streaming(['cli.py', 'train'])
         
         if result.returncode == 0:
             print("✅ Full training completed successfully!")
@@ -71,8 +68,7 @@ def run_full_training():
             print("   - japanese_character_model.tflite (TensorFlow Lite model)")
             print("   - training_history.png (Training graphs)")
         else:
-            print("❌ Training failed:")
-            print(result.stderr)
+            print(f"❌ Training failed (exit status {result.returncode})")
             
     except Exception as e:
         print(f"❌ Error running training: {e}")
@@ -99,7 +95,7 @@ def main():
         run_full_training()
     elif choice == '3':
         print("🚀 Generating synthetic data...")
-        subprocess.run([sys.executable, 'collect_training_data.py'])
+        run_streaming(['cli.py', 'generate'])
     else:
         print("❌ Invalid choice!")
 
@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+Sharded On-Disk Dataset for Japanese Character Recognition
+Packs exports into fixed-size uint8 shards and streams them for training,
+so memory use stays constant no matter how large the dataset gets
+
+With --binarize, samples are stored as 1-bit ink masks (np.packbits, 512 bytes
+per 64x64 sample instead of 4096).
+"""
+
+import os
+import sys
+import json
+import argparse
+from multiprocessing import Pool
+
+import numpy as np
+from PIL import Image
+
+from characters import HIRAGANA
+from preprocessing import INPUT_SIZE, INK_THRESHOLD, decode_image_data, pack_bits, unpack_bits
+
+INDEX_FILE = 'index.json'
+SPLIT_BUCKETS = 10000
+CLASS_SHARD_BLOCK_SIZE = 64
+
+
+def iter_export_entries(export_path):
+    """Yield entries of an export, streaming with ijson when it is installed"""
+    with open(export_path, 'rb') as f:
+        try:
+            import ijson
+        except ImportError:
+            ijson = None
+
+        if ijson is not None:
+            yield from ijson.items(f, 'data.item')
+        else:
+            # Falls back to loading the whole export at once
+            yield from json.load(f)['data']
+
+
+def iter_image_folder(directory):
+    """Yield entries of a <character>/<sample>.png folder tree like dataset/"""
+    for character in sorted(os.listdir(directory)):
+        class_dir = os.path.join(directory, character)
+        if not os.path.isdir(class_dir):
+            continue
+        for name in sorted(os.listdir(class_dir)):
+            if name.lower().endswith('.png'):
+                yield {'character': character, 'imagePath': os.path.join(class_dir, name)}
+
+
+def _decode_entry(args):
+    entry, character_to_index, input_size = args
+    label = character_to_index.get(entry.get('character'))
+    if label is None:
+        return None
+    try:
+        if 'imagePath' in entry:
+            with Image.open(entry['imagePath']) as image:
+                return np.asarray(image.convert('L').resize((input_size, input_size)), dtype=np.uint8), label
+        return decode_image_data(entry['imageData'], input_size), label
+    except Exception:
+        return None
+
+
+def unpack_bits_tf(packed, input_size=INPUT_SIZE):
+    """In-graph version of preprocessing.packed_to_model_input for a batch of packed rows"""
+    import tensorflow as tf
+
+    shifts = tf.constant([7, 6, 5, 4, 3, 2, 1, 0], dtype=tf.uint8)
+    bits = tf.bitwise.bitwise_and(tf.bitwise.right_shift(packed[..., tf.newaxis], shifts), 1)
+    bits = tf.reshape(bits, (tf.shape(packed)[0], -1))[:, :input_size * input_size]
+    return 1.0 - tf.cast(tf.reshape(bits, (-1, input_size, input_size, 1)), tf.float32)
+
+
+def build_augmentation(rotation_range=10, shift_range=0.1, zoom_range=0.1):
+    """Keras preprocessing layers matching the ImageDataGenerator ranges (None if all are 0)"""
+    from tensorflow import keras
+
+    layers = []
+    if rotation_range:
+        layers.append(keras.layers.RandomRotation(rotation_range / 360, fill_mode='nearest'))
+    if shift_range:
+        layers.append(keras.layers.RandomTranslation(shift_range, shift_range, fill_mode='nearest'))
+    if zoom_range:
+        layers.append(keras.layers.RandomZoom(zoom_range, fill_mode='nearest'))
+    return keras.Sequential(layers) if layers else None
+
+
+class ShardWriter:
+    """Appends samples to fixed-size shard files and keeps the index up to date"""
+
+    def __init__(self, output_dir, labels=None, shard_size=65536, input_size=INPUT_SIZE,
+                 binarize_threshold=None):
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.input_size = input_size
+        os.makedirs(output_dir, exist_ok=True)
+
+        index_path = os.path.join(output_dir, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+        else:
+            self.index = {
+                'input_size': input_size,
+                'labels': list(labels or HIRAGANA),
+                'shards': [],
+                'total_samples': 0,
+            }
+            if binarize_threshold is not None:
+                self.index['packed'] = True
+                self.index['threshold'] = int(binarize_threshold)
+
+        if binarize_threshold is not None and self.index.get('threshold') != binarize_threshold:
+            raise ValueError(f"{output_dir} is not bit-packed with threshold {binarize_threshold}")
+        self.packed = self.index.get('packed', False)
+        self.threshold = self.index.get('threshold', INK_THRESHOLD)
+
+        # Packing happens per shard at flush, so the staging buffer stays uint8
+        self.images = np.empty((shard_size, input_size, input_size), dtype=np.uint8)
+        self.labels = np.empty(shard_size, dtype=np.int16)
+        self.count = 0
+
+    def append(self, image, label):
+        self.images[self.count] = image
+        self.labels[self.count] = label
+        self.count += 1
+        if self.count == self.shard_size:
+            self.flush()
+
+    def flush(self):
+        """Write buffered samples as a new shard"""
+        if self.count == 0:
+            return
+
+        name = f"shard_{len(self.index['shards']):05d}"
+        images = self.images[:self.count]
+        if self.packed:
+            images = pack_bits(images, self.threshold)
+        np.save(os.path.join(self.output_dir, f"{name}.images.npy"), images)
+        np.save(os.path.join(self.output_dir, f"{name}.labels.npy"), self.labels[:self.count])
+
+        self.add_shard(name, self.count)
+        self.count = 0
+
+    def add_shard(self, name, num_samples, label=None, compose=None):
+        """Register a shard whose files are already written, e.g. by a worker process
+
+        A label marks a class shard holding samples of one class only. A compose
+        recipe ({'base': shard name, 'mark': ..., 'seed': ...}) registers a voiced-kana
+        class shard that has no files and is composed from its base shard when read.
+        """
+        shard = {'name': name, 'num_samples': int(num_samples)}
+        if compose is not None:
+            shard['compose'] = dict(compose)
+        if label is not None:
+            shard['label'] = int(label)
+            # Class shards are read in small blocks so the shuffle buffer mixes many classes
+            self.index['block_size'] = CLASS_SHARD_BLOCK_SIZE
+        self.index['shards'].append(shard)
+        self.index['total_samples'] += int(num_samples)
+        self.write_index()
+
+    def write_index(self):
+        # Write then rename so readers never see a half-written index
+        index_path = os.path.join(self.output_dir, INDEX_FILE)
+        with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, ensure_ascii=False, indent=2)
+        os.replace(index_path + '.tmp', index_path)
+
+
+def pack_exports(export_paths, output_dir, shard_size=65536, workers=None, input_size=INPUT_SIZE,
+                 binarize_threshold=None):
+    """Decode one or more exports (or PNG folder trees) into a sharded dataset directory"""
+    writer = ShardWriter(output_dir, shard_size=shard_size, input_size=input_size,
+                         binarize_threshold=binarize_threshold)
+    character_to_index = {char: i for i, char in enumerate(writer.index['labels'])}
+    skipped = 0
+
+    with Pool(workers) as pool:
+        for export_path in export_paths:
+            print(f"Packing {export_path}...")
+            entries = iter_image_folder(export_path) if os.path.isdir(export_path) \
+                else iter_export_entries(export_path)
+            tasks = ((entry, character_to_index, input_size) for entry in entries)
+            for result in pool.imap(_decode_entry, tasks, chunksize=256):
+                if result is None:
+                    skipped += 1
+                    continue
+                writer.append(*result)
+
+    writer.flush()
+    print(f"Packed {writer.index['total_samples']} samples into "
+          f"{len(writer.index['shards'])} shards ({skipped} skipped)"
+          + (f", bit-packed at threshold {writer.threshold}" if writer.packed else ""))
+    return writer.index
+
+
+class ShardedDataset:
+    """Memory-mapped view over a sharded dataset directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE), 'r', encoding='utf-8') as f:
+            self.index = json.load(f)
+        self.input_size = self.index['input_size']
+        self.labels = self.index['labels']
+        self.shards = self.index['shards']
+        self.packed = self.index.get('packed', False)
+        # Shape of one stored sample: an image, or its packed bit row
+        self.sample_shape = ((self.input_size * self.input_size + 7) // 8,) if self.packed \
+            else (self.input_size, self.input_size)
+
+        self._composer = None
+        # Unpacked base images of composed shards, per (base shard, split)
+        self._compose_bases = {}
+
+        # Global index of the first sample of each shard
+        self.offsets = np.cumsum([0] + [s['num_samples'] for s in self.shards])[:-1]
+
+    def __len__(self):
+        return self.index['total_samples']
+
+    def load_shard(self, shard_id):
+        """Memory-map one shard (pages are read lazily by the OS)"""
+        if 'compose' in self.shards[shard_id]:
+            return self._compose_shard(self.shards[shard_id])
+        name = self.shards[shard_id]['name']
+        images = np.load(os.path.join(self.directory, f"{name}.images.npy"), mmap_mode='r')
+        labels = np.load(os.path.join(self.directory, f"{name}.labels.npy"), mmap_mode='r')
+        return images, labels
+
+    def _compose_shard(self, shard):
+        """Samples of a composed voiced-kana shard, the same on every read for a given seed"""
+        images = self._compose(shard, np.arange(shard['num_samples']))
+        return images, np.full(shard['num_samples'], shard['label'], dtype=np.int16)
+
+    def _compose(self, shard, indices, split=None, validation_split=0.2, seed=42):
+        """Composed samples at the given positions of a voiced-kana shard
+
+        Each sample depends only on its position, so a block is composed on its own.
+        With a split, marks only go onto base samples of that split, so a validation
+        base glyph never reaches training as its voiced form.
+        """
+        from collect_training_data import DiacriticComposer
+
+        if self._composer is None:
+            self._composer = DiacriticComposer(input_size=self.input_size)
+        recipe = shard['compose']
+        key = (recipe['base'], split, validation_split, seed)
+        if key not in self._compose_bases:
+            base_id = next(i for i, s in enumerate(self.shards) if s['name'] == recipe['base'])
+            base = np.load(os.path.join(self.directory, f"{recipe['base']}.images.npy"), mmap_mode='r')
+            if split is not None:
+                is_val = self.split_mask(np.arange(len(base)) + self.offsets[base_id], validation_split, seed)
+                base = base[is_val if split == 'validation' else ~is_val]
+            self._compose_bases[key] = unpack_bits(base, self.input_size) if self.packed else np.asarray(base)
+        base = self._compose_bases[key]
+        if len(base) == 0:
+            raise ValueError(f"No {split} samples of {recipe['base']} to compose {shard['name']} from")
+
+        images = self._composer.compose_batch(base, recipe['mark'], len(indices), recipe['seed'], indices=indices)
+        if self.packed:
+            images = pack_bits(images, self.index['threshold'])
+        return images
+
+    @staticmethod
+    def split_mask(global_indices, validation_split, seed=42):
+        """Deterministic train/validation assignment from the sample index alone"""
+        # Multiplicative hash so the split needs no per-sample state
+        hashed = (np.asarray(global_indices, dtype=np.uint64) * np.uint64(2654435761)
+                  + np.uint64(seed)) % np.uint64(2 ** 32)
+        return (hashed % SPLIT_BUCKETS) < int(validation_split * SPLIT_BUCKETS)
+
+    def count(self, split='train', validation_split=0.2, seed=42):
+        """Number of samples in a split, computed one shard at a time"""
+        total = 0
+        for shard_id, shard in enumerate(self.shards):
+            indices = np.arange(shard['num_samples']) + self.offsets[shard_id]
+            is_val = self.split_mask(indices, validation_split, seed)
+            total += int(is_val.sum()) if split == 'validation' else int((~is_val).sum())
+        return total
+
+    def stream(self, split='train', validation_split=0.2, shuffle_buffer=0,
+               block_size=None, seed=42, epoch=0, num_workers=1, worker_index=0):
+        """Yield (image, label) pairs of a split using a bounded shuffle buffer
+
+        Images of bit-packed datasets stay packed (see sample_shape), which also
+        makes the shuffle buffer 8x smaller. With num_workers > 1 every block is cut
+        into num_workers contiguous slices and only slice worker_index is read, so
+        distributed workers see disjoint, equally sized parts of the shard files even
+        when there are fewer blocks than workers.
+        """
+        rng = np.random.default_rng(seed + epoch)
+        block_size = block_size or self.index.get('block_size', 4096)
+
+        # Contiguous blocks from all shards, read in random order to keep I/O sequential
+        # within a block while mixing shards (and classes, for class shards)
+        blocks = [(shard_id, start, min(start + block_size, shard['num_samples']))
+                  for shard_id, shard in enumerate(self.shards)
+                  for start in range(0, shard['num_samples'], block_size)]
+        if num_workers > 1:
+            blocks = [(shard_id, start + (end - start) * worker_index // num_workers,
+                       start + (end - start) * (worker_index + 1) // num_workers)
+                      for shard_id, start, end in blocks]
+            blocks = [block for block in blocks if block[2] > block[1]]
+        order = rng.permutation(len(blocks)) if shuffle_buffer else range(len(blocks))
+
+        buffer_images = np.empty((max(shuffle_buffer, 1),) + self.sample_shape, dtype=np.uint8)
+        buffer_labels = np.empty(max(shuffle_buffer, 1), dtype=np.int16)
+        filled = 0
+        loaded_shard = None
+
+        for block_id in order:
+            shard_id, start, end = blocks[block_id]
+            shard = self.shards[shard_id]
+            indices = np.arange(start, end) + self.offsets[shard_id]
+            is_val = self.split_mask(indices, validation_split, seed)
+            keep = is_val if split == 'validation' else ~is_val
+
+            if 'compose' in shard:
+                # Only the kept samples of this block are composed
+                block_images = self._compose(shard, np.arange(start, end)[keep], split, validation_split, seed)
+                block_labels = np.full(len(block_images), shard['label'], dtype=np.int16)
+            else:
+                if shard_id != loaded_shard:
+                    images, labels = self.load_shard(shard_id)
+                    loaded_shard = shard_id
+                block_images = np.asarray(images[start:end])[keep]
+                block_labels = np.asarray(labels[start:end])[keep]
+
+            if not shuffle_buffer:
+                yield from zip(block_images, block_labels)
+                continue
+
+            for image, label in zip(block_images, block_labels):
+                if filled < shuffle_buffer:
+                    buffer_images[filled] = image
+                    buffer_labels[filled] = label
+                    filled += 1
+                    continue
+                # Emit a random buffered sample and replace it
+                slot = rng.integers(shuffle_buffer)
+                yield buffer_images[slot].copy(), buffer_labels[slot]
+                buffer_images[slot] = image
+                buffer_labels[slot] = label
+
+        # Drain the buffer
+        for slot in rng.permutation(filled) if shuffle_buffer else []:
+            yield buffer_images[slot], buffer_labels[slot]
+
+    def as_tf_dataset(self, split='train', batch_size=32, validation_split=0.2,
+                      shuffle_buffer=8192, augment=False, seed=42, num_workers=1, worker_index=0):
+        """Batched tf.data pipeline over the stream, re-shuffled every epoch
+
+        augment is True for the default ranges or a dict of build_augmentation() arguments.
+        """
+        import tensorflow as tf
+        from tensorflow import keras
+
+        size = self.input_size
+        epoch_counter = {'epoch': 0}
+
+        def generator():
+            yield from self.stream(split, validation_split, shuffle_buffer, seed=seed,
+                                   epoch=epoch_counter['epoch'], num_workers=num_workers,
+                                   worker_index=worker_index)
+            epoch_counter['epoch'] += 1
+
+        dataset = tf.data.Dataset.from_generator(
+            generator,
+            output_signature=(
+                tf.TensorSpec(shape=self.sample_shape, dtype=tf.uint8),
+                tf.TensorSpec(shape=(), dtype=tf.int16),
+            ),
+        )
+
+        def normalize(images, labels):
+            if self.packed:
+                images = unpack_bits_tf(images, size)
+            else:
+                images = tf.cast(images, tf.float32)[..., tf.newaxis] / 255.0
+            return images, tf.cast(labels, tf.int32)
+
+        # Converted per batch, so packed bits are only expanded right before the model
+        dataset = dataset.batch(batch_size)
+        dataset = dataset.map(normalize, num_parallel_calls=tf.data.AUTOTUNE)
+
+        # True means the same ranges as the in-memory ImageDataGenerator
+        augmentation = build_augmentation(**(augment if isinstance(augment, dict) else {})) if augment else None
+        if augmentation is not None:
+            dataset = dataset.map(lambda x, y: (augmentation(x, training=True), y),
+                                  num_parallel_calls=tf.data.AUTOTUNE)
+
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pack training exports into on-disk shards")
+    parser.add_argument('exports', nargs='+', help="Export JSON files or <character>/*.png folders")
+    parser.add_argument('--output', default='dataset_shards')
+    parser.add_argument('--shard-size', type=int, default=65536)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--binarize', type=int, nargs='?', const=INK_THRESHOLD, default=None,
+                        metavar='THRESHOLD', help=f"Store 1-bit ink masks (default threshold {INK_THRESHOLD})")
+    args = parser.parse_args(argv)
+
+    pack_exports(args.exports, args.output, args.shard_size, args.workers, binarize_threshold=args.binarize)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,35 +2,113 @@
 """
 Simple Japanese Character Recognition WITHOUT TensorFlow
 Uses scikit-learn for basic ML training
+
+Backends: random_forest (all cores), hist_gradient_boosting (early stopping),
+and linear / svm on PCA-compacted features. `--compare` reports fit time,
+prediction latency, model size and accuracy for each.
 """
 
 import os
+import sys
 import json
+import time
+import argparse
 import numpy as np
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, classification_report
 import pickle
 from PIL import Image
 import base64
 import io
 import random
 
+from characters import HIRAGANA
+
+COMPACT_FEATURES = 32
+
+
+def random_forest(n_jobs=-1):
+    from sklearn.ensemble import RandomForestClassifier
+    return RandomForestClassifier(n_estimators=100, random_state=42, max_depth=10, n_jobs=n_jobs)
+
+
+def hist_gradient_boosting(n_jobs=-1):
+    # Threads come from OpenMP, not n_jobs
+    from sklearn.ensemble import HistGradientBoostingClassifier
+    return HistGradientBoostingClassifier(max_iter=200, early_stopping=True, validation_fraction=0.1,
+                                          n_iter_no_change=10, random_state=42)
+
+
+def linear(n_jobs=-1):
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.decomposition import PCA
+    from sklearn.linear_model import LogisticRegression
+    return make_pipeline(StandardScaler(), PCA(COMPACT_FEATURES, random_state=42),
+                         LogisticRegression(max_iter=1000))
+
+
+def svm(n_jobs=-1):
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.decomposition import PCA
+    from sklearn.svm import SVC
+    from sklearn.calibration import CalibratedClassifierCV
+    # Calibrated probabilities for predict_proba (SVC(probability=True) is deprecated)
+    return make_pipeline(StandardScaler(), PCA(COMPACT_FEATURES, random_state=42),
+                         CalibratedClassifierCV(SVC(), ensemble=False, n_jobs=n_jobs))
+
+
+BACKENDS = {
+    'random_forest': random_forest,
+    'hist_gradient_boosting': hist_gradient_boosting,
+    'linear': linear,
+    'svm': svm,
+}
+
+
+def final_estimator(model):
+    """The classifier itself when the model is a preprocessing pipeline"""
+    return model.steps[-1][1] if hasattr(model, 'steps') else model
+
+
+def feature_importances(model):
+    """Per-input-feature importances for any backend (uniform when the model has none)"""
+    estimator = final_estimator(model)
+    if hasattr(estimator, 'feature_importances_'):
+        return np.asarray(estimator.feature_importances_)
+    if hasattr(estimator, 'coef_') and hasattr(model, 'steps'):
+        # Map linear weights back through PCA and scaling to the input features
+        weights = np.abs(estimator.coef_).mean(axis=0)
+        for _, step in reversed(model.steps[:-1]):
+            if hasattr(step, 'components_'):
+                weights = np.abs(step.components_).T @ weights
+            elif hasattr(step, 'scale_'):
+                weights = weights / step.scale_
+        return weights / weights.sum()
+    n_features = model.n_features_in_
+    return np.full(n_features, 1.0 / n_features)
+
+
+def image_features(images, grid=8):
+    """Compact features: mean ink per cell of a grid x grid layout (64 for 8x8)"""
+    images = np.asarray(images, dtype=np.float32)
+    n, height, width = images.shape
+    cells = images[:, :height - height % grid, :width - width % grid]
+    cells = cells.reshape(n, grid, height // grid, grid, width // grid).mean(axis=(2, 4))
+    return (1.0 - cells / 255.0).reshape(n, -1)
+
+
+def model_size_bytes(model):
+    return len(pickle.dumps(model))
+
+
 class SimpleJapaneseRecognizer:
-    def __init__(self):
+    def __init__(self, backend='random_forest', n_jobs=-1):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}', choose from {sorted(BACKENDS)}")
         self.model = None
-        self.characters = [
-            'あ', 'い', 'う', 'え', 'お',
-            'か', 'き', 'く', 'け', 'こ',
-            'さ', 'し', 'す', 'せ', 'そ',
-            'た', 'ち', 'つ', 'て', 'と',
-            'な', 'に', 'ぬ', 'ね', 'の',
-            'は', 'ひ', 'ふ', 'へ', 'ほ',
-            'ま', 'み', 'む', 'め', 'も',
-            'や', 'ゆ', 'よ',
-            'ら', 'り', 'る', 'れ', 'ろ',
-            'わ', 'を', 'ん'
-        ]
+        self.backend = backend
+        self.n_jobs = n_jobs
+        self.characters = list(HIRAGANA)
         self.character_to_index = {char: i for i, char in enumerate(self.characters)}
     
     def generate_simple_data(self, num_samples_per_char=100):
@@ -72,9 +150,35 @@ class SimpleJapaneseRecognizer:
         
         return features
     
+    def load_export_features(self, export_path):
+        """Image features and labels of an export, for training on real data"""
+        from preprocessing import decode_sample
+        
+        with open(export_path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)['data']
+        
+        images, labels = [], []
+        for entry in entries:
+            label = self.character_to_index.get(entry.get('character'))
+            if label is None:
+                continue
+            try:
+                images.append(decode_sample(entry))
+                labels.append(label)
+            except Exception:
+                continue
+        
+        return image_features(np.stack(images)), np.array(labels)
+    
+    def create_model(self):
+        return BACKENDS[self.backend](self.n_jobs)
+    
     def train_model(self, X, y):
-        """Train a simple Random Forest model"""
-        print("🌲 Training Random Forest model...")
+        """Train the selected backend and report held-out accuracy"""
+        from sklearn.model_selection import train_test_split
+        from sklearn.metrics import accuracy_score, classification_report
+        
+        print(f"🌲 Training {self.backend} model...")
         
         # Split data
         X_train, X_test, y_train, y_test = train_test_split(
@@ -82,12 +186,7 @@ class SimpleJapaneseRecognizer:
         )
         
         # Train model
-        self.model = RandomForestClassifier(
-            n_estimators=100,
-            random_state=42,
-            max_depth=10
-        )
-        
+        self.model = self.create_model()
         self.model.fit(X_train, y_train)
         
         # Evaluate
@@ -99,7 +198,8 @@ class SimpleJapaneseRecognizer:
         # Print classification report
         print("\n📊 Classification Report:")
         target_names = [self.characters[i] for i in range(len(self.characters))]
-        print(classification_report(y_test, y_pred, target_names=target_names))
+        print(classification_report(y_test, y_pred, labels=range(len(self.characters)),
+                                    target_names=target_names, zero_division=0))
         
         return accuracy
     
@@ -120,35 +220,119 @@ class SimpleJapaneseRecognizer:
             return self.characters[prediction], confidence
         return 'あ', 0.5
 
-def main():
+def compare_backends(X, y, backends=None, n_jobs=-1, single_repeats=50,
+                     target_accuracy=None, report_path='backend_comparison.json'):
+    """Fit every backend on the same split and measure cost against accuracy"""
+    from sklearn.model_selection import train_test_split
+    
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    results = []
+    
+    for name in backends or BACKENDS:
+        print(f"⏱️  {name}...")
+        model = BACKENDS[name](n_jobs)
+        start = time.perf_counter()
+        model.fit(X_train, y_train)
+        fit_seconds = time.perf_counter() - start
+        
+        # One sample at a time is how the app calls it
+        single = []
+        for i in range(min(single_repeats, len(X_test))):
+            start = time.perf_counter()
+            model.predict_proba(X_test[i:i + 1])
+            single.append(time.perf_counter() - start)
+        
+        start = time.perf_counter()
+        predictions = model.classes_[np.argmax(model.predict_proba(X_test), axis=1)]
+        batch_seconds = time.perf_counter() - start
+        
+        results.append({
+            'backend': name,
+            'accuracy': float(np.mean(predictions == y_test)),
+            'fit_seconds': fit_seconds,
+            'single_latency_ms': float(np.median(single)) * 1000,
+            'batch_latency_ms_per_sample': batch_seconds / len(X_test) * 1000,
+            'model_size_bytes': model_size_bytes(model),
+        })
+    
+    print(f"\n{'backend':<24} {'accuracy':>8} {'fit s':>8} {'1 sample ms':>12} "
+          f"{'batch ms/sample':>16} {'size KB':>9}")
+    for r in sorted(results, key=lambda r: r['single_latency_ms']):
+        print(f"{r['backend']:<24} {r['accuracy']:>8.3f} {r['fit_seconds']:>8.2f} "
+              f"{r['single_latency_ms']:>12.3f} {r['batch_latency_ms_per_sample']:>16.4f} "
+              f"{r['model_size_bytes'] / 1024:>9.1f}")
+    
+    recommended = None
+    if target_accuracy is not None:
+        # Cheapest to run per sample among the backends that are accurate enough
+        passing = [r for r in results if r['accuracy'] >= target_accuracy]
+        if passing:
+            recommended = min(passing, key=lambda r: r['single_latency_ms'])['backend']
+            print(f"\n✅ Cheapest backend with accuracy >= {target_accuracy}: {recommended}")
+        else:
+            print(f"\n❌ No backend reaches accuracy {target_accuracy}")
+    
+    report = {
+        'train_samples': int(len(X_train)),
+        'test_samples': int(len(X_test)),
+        'n_features': int(X.shape[1]),
+        'cpu_count': os.cpu_count(),
+        'target_accuracy': target_accuracy,
+        'recommended': recommended,
+        'results': results,
+    }
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"📁 Comparison saved to {report_path}")
+    return report
+
+def main(argv=None):
     """Main training function"""
+    parser = argparse.ArgumentParser(description="Train the scikit-learn recognizer")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='random_forest')
+    parser.add_argument('--n-jobs', type=int, default=-1)
+    parser.add_argument('--data', help="Train on image features of an export instead of generated features")
+    parser.add_argument('--samples-per-char', type=int, default=50)
+    parser.add_argument('--compare', action='store_true', help="Compare all backends instead of training one")
+    parser.add_argument('--target-accuracy', type=float, default=None)
+    args = parser.parse_args(argv)
+    
     print("🇯🇵 Simple Japanese Character Recognition")
     print("=" * 50)
     
     # Create recognizer
-    recognizer = SimpleJapaneseRecognizer()
+    recognizer = SimpleJapaneseRecognizer(args.backend, args.n_jobs)
     
     # Generate training data
-    X, y = recognizer.generate_simple_data(num_samples_per_char=50)
+    if args.data:
+        X, y = recognizer.load_export_features(args.data)
+    else:
+        X, y = recognizer.generate_simple_data(num_samples_per_char=args.samples_per_char)
     
     print(f"📊 Training data: {X.shape[0]} samples, {X.shape[1]} features")
     
+    if args.compare:
+        report = compare_backends(X, y, n_jobs=args.n_jobs, target_accuracy=args.target_accuracy)
+        return 0 if args.target_accuracy is None or report['recommended'] else 1
+    
     # Train model
     accuracy = recognizer.train_model(X, y)
     
     # Save model
     recognizer.save_model()
     
-    # Test predictions
-    print("\n🧪 Testing predictions:")
-    for char in ['あ', 'い', 'う', 'え', 'お']:
-        features = recognizer.create_character_features(char)
-        predicted_char, confidence = recognizer.predict_character(features)
-        print(f"   {char} -> {predicted_char} (confidence: {confidence:.3f})")
+    # Test predictions (generated features only)
+    if not args.data:
+        print("\n🧪 Testing predictions:")
+        for char in ['あ', 'い', 'う', 'え', 'お']:
+            features = recognizer.create_character_features(char)
+            predicted_char, confidence = recognizer.predict_character(features)
+            print(f"   {char} -> {predicted_char} (confidence: {confidence:.3f})")
     
     print(f"\n🎉 Training complete! Final accuracy: {accuracy:.3f}")
     print("📁 Model saved as: simple_japanese_model.pkl")
     print("\n💡 This model can be integrated into your Flutter app!")
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
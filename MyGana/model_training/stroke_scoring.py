@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Stroke Scoring for Japanese Character Recognition
+Compares user stroke sequences with the AnimCJK reference strokes in
+assets/HiraganaSVG and assets/KatakanaSVG using batched DTW on resampled points
+
+Every (user stroke, reference stroke) pair of a batch is resampled to the same
+number of points and scored at once with NumPy. A cheap LB_Keogh-style lower
+bound skips the exact DTW for pairs that are already too far apart.
+"""
+
+import os
+import re
+import sys
+import json
+import sqlite3
+import argparse
+
+import numpy as np
+
+from label_registry import DEFAULT_DB_PATH
+
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'assets')
+SVG_DIRS = {'hiragana': 'HiraganaSVG', 'katakana': 'KatakanaSVG'}
+
+# Median (centre line) of each stroke; split strokes (3a, 3b) share a number
+MEDIAN_PATTERN = re.compile(r'<path[^>]*clip-path="url\(#z\d+c(\d+)([a-z]?)\)"[^>]*\sd="([^"]+)"')
+NUMBER_PATTERN = re.compile(r'-?\d+(?:\.\d+)?')
+
+_reference_cache = {}
+
+
+def parse_reference_svg(svg_path):
+    """Stroke medians of an AnimCJK SVG as (N, 2) arrays in stroke order"""
+    with open(svg_path, 'r', encoding='utf-8') as f:
+        svg = f.read()
+
+    strokes = {}
+    for number, _, path in MEDIAN_PATTERN.findall(svg):
+        # Later parts of a split stroke repeat the same median with clipping offsets
+        if int(number) in strokes:
+            continue
+        values = np.array(NUMBER_PATTERN.findall(path), dtype=np.float32)
+        strokes[int(number)] = values[:len(values) // 2 * 2].reshape(-1, 2)
+
+    return [strokes[number] for number in sorted(strokes)]
+
+
+def load_references(db_path=DEFAULT_DB_PATH, assets_dir=ASSETS_DIR):
+    """Reference strokes per character, using the SVG file names from the database"""
+    key = (os.path.abspath(db_path), os.path.abspath(assets_dir))
+    if key in _reference_cache:
+        return _reference_cache[key]
+
+    connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        references = {}
+        for table, directory in SVG_DIRS.items():
+            for character, svg in connection.execute(f"SELECT character, svg FROM {table} ORDER BY id"):
+                svg_path = os.path.join(assets_dir, directory, svg or '')
+                if svg and os.path.exists(svg_path):
+                    references[character] = parse_reference_svg(svg_path)
+    finally:
+        connection.close()
+
+    _reference_cache[key] = references
+    return references
+
+
+def reference_stroke_counts(db_path=DEFAULT_DB_PATH, assets_dir=ASSETS_DIR):
+    """Number of strokes of each reference character"""
+    return {character: len(strokes) for character, strokes in load_references(db_path, assets_dir).items()}
+
+
+def to_points(stroke):
+    """A stroke from an export ([x, y] or {'x', 'y'} points) as an (N, 2) array, N >= 2"""
+    if len(stroke) and isinstance(stroke[0], dict):
+        points = np.array([(p['x'], p['y']) for p in stroke], dtype=np.float32)
+    else:
+        points = np.asarray(stroke, dtype=np.float32).reshape(-1, 2)
+    # A tap is a zero-length stroke
+    return np.repeat(points, 2, axis=0) if len(points) == 1 else points
+
+
+def prepare_batch(characters, num_points=32):
+    """Normalize and resample the strokes of many characters at once
+
+    Each character is scaled into the unit square (aspect kept, centered), then every
+    stroke is resampled to num_points equally spaced points with a single np.interp
+    over all strokes. Returns a (total_strokes, num_points, 2) array and the number
+    of strokes of each character.
+    """
+    strokes = []
+    counts = np.zeros(len(characters), dtype=np.int64)
+    for c, character_strokes in enumerate(characters):
+        points = [to_points(stroke) for stroke in character_strokes if len(stroke) > 0]
+        strokes.extend(points)
+        counts[c] = len(points)
+    if not strokes:
+        return np.zeros((0, num_points, 2), dtype=np.float32), counts
+
+    lengths = np.array([len(stroke) for stroke in strokes])
+    points = np.concatenate(strokes)
+    stroke_of_point = np.repeat(np.arange(len(strokes)), lengths)
+    stroke_starts = np.cumsum(lengths) - lengths
+    stroke_ends = stroke_starts + lengths - 1
+
+    # Bounding box of each character (points are grouped by character)
+    has_strokes = counts > 0
+    first_stroke = (np.cumsum(counts) - counts)[has_strokes]
+    low = np.minimum.reduceat(points, stroke_starts[first_stroke], axis=0)
+    high = np.maximum.reduceat(points, stroke_starts[first_stroke], axis=0)
+    character_of_stroke = np.repeat(np.arange(has_strokes.sum()), counts[has_strokes])
+    extent = high - low
+    scale = np.maximum(extent.max(axis=1, keepdims=True), 1e-6)
+    offset = (1.0 - extent / scale) / 2
+    character_of_point = character_of_stroke[stroke_of_point]
+    points = (points - low[character_of_point]) / scale[character_of_point] + offset[character_of_point]
+
+    # Arc length of each point within its stroke, scaled to [0, 1]
+    segments = np.linalg.norm(np.diff(points, axis=0), axis=1)
+    segments[stroke_ends[:-1]] = 0.0  # no segment between strokes
+    arc = np.concatenate([[0.0], np.cumsum(segments)])
+    arc -= arc[stroke_starts][stroke_of_point]
+    total = arc[stroke_ends]
+    arc /= np.where(total > 0, total, 1.0)[stroke_of_point]
+    arc[stroke_ends] = 1.0
+
+    # Strokes are laid out 2 apart on one monotonic axis, so one interp resamples them all
+    axis = arc + 2.0 * stroke_of_point
+    targets = (np.linspace(0.0, 1.0, num_points)[None, :] + 2.0 * np.arange(len(strokes))[:, None]).ravel()
+    resampled = np.stack([np.interp(targets, axis, points[:, 0]),
+                          np.interp(targets, axis, points[:, 1])], axis=1)
+    return resampled.reshape(len(strokes), num_points, 2).astype(np.float32), counts
+
+
+def envelope(sequences, window):
+    """Per-point upper/lower bounds of each sequence within +-window (batched)"""
+    upper = sequences.copy()
+    lower = sequences.copy()
+    for shift in range(1, min(window, sequences.shape[1] - 1) + 1):
+        np.maximum(upper[:, shift:], sequences[:, :-shift], out=upper[:, shift:])
+        np.maximum(upper[:, :-shift], sequences[:, shift:], out=upper[:, :-shift])
+        np.minimum(lower[:, shift:], sequences[:, :-shift], out=lower[:, shift:])
+        np.minimum(lower[:, :-shift], sequences[:, shift:], out=lower[:, :-shift])
+    return upper, lower
+
+
+def lb_keogh(queries, upper, lower):
+    """Lower bound of the DTW distance: each point's distance to the candidate's envelope box"""
+    excess = np.maximum(queries - upper, 0) + np.maximum(lower - queries, 0)
+    return np.linalg.norm(excess, axis=-1).mean(axis=-1)
+
+
+def batch_dtw(queries, candidates, window=None):
+    """Mean per-point DTW distance of each (query, candidate) pair, shape (P, N, 2) each
+
+    Cells are filled one anti-diagonal at a time, so each step is a vectorized
+    update over all pairs; only cells inside the Sakoe-Chiba band are visited.
+    """
+    num_pairs, num_points = queries.shape[:2]
+    window = num_points if window is None else window
+
+    accumulated = np.full((num_pairs, num_points + 1, num_points + 1), np.inf, dtype=np.float32)
+    accumulated[:, 0, 0] = 0.0
+    for diagonal in range(2 * num_points - 1):
+        # |i - j| <= window on the diagonal i + j = diagonal
+        low = max(0, diagonal - num_points + 1, -(-(diagonal - window) // 2))
+        high = min(diagonal, num_points - 1, (diagonal + window) // 2)
+        i = np.arange(low, high + 1)
+        j = diagonal - i
+        cost = np.linalg.norm(queries[:, i] - candidates[:, j], axis=-1)
+        accumulated[:, i + 1, j + 1] = cost + np.minimum(
+            np.minimum(accumulated[:, i, j + 1], accumulated[:, i + 1, j]), accumulated[:, i, j]
+        )
+
+    # Per query point, so distances stay in unit-square units
+    return accumulated[:, -1, -1] / num_points
+
+
+def pair_distances(queries, candidates, window=4, abandon_distance=None, envelopes=None, chunk_size=4096):
+    """DTW distances of many pairs; pairs whose lower bound reaches abandon_distance are skipped
+
+    Returns the distances (the lower bound for abandoned pairs) and the abandoned mask.
+    """
+    if envelopes is None:
+        # Without a window any candidate point can match, so the envelope spans the whole stroke
+        envelopes = envelope(candidates, window if window is not None else candidates.shape[1])
+    bounds = lb_keogh(queries, *envelopes).astype(np.float32)
+
+    abandoned = np.zeros(len(queries), dtype=bool)
+    if abandon_distance is not None:
+        abandoned = bounds >= abandon_distance
+
+    distances = bounds
+    remaining = np.where(~abandoned)[0]
+    for start in range(0, len(remaining), chunk_size):
+        rows = remaining[start:start + chunk_size]
+        distances[rows] = batch_dtw(queries[rows], candidates[rows], window)
+    return distances, abandoned
+
+
+class StrokeScorer:
+    """Scores stroke count, stroke order and shape of attempts against reference strokes
+
+    A stroke pair further apart than `tolerance` counts as not matching at all, so
+    pairs whose lower bound already reaches it are abandoned without changing any score.
+    """
+
+    def __init__(self, references=None, num_points=32, window=4, tolerance=0.25, prune=True):
+        self.num_points = num_points
+        self.window = window
+        self.tolerance = tolerance
+        self.prune = prune
+        references = load_references() if references is None else references
+
+        self.characters = list(references)
+        self.strokes, counts = prepare_batch([references[c] for c in self.characters], num_points)
+        starts = np.cumsum(counts) - counts
+        self.spans = {c: (int(start), int(count)) for c, start, count in zip(self.characters, starts, counts)}
+        self.envelopes = envelope(self.strokes, window if window is not None else num_points)
+
+    def score_batch(self, attempts):
+        """Score (character, strokes) attempts; every stroke pair of the batch is scored at once"""
+        user_strokes, user_counts = prepare_batch([strokes for _, strokes in attempts], self.num_points)
+        user_starts = np.cumsum(user_counts) - user_counts
+
+        # Every user stroke against every reference stroke of the expected character
+        user_rows, reference_rows, pair_starts = [], [], []
+        num_pairs = 0
+        for (character, _), user_start, num_user in zip(attempts, user_starts, user_counts):
+            reference_start, num_reference = self.spans.get(character, (0, 0))
+            pair_starts.append(num_pairs)
+            if num_user == 0 or num_reference == 0:
+                continue
+            user_rows.append(np.repeat(np.arange(user_start, user_start + num_user), num_reference))
+            reference_rows.append(np.tile(np.arange(reference_start, reference_start + num_reference), num_user))
+            num_pairs += num_user * num_reference
+
+        distances = abandoned = np.zeros(0, dtype=np.float32)
+        if num_pairs:
+            user_rows = np.concatenate(user_rows)
+            reference_rows = np.concatenate(reference_rows)
+            distances, abandoned = pair_distances(
+                user_strokes[user_rows], self.strokes[reference_rows], self.window,
+                self.tolerance if self.prune else None,
+                (self.envelopes[0][reference_rows], self.envelopes[1][reference_rows]),
+            )
+
+        results = []
+        for (character, _), num_user, start in zip(attempts, user_counts, pair_starts):
+            num_user = int(num_user)
+            num_reference = self.spans.get(character, (0, None))[1]
+            if not num_user or not num_reference:
+                results.append({
+                    'character': character,
+                    'stroke_count': num_user,
+                    'expected_stroke_count': num_reference,
+                    'accuracy_score': 0.0,
+                    'error': 'no reference' if not num_reference else 'no strokes',
+                })
+                continue
+
+            end = start + num_user * num_reference
+            matrix = np.minimum(distances[start:end], self.tolerance).reshape(num_user, num_reference)
+
+            # Shape: each reference stroke against its closest user stroke
+            closest_user = matrix.min(axis=0)
+            # Order: the i-th user stroke should match the i-th reference stroke
+            order_ok = num_user == num_reference and bool(
+                np.all(matrix.min(axis=1) < self.tolerance)
+                and np.all(np.argmin(matrix, axis=1) == np.arange(num_user))
+            )
+            results.append({
+                'character': character,
+                'stroke_count': num_user,
+                'expected_stroke_count': num_reference,
+                'stroke_count_ok': num_user == num_reference,
+                'stroke_order_ok': order_ok,
+                'shape_distance': float(closest_user.mean()),
+                'accuracy_score': float(100.0 * np.mean(1.0 - closest_user / self.tolerance)),
+                'abandoned_pairs': int(abandoned[start:end].sum()),
+            })
+        return results
+
+
+def iter_stroke_attempts(export_path):
+    """(entry, character, strokes) for every export entry that has raw strokes"""
+    from sharded_dataset import iter_export_entries
+
+    for entry in iter_export_entries(export_path):
+        if entry.get('strokes'):
+            yield entry, entry.get('character'), entry['strokes']
+
+
+def rescore_export(export_path, scorer, batch_size=2048, output=None):
+    """Re-score an export and compare against the on-device accuracyScore/strokeCount
+
+    Per-attempt scores are written to the output file object as JSON lines while
+    scoring, so memory stays flat however many attempts the export holds.
+    """
+    summary = {'scored': 0, 'stroke_count_mismatch': 0, 'stroke_order_errors': 0,
+               'abandoned_pairs': 0, 'device_score_abs_diff': 0.0}
+
+    def flush(batch):
+        for (entry, _, _), result in zip(batch, scorer.score_batch([(c, s) for _, c, s in batch])):
+            if 'error' in result:
+                continue
+            summary['scored'] += 1
+            summary['stroke_count_mismatch'] += int(entry.get('strokeCount', result['stroke_count'])
+                                                    != result['expected_stroke_count'])
+            summary['stroke_order_errors'] += int(not result['stroke_order_ok'])
+            summary['abandoned_pairs'] += result['abandoned_pairs']
+            if entry.get('accuracyScore') is not None:
+                summary['device_score_abs_diff'] += abs(float(entry['accuracyScore']) - result['accuracy_score'])
+            if output is not None:
+                output.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+    batch = []
+    for attempt in iter_stroke_attempts(export_path):
+        batch.append(attempt)
+        if len(batch) == batch_size:
+            flush(batch)
+            batch = []
+    flush(batch)
+
+    summary['device_score_mean_abs_diff'] = summary.pop('device_score_abs_diff') / max(summary['scored'], 1)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-score exported attempts against reference strokes")
+    parser.add_argument('exports', nargs='+', help="Export JSON files with raw 'strokes'")
+    parser.add_argument('--output', help="Write per-attempt scores as JSON lines")
+    parser.add_argument('--num-points', type=int, default=32)
+    parser.add_argument('--window', type=int, default=4, help="DTW warping window in points")
+    parser.add_argument('--batch-size', type=int, default=2048)
+    args = parser.parse_args(argv)
+
+    scorer = StrokeScorer(num_points=args.num_points, window=args.window)
+    output = open(args.output, 'w', encoding='utf-8') if args.output else None
+    try:
+        for export_path in args.exports:
+            summary = rescore_export(export_path, scorer, args.batch_size, output)
+            print(f"{export_path}: {json.dumps(summary)}")
+    finally:
+        if output:
+            output.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
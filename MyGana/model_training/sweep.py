@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Hyperparameter Sweep for Japanese Character Recognition
+Runs trials in parallel worker processes with a CPU thread budget each, and
+stops weak configurations early with successive halving (or Hyperband)
+
+All trials read one memory-mapped uint8 copy of the dataset, so the page
+cache holds it once no matter how many workers run.
+
+Examples:
+    python sweep.py --data training_data_export.json --trials 27 --max-epochs 27
+    python sweep.py --data training_data_export.json --scheduler hyperband --parallel 4
+    python sweep.py --show sweep/sweep_results.csv --sort-by seconds
+"""
+
+import os
+import sys
+import csv
+import json
+import math
+import time
+import argparse
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from characters import HIRAGANA
+from train_japanese_model import DEFAULT_HYPERPARAMETERS
+
+# name: ('log', low, high) | ('uniform', low, high) | ('choice', [values])
+SEARCH_SPACE = {
+    'learning_rate': ('log', 1e-4, 3e-3),
+    'batch_size': ('choice', [16, 32, 64]),
+    'conv_dropout': ('uniform', 0.1, 0.4),
+    'dense_dropout': ('uniform', 0.2, 0.6),
+    'rotation_range': ('uniform', 0.0, 15.0),
+    'shift_range': ('uniform', 0.0, 0.15),
+    'zoom_range': ('uniform', 0.0, 0.15),
+}
+
+RESULT_COLUMNS = ['trial_id', 'bracket', 'rung', 'epochs', 'val_accuracy', 'val_loss', 'seconds']
+
+
+def sample_config(space, rng):
+    config = {}
+    for name, (kind, *args) in space.items():
+        if kind == 'log':
+            config[name] = float(np.exp(rng.uniform(np.log(args[0]), np.log(args[1]))))
+        elif kind == 'uniform':
+            config[name] = float(rng.uniform(args[0], args[1]))
+        elif kind == 'choice':
+            config[name] = args[0][rng.integers(len(args[0]))]
+        else:
+            raise ValueError(f"Unknown search space type '{kind}' for {name}")
+    return config
+
+
+def prepare_dataset(export_path, dataset_dir, labels=HIRAGANA, validation_split=0.2, seed=42):
+    """Decode an export once into images.npy/labels.npy that every trial memory-maps"""
+    from sharded_dataset import iter_export_entries
+    from preprocessing import INPUT_SIZE, decode_sample
+
+    os.makedirs(dataset_dir, exist_ok=True)
+    meta_path = os.path.join(dataset_dir, 'meta.json')
+    source = {'export': os.path.abspath(export_path), 'size': os.path.getsize(export_path),
+              'mtime': os.path.getmtime(export_path), 'validation_split': validation_split, 'seed': seed}
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            if json.load(f).get('source') == source:
+                return dataset_dir
+
+    print(f"Preparing shared dataset from {export_path}...")
+    character_to_index = {char: i for i, char in enumerate(labels)}
+    images, targets = [], []
+    for entry in iter_export_entries(export_path):
+        label = character_to_index.get(entry.get('character'))
+        if label is None:
+            continue
+        try:
+            images.append(decode_sample(entry, INPUT_SIZE))
+            targets.append(label)
+        except Exception:
+            continue
+
+    images = np.stack(images)
+    targets = np.array(targets, dtype=np.int16)
+    rng = np.random.default_rng(seed)
+    validation = np.zeros(len(targets), dtype=bool)
+    validation[rng.permutation(len(targets))[:int(len(targets) * validation_split)]] = True
+
+    np.save(os.path.join(dataset_dir, 'images.npy'), images)
+    np.save(os.path.join(dataset_dir, 'labels.npy'), targets)
+    np.save(os.path.join(dataset_dir, 'validation.npy'), validation)
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump({'source': source, 'labels': list(labels), 'num_samples': len(targets)}, f, ensure_ascii=False)
+    print(f"Shared dataset: {len(targets)} samples in {dataset_dir}")
+    return dataset_dir
+
+
+def memmap_dataset(images, labels, indices, batch_size, shuffle=False, augment=None, seed=42):
+    """tf.data batches read straight from the memory-mapped uint8 arrays"""
+    import tensorflow as tf
+    from sharded_dataset import build_augmentation
+
+    size = images.shape[1]
+    epoch_counter = {'epoch': 0}
+
+    def generator():
+        order = indices
+        if shuffle:
+            order = np.random.default_rng(seed + epoch_counter['epoch']).permutation(indices)
+            epoch_counter['epoch'] += 1
+        for start in range(0, len(order), batch_size):
+            # Sorted reads keep page access sequential within a batch
+            batch = np.sort(order[start:start + batch_size])
+            yield images[batch], labels[batch].astype(np.int32)
+
+    dataset = tf.data.Dataset.from_generator(
+        generator,
+        output_signature=(
+            tf.TensorSpec(shape=(None, size, size), dtype=tf.uint8),
+            tf.TensorSpec(shape=(None,), dtype=tf.int32),
+        ),
+    )
+    dataset = dataset.map(lambda x, y: (tf.cast(x, tf.float32)[..., tf.newaxis] / 255.0, y),
+                          num_parallel_calls=tf.data.AUTOTUNE)
+
+    augmentation = build_augmentation(**augment) if augment else None
+    if augmentation is not None:
+        dataset = dataset.map(lambda x, y: (augmentation(x, training=True), y),
+                              num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(2)
+
+
+def _init_worker(threads):
+    """Pin each worker to its thread budget before TensorFlow is imported"""
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+
+
+def run_trial(task):
+    """Train one configuration from its last checkpoint up to task['epochs'] and evaluate it"""
+    import tensorflow as tf
+    from train_japanese_model import JapaneseCharacterTrainer
+
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(task['threads'])
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except RuntimeError:
+        pass  # Already initialized by an earlier trial in this worker
+
+    start = time.perf_counter()
+    dataset_dir = task['dataset_dir']
+    images = np.load(os.path.join(dataset_dir, 'images.npy'), mmap_mode='r')
+    labels = np.load(os.path.join(dataset_dir, 'labels.npy'), mmap_mode='r')
+    validation = np.load(os.path.join(dataset_dir, 'validation.npy'))
+    with open(os.path.join(dataset_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+        label_names = json.load(f)['labels']
+
+    config = task['config']
+    trainer = JapaneseCharacterTrainer(hyperparameters=config)
+    trainer.use_labels(label_names)
+
+    # Rebuilt from the config and resumed from weights, so the optimizer matches the trial
+    model = trainer.create_model()
+    checkpoint = task['checkpoint']
+    if task['initial_epoch'] > 0 and os.path.exists(checkpoint):
+        model.load_weights(checkpoint)
+
+    batch_size = int(config.get('batch_size', 32))
+    train_data = memmap_dataset(images, labels, np.flatnonzero(~validation), batch_size,
+                                shuffle=True, augment=trainer.augmentation(), seed=task['seed'])
+    val_data = memmap_dataset(images, labels, np.flatnonzero(validation), 256)
+
+    model.fit(train_data, epochs=task['epochs'], initial_epoch=task['initial_epoch'], verbose=0)
+    val_loss, val_accuracy = model.evaluate(val_data, verbose=0)[:2]
+    model.save_weights(checkpoint)
+
+    return {
+        'trial_id': task['trial_id'],
+        'bracket': task['bracket'],
+        'rung': task['rung'],
+        'epochs': task['epochs'],
+        'val_accuracy': float(val_accuracy),
+        'val_loss': float(val_loss),
+        'seconds': time.perf_counter() - start,
+        'config': config,
+    }
+
+
+def successive_halving(executor, configs, min_epochs, max_epochs, eta, context, bracket=0):
+    """Train all configs for min_epochs, keep the best 1/eta, multiply the budget by eta, repeat"""
+    trials = [{'trial_id': f"b{bracket}_t{i:03d}", 'config': config, 'epochs': 0}
+              for i, config in enumerate(configs)]
+    epochs = min_epochs
+    rung = 0
+    rows = []
+
+    while True:
+        futures = []
+        for trial in trials:
+            futures.append(executor.submit(run_trial, {
+                'trial_id': trial['trial_id'],
+                'bracket': bracket,
+                'rung': rung,
+                'config': trial['config'],
+                'initial_epoch': trial['epochs'],
+                'epochs': epochs,
+                'checkpoint': os.path.join(context['trials_dir'], f"{trial['trial_id']}.weights.h5"),
+                'dataset_dir': context['dataset_dir'],
+                'threads': context['threads'],
+                'seed': context['seed'],
+            }))
+
+        scores = {}
+        for future in as_completed(futures):
+            row = future.result()
+            rows.append(row)
+            scores[row['trial_id']] = row['val_accuracy']
+            context['on_result'](row)
+
+        for trial in trials:
+            trial['epochs'] = epochs
+        if epochs >= max_epochs or len(trials) <= 1:
+            break
+
+        trials.sort(key=lambda trial: scores[trial['trial_id']], reverse=True)
+        trials = trials[:max(1, len(trials) // eta)]
+        epochs = min(epochs * eta, max_epochs)
+        rung += 1
+
+    return rows
+
+
+def hyperband_brackets(min_epochs, max_epochs, eta):
+    """(num_configs, starting epochs) of each Hyperband bracket, most aggressive first"""
+    s_max = int(math.floor(math.log(max_epochs / min_epochs, eta) + 1e-9))
+    return [(int(math.ceil((s_max + 1) / (s + 1) * eta ** s)), max(min_epochs, int(max_epochs / eta ** s)))
+            for s in range(s_max, -1, -1)]
+
+
+def flatten_row(row):
+    flat = {column: row[column] for column in RESULT_COLUMNS}
+    flat.update(row['config'])
+    return flat
+
+
+def write_results(rows, path):
+    if not rows:
+        return
+    columns = RESULT_COLUMNS + sorted({key for row in rows for key in row} - set(RESULT_COLUMNS))
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def read_results(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        for key, value in row.items():
+            try:
+                row[key] = int(value) if value.lstrip('-').isdigit() else float(value)
+            except ValueError:
+                pass
+    return rows
+
+
+def print_table(rows, sort_by='val_accuracy', descending=None, limit=20, final_only=True):
+    """Print results sorted by any column; by default only each trial's last rung"""
+    if final_only:
+        last = {}
+        for row in rows:
+            if row['trial_id'] not in last or row['epochs'] > last[row['trial_id']]['epochs']:
+                last[row['trial_id']] = row
+        rows = list(last.values())
+    if descending is None:
+        # Higher is better for accuracy, lower for everything else
+        descending = sort_by == 'val_accuracy'
+    rows = sorted(rows, key=lambda row: row.get(sort_by, 0), reverse=descending)[:limit]
+
+    columns = RESULT_COLUMNS + [key for key in SEARCH_SPACE if any(key in row for row in rows)]
+    cells = [[f"{row.get(c):.4g}" if isinstance(row.get(c), float) else str(row.get(c, '')) for c in columns]
+             for row in rows]
+    widths = [max(len(c), *(len(r[i]) for r in cells)) if cells else len(c) for i, c in enumerate(columns)]
+    print('  '.join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in cells:
+        print('  '.join(v.ljust(w) for v, w in zip(r, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel hyperparameter sweep with successive halving")
+    parser.add_argument('--data', default='training_data_export.json')
+    parser.add_argument('--output-dir', default='sweep')
+    parser.add_argument('--scheduler', choices=['sha', 'hyperband'], default='sha')
+    parser.add_argument('--trials', type=int, default=27, help="Configurations for successive halving")
+    parser.add_argument('--min-epochs', type=int, default=1)
+    parser.add_argument('--max-epochs', type=int, default=27)
+    parser.add_argument('--eta', type=int, default=3, help="Keep the best 1/eta at each rung")
+    parser.add_argument('--parallel', type=int, default=None, help="Concurrent trials")
+    parser.add_argument('--threads', type=int, default=None, help="CPU threads per trial")
+    parser.add_argument('--space', help="JSON file overriding the search space")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--show', metavar='RESULTS_CSV', help="Only print an existing results table")
+    parser.add_argument('--sort-by', default='val_accuracy')
+    parser.add_argument('--ascending', action='store_true')
+    parser.add_argument('--all-rungs', action='store_true', help="Show every rung, not just the last")
+    args = parser.parse_args(argv)
+
+    descending = False if args.ascending else None
+    if args.show:
+        print_table(read_results(args.show), args.sort_by, descending, final_only=not args.all_rungs)
+        return 0
+
+    space = dict(SEARCH_SPACE)
+    if args.space:
+        with open(args.space, 'r', encoding='utf-8') as f:
+            space.update({name: tuple(spec) for name, spec in json.load(f).items()})
+
+    cpus = os.cpu_count() or 1
+    parallel = args.parallel or max(1, cpus // 2)
+    threads = args.threads or max(1, cpus // parallel)
+    print(f"Running up to {parallel} trials at a time with {threads} threads each")
+
+    trials_dir = os.path.join(args.output_dir, 'trials')
+    os.makedirs(trials_dir, exist_ok=True)
+    dataset_dir = prepare_dataset(args.data, os.path.join(args.output_dir, 'dataset'), seed=args.seed)
+    results_path = os.path.join(args.output_dir, 'sweep_results.csv')
+
+    rows = []
+
+    def on_result(row):
+        rows.append(flatten_row(row))
+        # Rewritten after every trial so a long sweep can be inspected while it runs
+        write_results(rows, results_path)
+        print(f"  {row['trial_id']} rung {row['rung']} ({row['epochs']} epochs): "
+              f"val_accuracy {row['val_accuracy']:.4f} in {row['seconds']:.1f}s")
+
+    context = {'trials_dir': trials_dir, 'dataset_dir': dataset_dir, 'threads': threads,
+               'seed': args.seed, 'on_result': on_result}
+    rng = np.random.default_rng(args.seed)
+
+    if args.scheduler == 'hyperband':
+        brackets = hyperband_brackets(args.min_epochs, args.max_epochs, args.eta)
+    else:
+        brackets = [(args.trials, args.min_epochs)]
+
+    start = time.perf_counter()
+    # Spawned workers: TensorFlow is not fork-safe
+    with ProcessPoolExecutor(max_workers=parallel, mp_context=get_context('spawn'),
+                             initializer=_init_worker, initargs=(threads,)) as executor:
+        for bracket, (num_configs, min_epochs) in enumerate(brackets):
+            print(f"Bracket {bracket}: {num_configs} configs starting at {min_epochs} epochs")
+            configs = [sample_config(space, rng) for _ in range(num_configs)]
+            successive_halving(executor, configs, min_epochs, args.max_epochs, args.eta, context, bracket)
+
+    # Rungs resume from checkpoints, so a trial trained as many epochs as its last rung
+    trial_epochs = {}
+    for row in rows:
+        trial_epochs[row['trial_id']] = max(trial_epochs.get(row['trial_id'], 0), row['epochs'])
+    total_epochs = sum(trial_epochs.values())
+    print(f"\n✅ Sweep finished in {time.perf_counter() - start:.1f}s "
+          f"({len(rows)} trial runs, {total_epochs} epochs trained)")
+    print_table(rows, args.sort_by, descending)
+
+    best = max((row for row in rows), key=lambda row: (row['epochs'], row['val_accuracy']))
+    best_config = {key: best[key] for key in DEFAULT_HYPERPARAMETERS if key in best}
+    best_config['batch_size'] = best.get('batch_size', 32)
+    best_path = os.path.join(args.output_dir, 'best_hyperparameters.json')
+    with open(best_path, 'w', encoding='utf-8') as f:
+        json.dump(best_config, f, indent=2)
+    print(f"📁 Results in {results_path}, best configuration in {best_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Tests for config file and command line precedence in cli.py
+"""
+
+import json
+
+from cli import parse_args
+
+
+def _config(tmp_path, config):
+    path = tmp_path / 'config.json'
+    path.write_text(json.dumps(config), encoding='utf-8')
+    return str(path)
+
+
+def test_cli_flags_override_config(tmp_path):
+    config = _config(tmp_path, {'log_level': 'DEBUG', 'train': {'epochs': 5}})
+    args = parse_args(['--config', config, '--log-level', 'WARNING', 'train', '--epochs', '7'])
+    assert args.log_level == 'WARNING'
+    assert args.epochs == 7
+
+
+def test_config_overrides_builtin_defaults(tmp_path):
+    config = _config(tmp_path, {'log_level': 'DEBUG', 'train': {'epochs': 5}})
+    args = parse_args(['--config', config, 'train'])
+    assert args.log_level == 'DEBUG'
+    assert args.epochs == 5
+
+
+def test_flat_config_keys_apply_to_subcommand(tmp_path):
+    config = _config(tmp_path, {'epochs': 3})
+    assert parse_args(['--config', config, 'train']).epochs == 3
+    assert parse_args(['--config', config, 'train', '--epochs', '9']).epochs == 9
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Regression tests for evaluate_tflite.py with exports that mix hiragana and katakana
+"""
+
+import io
+import json
+import base64
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from characters import ALL_KANA, HIRAGANA
+from evaluate_tflite import StreamingMetrics, evaluate_tflite
+
+
+def _blank_png():
+    buffer = io.BytesIO()
+    Image.new('L', (64, 64), 255).save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def _write_mixed_export(path):
+    image = _blank_png()
+    entries = [{'character': char, 'imageData': image} for char in HIRAGANA]
+    entries += [{'character': 'カ', 'imageData': image} for _ in range(3)]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'data': entries}, f, ensure_ascii=False)
+
+
+def test_streaming_metrics_skips_targets_beyond_outputs():
+    metrics = StreamingMetrics(num_classes=46, k=5)
+    labels = np.array([0, 1, 50, 91])
+    top_classes = np.tile(np.arange(5), (4, 1))
+    metrics.update(labels, top_classes)
+    assert metrics.out_of_range == 2
+    assert metrics.total == 2
+    assert metrics.confusion.shape == (46, 46)
+
+
+def test_mixed_script_export_with_hiragana_model(tmp_path):
+    tf = pytest.importorskip('tensorflow')
+
+    # 46-output model next to the full 92-line labels file
+    model = tf.keras.Sequential([
+        tf.keras.Input((64, 64, 1)),
+        tf.keras.layers.Flatten(),
+        tf.keras.layers.Dense(len(HIRAGANA), activation='softmax'),
+    ])
+    model_path = tmp_path / 'japanese_character_model.tflite'
+    model_path.write_bytes(tf.lite.TFLiteConverter.from_keras_model(model).convert())
+    (tmp_path / 'japanese_character_labels.txt').write_text('\n'.join(ALL_KANA) + '\n', encoding='utf-8')
+
+    export_path = tmp_path / 'mixed.json'
+    _write_mixed_export(export_path)
+
+    report, confusion = evaluate_tflite(str(model_path), str(export_path), batch_size=16, workers=1)
+    assert confusion.shape == (len(HIRAGANA), len(HIRAGANA))
+    assert report['samples'] == len(HIRAGANA)
@@ -6,7 +6,9 @@ Test the trained model to verify it's working correctly
 import pickle
 import json
 import numpy as np
-from simple_train import SimpleJapaneseRecognizer
+
+from characters import HIRAGANA
+from simple_train import SimpleJapaneseRecognizer, final_estimator, feature_importances
 
 def test_model():
     """Test the trained model"""
@@ -41,23 +43,26 @@ def test_model():
         prediction = model.predict([features])[0]
         confidence = model.predict_proba([features])[0].max()
         
-        predicted_char = recognizer.characters[prediction]
+        predicted_char = HIRAGANA[prediction]
         
         print(f"   {char} -> {predicted_char} (confidence: {confidence:.3f})")
     
+    X_test, y_test = recognizer.generate_simple_data()
     print(f"\n📊 Model Statistics:")
-    print(f"   - Accuracy: {model.score(recognizer.generate_simple_data()[0], recognizer.generate_simple_data()[1]):.3f}")
+    print(f"   - Accuracy: {model.score(X_test, y_test):.3f}")
     print(f"   - Features: {model.n_features_in_}")
-    print(f"   - Trees: {model.n_estimators}")
+    print(f"   - Type: {type(final_estimator(model)).__name__}")
+    if hasattr(final_estimator(model), 'n_estimators'):
+        print(f"   - Trees: {final_estimator(model).n_estimators}")
     print(f"   - Classes: {len(model.classes_)}")
     
     # Test feature importances
     print(f"\n🔍 Top 10 Most Important Features:")
-    feature_importances = model.feature_importances_
-    top_features = np.argsort(feature_importances)[-10:][::-1]
+    importances = feature_importances(model)
+    top_features = np.argsort(importances)[-10:][::-1]
     
     for i, feature_idx in enumerate(top_features):
-        print(f"   {i+1}. Feature {feature_idx}: {feature_importances[feature_idx]:.4f}")
+        print(f"   {i+1}. Feature {feature_idx}: {importances[feature_idx]:.4f}")
     
     print("\n✅ Model testing complete!")
 
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Tests for the sharded dataset reader
+"""
+
+import os
+
+import numpy as np
+
+from characters import DAKUTEN
+from sharded_dataset import ShardWriter, ShardedDataset
+
+
+def _write_dataset(directory, num_samples):
+    writer = ShardWriter(str(directory), shard_size=8192)
+    for i in range(num_samples):
+        writer.append(np.full((64, 64), i % 256, dtype=np.uint8), i % 46)
+    writer.flush()
+    return ShardedDataset(str(directory))
+
+
+def test_fewer_blocks_than_workers(tmp_path):
+    # 920 samples are a single 4096-sample block, shared by two workers
+    dataset = _write_dataset(tmp_path, 920)
+    assert len(dataset.shards) == 1
+
+    streams = [list(dataset.stream('train', num_workers=2, worker_index=i)) for i in range(2)]
+    sizes = [len(stream) for stream in streams]
+    assert min(sizes) > 0
+    assert abs(sizes[0] - sizes[1]) <= 0.2 * max(sizes)
+    assert sum(sizes) == dataset.count('train')
+
+
+def _write_composed_dataset(directory, num_samples=200):
+    writer = ShardWriter(str(directory), labels=['か', 'が'], shard_size=1)
+    # Every base sample is identifiable by its fill value
+    base = np.stack([np.full((64, 64), i, dtype=np.uint8) for i in range(num_samples)])
+    np.save(os.path.join(str(directory), 'class_00000.images.npy'), base)
+    np.save(os.path.join(str(directory), 'class_00000.labels.npy'), np.zeros(num_samples, dtype=np.int16))
+    writer.add_shard('class_00000', num_samples, 0)
+    writer.add_shard('class_00001', num_samples, 1, compose={'base': 'class_00000', 'mark': DAKUTEN, 'seed': 7})
+    return ShardedDataset(str(directory))
+
+
+def test_composed_blocks_match_full_shard(tmp_path):
+    dataset = _write_composed_dataset(tmp_path)
+    shard = dataset.shards[1]
+    full, _ = dataset.load_shard(1)
+    block = dataset._compose(shard, np.arange(64, 128))
+    assert np.array_equal(block, full[64:128])
+
+
+def test_composed_training_samples_use_training_bases(tmp_path):
+    dataset = _write_composed_dataset(tmp_path)
+    base_ids = np.arange(dataset.shards[0]['num_samples']) + dataset.offsets[0]
+    validation_bases = set(np.flatnonzero(dataset.split_mask(base_ids, 0.2)).tolist())
+    assert validation_bases
+
+    composed = [image for image, label in dataset.stream('train') if label == 1]
+    assert composed
+    # The mark is pasted top-right; the left half still shows which base was used
+    used = {int(image[:, :32].min()) for image in composed}
+    assert not used & validation_bases
@@ -7,40 +7,43 @@ Using TensorFlow/Keras for accurate character recognition
 import os
 import json
 import numpy as np
-import tensorflow as tf
-from tensorflow import keras
-from tensorflow.keras import layers
-import matplotlib.pyplot as plt
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import LabelEncoder
-import cv2
-from PIL import Image
-import base64
-import io
+
+from characters import HIRAGANA
+from preprocessing import decode_image_data
+
+# TensorFlow, matplotlib and scikit-learn are imported inside the methods that
+# use them, so loading data or labels doesn't pay their import cost.
+
+# Above this many classes (kanji) the model outputs logits: the loss is computed
+# from logits and softmax/top-k are only applied in the exported model
+LARGE_VOCABULARY_THRESHOLD = 500
+
+# Defaults for the tunable settings (see sweep.py)
+DEFAULT_HYPERPARAMETERS = {
+    'learning_rate': 0.001,
+    'conv_dropout': 0.25,
+    'dense_dropout': 0.5,
+    'rotation_range': 10,
+    'shift_range': 0.1,
+    'zoom_range': 0.1,
+}
 
 class JapaneseCharacterTrainer:
-    def __init__(self):
+    def __init__(self, hyperparameters=None):
         self.model = None
-        self.label_encoder = LabelEncoder()
+        self.loaded_model_path = None
+        self.hyperparameters = dict(DEFAULT_HYPERPARAMETERS, **(hyperparameters or {}))
         self.input_size = 64
         self.num_classes = 46  # Basic hiragana characters
         
         # Character mapping
-        self.character_to_index = {
-            'あ': 0, 'い': 1, 'う': 2, 'え': 3, 'お': 4,
-            'か': 5, 'き': 6, 'く': 7, 'け': 8, 'こ': 9,
-            'さ': 10, 'し': 11, 'す': 12, 'せ': 13, 'そ': 14,
-            'た': 15, 'ち': 16, 'つ': 17, 'て': 18, 'と': 19,
-            'な': 20, 'に': 21, 'ぬ': 22, 'ね': 23, 'の': 24,
-            'は': 25, 'ひ': 26, 'ふ': 27, 'へ': 28, 'ほ': 29,
-            'ま': 30, 'み': 31, 'む': 32, 'め': 33, 'も': 34,
-            'や': 35, 'ゆ': 36, 'よ': 37,
-            'ら': 38, 'り': 39, 'る': 40, 'れ': 41, 'ろ': 42,
-            'わ': 43, 'を': 44, 'ん': 45,
-        }
+        self.character_to_index = {char: i for i, char in enumerate(HIRAGANA)}
         
         self.index_to_character = {v: k for k, v in self.character_to_index.items()}
         
+        # Per-sample export fields, aligned with the arrays from load_training_data
+        self.sample_metadata = None
+        
     def load_training_data(self, data_path):
         """Load training data from JSON file"""
         print(f"Loading training data from {data_path}...")
@@ -50,39 +53,59 @@ class JapaneseCharacterTrainer:
         
         images = []
         labels = []
+        is_correct = []
+        accuracy_scores = []
+        stroke_counts = []
+        sample_weights = []
         
         for entry in data['data']:
             try:
-                # Decode base64 image
-                image_data = base64.b64decode(entry['imageData'])
-                image = Image.open(io.BytesIO(image_data))
+                # Get character label
+                character = entry['character']
+                if character not in self.character_to_index:
+                    print(f"Unknown character: {character}")
+                    continue
                 
-                # Convert to grayscale and resize
-                image = image.convert('L')
-                image = image.resize((self.input_size, self.input_size))
+                # Decode base64 image, convert to grayscale and resize
+                image = decode_image_data(entry['imageData'], self.input_size)
                 
-                # Convert to numpy array and normalize
-                image_array = np.array(image) / 255.0
+                # Normalize
+                image_array = image / 255.0
                 images.append(image_array)
+                labels.append(self.character_to_index[character])
                 
-                # Get character label
-                character = entry['character']
-                if character in self.character_to_index:
-                    labels.append(self.character_to_index[character])
-                else:
-                    print(f"Unknown character: {character}")
+                # Keep the fields used for hard-example mining
+                is_correct.append(bool(entry.get('isCorrect', True)))
+                accuracy_scores.append(float(entry.get('accuracyScore', 100.0)))
+                stroke_counts.append(int(entry.get('strokeCount', 0)))
+                # Set by dedup.py --mode weight for near-duplicate samples
+                sample_weights.append(float(entry.get('sampleWeight', 1.0)))
                     
             except Exception as e:
                 print(f"Error processing entry: {e}")
                 continue
         
+        self.sample_metadata = {
+            'is_correct': np.array(is_correct, dtype=bool),
+            'accuracy_score': np.array(accuracy_scores, dtype=np.float32),
+            'stroke_count': np.array(stroke_counts, dtype=np.int16),
+            'sample_weight': np.array(sample_weights, dtype=np.float32),
+        }
+        
         print(f"Loaded {len(images)} training samples")
         return np.array(images), np.array(labels)
     
     def create_model(self):
         """Create CNN model for character recognition"""
+        from tensorflow import keras
+        from tensorflow.keras import layers
+        
         print("Creating CNN model...")
         
+        large_vocabulary = self.num_classes > LARGE_VOCABULARY_THRESHOLD
+        conv_dropout = self.hyperparameters['conv_dropout']
+        dense_dropout = self.hyperparameters['dense_dropout']
+        
         model = keras.Sequential([
             # Input layer
             layers.Input(shape=(self.input_size, self.input_size, 1)),
@@ -91,73 +114,209 @@ class JapaneseCharacterTrainer:
             layers.Conv2D(32, (3, 3), activation='relu'),
             layers.BatchNormalization(),
             layers.MaxPooling2D((2, 2)),
-            layers.Dropout(0.25),
+            layers.Dropout(conv_dropout),
             
             # Second convolutional block
             layers.Conv2D(64, (3, 3), activation='relu'),
             layers.BatchNormalization(),
             layers.MaxPooling2D((2, 2)),
-            layers.Dropout(0.25),
+            layers.Dropout(conv_dropout),
             
             # Third convolutional block
             layers.Conv2D(128, (3, 3), activation='relu'),
             layers.BatchNormalization(),
             layers.MaxPooling2D((2, 2)),
-            layers.Dropout(0.25),
+            layers.Dropout(conv_dropout),
             
             # Fourth convolutional block
             layers.Conv2D(256, (3, 3), activation='relu'),
             layers.BatchNormalization(),
-            layers.Dropout(0.25),
+            layers.Dropout(conv_dropout),
             
             # Global average pooling
             layers.GlobalAveragePooling2D(),
             
-            # Dense layers
+            # Dense layers; Dense(256) is also the bottleneck in front of a large output layer
             layers.Dense(512, activation='relu'),
             layers.BatchNormalization(),
-            layers.Dropout(0.5),
+            layers.Dropout(dense_dropout),
             
             layers.Dense(256, activation='relu'),
             layers.BatchNormalization(),
-            layers.Dropout(0.5),
+            layers.Dropout(dense_dropout),
             
             # Output layer
-            layers.Dense(self.num_classes, activation='softmax')
+            layers.Dense(self.num_classes, activation=None if large_vocabulary else 'softmax')
         ])
         
+        metrics = ['accuracy']
+        if large_vocabulary:
+            metrics.append(keras.metrics.SparseTopKCategoricalAccuracy(k=5, name='top5_accuracy'))
+        
         # Compile model
         model.compile(
-            optimizer=keras.optimizers.Adam(learning_rate=0.001),
-            loss='sparse_categorical_crossentropy',
-            metrics=['accuracy']
+            optimizer=keras.optimizers.Adam(learning_rate=self.hyperparameters['learning_rate']),
+            loss=keras.losses.SparseCategoricalCrossentropy(from_logits=large_vocabulary),
+            metrics=metrics
         )
         
         self.model = model
+        self.loaded_model_path = None
         print("Model created successfully!")
         return model
     
-    def train_model(self, X, y, epochs=100, batch_size=32, validation_split=0.2):
+    def train_model(self, X, y, epochs=100, batch_size=32, validation_split=0.2,
+                    hard_example_mining=False, extra_callbacks=None):
         """Train the model"""
         print(f"Training model for {epochs} epochs...")
         
         # Split data
-        X_train, X_val, y_train, y_val = train_test_split(
-            X, y, test_size=validation_split, random_state=42, stratify=y
-        )
+        train_idx, val_idx = self.split_indices(y, validation_split)
+        X_train, X_val = X[train_idx], X[val_idx]
+        y_train, y_val = y[train_idx], y[val_idx]
         
         # Data augmentation
-        datagen = keras.preprocessing.image.ImageDataGenerator(
-            rotation_range=10,
-            width_shift_range=0.1,
-            height_shift_range=0.1,
-            zoom_range=0.1,
+        datagen = self.create_datagen()
+        
+        # Callbacks
+        callbacks = self.create_callbacks()
+        
+        sample_weight = None
+        if self.sample_metadata is not None and len(self.sample_metadata['sample_weight']) == len(y):
+            sample_weight = self.sample_metadata['sample_weight'][train_idx]
+            if np.all(sample_weight == 1.0):
+                sample_weight = None
+        
+        if hard_example_mining:
+            # Oversample hard examples using export fields and last epoch's loss
+            from hard_example_mining import (
+                HardExampleSampler, HardExampleSequence, HardExampleMiningCallback
+            )
+            
+            if self.sample_metadata is None or len(self.sample_metadata['is_correct']) != len(y):
+                raise ValueError("Hard-example mining needs the metadata from load_training_data")
+            
+            import sqlite3
+            from stroke_scoring import reference_stroke_counts
+            
+            # Expected stroke counts from the AnimCJK references (0 = unknown, no prior)
+            try:
+                reference_counts = reference_stroke_counts()
+            except (OSError, sqlite3.Error) as e:
+                print(f"⚠️  No stroke references ({e}), stroke-count prior disabled")
+                reference_counts = {}
+            expected_stroke_counts = np.array(
+                [reference_counts.get(self.index_to_character[label], 0) for label in y_train]
+            )
+            print(f"Stroke-count prior: {int((expected_stroke_counts > 0).sum())}/{len(y_train)} "
+                  f"training samples have a reference")
+            
+            sampler = HardExampleSampler(
+                self.sample_metadata['is_correct'][train_idx],
+                self.sample_metadata['accuracy_score'][train_idx],
+                self.sample_metadata['stroke_count'][train_idx],
+                expected_stroke_counts,
+                sample_weights=sample_weight,
+            )
+            train_data = HardExampleSequence(X_train, y_train, sampler, batch_size, datagen)
+            callbacks.append(HardExampleMiningCallback(X_train, y_train, sampler))
+            steps_per_epoch = len(train_data)
+        else:
+            train_data = datagen.flow(X_train, y_train, batch_size=batch_size, sample_weight=sample_weight)
+            steps_per_epoch = len(X_train) // batch_size
+        
+        if extra_callbacks:
+            callbacks.extend(extra_callbacks)
+        
+        # Train model
+        history = self.model.fit(
+            train_data,
+            steps_per_epoch=steps_per_epoch,
+            epochs=epochs,
+            validation_data=(X_val, y_val),
+            callbacks=callbacks,
+            verbose=1
+        )
+        
+        return history
+    
+    def split_indices(self, y, validation_split=0.2):
+        """Stratified train/validation indices, the same for every call with the same labels"""
+        from sklearn.model_selection import train_test_split
+        
+        return train_test_split(
+            np.arange(len(y)), test_size=validation_split, random_state=42, stratify=y
+        )
+    
+    def quantization_aware_finetune(self, X, y, epochs=3, batch_size=32, validation_split=0.2,
+                                    learning_rate_scale=0.1, output_path='qat_model.keras'):
+        """Fine-tune the trained model with BatchNorm folded and int8 fake quantization
+        
+        Uses the same split as train_model(), at a fraction of its learning rate. The
+        fine-tuned model replaces self.model, so convert_to_tflite(model_path=output_path,
+        quantization='int8') converts it without reloading. Returns the validation data.
+        """
+        from tensorflow import keras
+        from quantization import fold_batch_norm, build_qat_model
+        from inference import is_logits_model
+        
+        print(f"Quantization-aware fine-tuning for {epochs} epochs...")
+        
+        train_idx, val_idx = self.split_indices(y, validation_split)
+        X_train, X_val = X[train_idx], X[val_idx]
+        y_train, y_val = y[train_idx], y[val_idx]
+        
+        qat_model = build_qat_model(fold_batch_norm(self.model))
+        qat_model.compile(
+            optimizer=keras.optimizers.Adam(
+                learning_rate=self.hyperparameters['learning_rate'] * learning_rate_scale),
+            loss=keras.losses.SparseCategoricalCrossentropy(from_logits=is_logits_model(self.model)),
+            metrics=['accuracy']
+        )
+        
+        datagen = self.create_datagen()
+        qat_model.fit(
+            datagen.flow(X_train, y_train, batch_size=batch_size),
+            steps_per_epoch=max(1, len(X_train) // batch_size),
+            epochs=epochs,
+            validation_data=(X_val, y_val),
+            verbose=1
+        )
+        
+        qat_model.save(output_path)
+        self.model = qat_model
+        self.loaded_model_path = os.path.abspath(output_path)
+        print(f"Quantization-aware model saved to {output_path}")
+        return X_val, y_val
+    
+    def create_datagen(self):
+        """ImageDataGenerator for in-memory training with the augmentation ranges"""
+        from tensorflow import keras
+        
+        return keras.preprocessing.image.ImageDataGenerator(
+            rotation_range=self.hyperparameters['rotation_range'],
+            width_shift_range=self.hyperparameters['shift_range'],
+            height_shift_range=self.hyperparameters['shift_range'],
+            zoom_range=self.hyperparameters['zoom_range'],
             horizontal_flip=False,  # Don't flip Japanese characters
             fill_mode='nearest'
         )
+    
+    def augmentation(self):
+        """Augmentation ranges as keyword arguments of build_augmentation()"""
+        return {key: self.hyperparameters[key] for key in ('rotation_range', 'shift_range', 'zoom_range')}
+    
+    def create_embedding_model(self):
+        """Model that outputs the penultimate Dense(256) layer as an embedding"""
+        from embedding_index import build_embedding_model
         
-        # Callbacks
-        callbacks = [
+        return build_embedding_model(self.model)
+    
+    def create_callbacks(self):
+        """Early stopping, learning rate schedule and checkpointing"""
+        from tensorflow import keras
+        
+        return [
             keras.callbacks.EarlyStopping(
                 monitor='val_accuracy',
                 patience=10,
@@ -175,36 +334,88 @@ class JapaneseCharacterTrainer:
                 save_best_only=True
             )
         ]
+    
+    def use_labels(self, labels):
+        """Switch the label set, e.g. to the one stored with a sharded dataset"""
+        self.character_to_index = {char: i for i, char in enumerate(labels)}
+        self.index_to_character = {i: char for i, char in enumerate(labels)}
+        self.num_classes = len(labels)
+    
+    def train_from_shards(self, shard_dir, epochs=100, batch_size=32, validation_split=0.2,
+                          shuffle_buffer=8192, extra_callbacks=None):
+        """Train straight from a sharded on-disk dataset with constant memory use"""
+        from sharded_dataset import ShardedDataset
+        
+        print(f"Training model from shards in {shard_dir} for {epochs} epochs...")
+        
+        dataset = ShardedDataset(shard_dir)
+        train_data = dataset.as_tf_dataset('train', batch_size, validation_split,
+                                           shuffle_buffer=shuffle_buffer, augment=self.augmentation())
+        val_data = dataset.as_tf_dataset('validation', batch_size, validation_split,
+                                         shuffle_buffer=0)
+        
+        callbacks = self.create_callbacks() + list(extra_callbacks or [])
         
-        # Train model
         history = self.model.fit(
-            datagen.flow(X_train, y_train, batch_size=batch_size),
-            steps_per_epoch=len(X_train) // batch_size,
+            train_data,
             epochs=epochs,
-            validation_data=(X_val, y_val),
+            validation_data=val_data,
             callbacks=callbacks,
             verbose=1
         )
         
         return history
     
-    def evaluate_model(self, X_test, y_test):
+    def load_model(self, model_path='best_model.h5'):
+        """Load a saved model, unless it is already the one in memory"""
+        from tensorflow import keras
+        
+        if self.model is None or self.loaded_model_path != os.path.abspath(model_path):
+            self.model = keras.models.load_model(model_path)
+            self.loaded_model_path = os.path.abspath(model_path)
+        return self.model
+    
+    def evaluate_from_shards(self, shard_dir, batch_size=256, validation_split=0.2,
+                             model_path='best_model.h5'):
+        """Evaluate on the validation split, accumulating the confusion matrix per batch"""
+        from sharded_dataset import ShardedDataset
+        
+        print("Evaluating model on validation shards...")
+        
+        self.load_model(model_path)
+        dataset = ShardedDataset(shard_dir)
+        val_data = dataset.as_tf_dataset('validation', batch_size, validation_split,
+                                         shuffle_buffer=0)
+        
+        cm = np.zeros((self.num_classes, self.num_classes), dtype=np.int64)
+        for images, labels in val_data:
+            predicted = np.argmax(self.model.predict_on_batch(images), axis=1)
+            np.add.at(cm, (labels.numpy(), predicted), 1)
+        
+        test_accuracy = np.trace(cm) / max(cm.sum(), 1)
+        print(f"Test Accuracy: {test_accuracy:.4f}")
+        return test_accuracy, cm
+    
+    def evaluate_model(self, X_test, y_test, model_path='best_model.h5', batch_size=256):
         """Evaluate model performance"""
+        from inference import is_logits_model, softmax
+        
         print("Evaluating model...")
         
         # Load best model
-        self.model = keras.models.load_model('best_model.h5')
+        self.load_model(model_path)
         
-        # Evaluate
-        test_loss, test_accuracy = self.model.evaluate(X_test, y_test, verbose=0)
+        # One prediction pass gives both the metrics and the confusion matrix
+        predictions = self.model.predict(X_test, batch_size=batch_size, verbose=0)
+        if is_logits_model(self.model):
+            predictions = softmax(predictions)
+        predicted_classes = np.argmax(predictions, axis=1)
+        test_accuracy = float(np.mean(predicted_classes == y_test))
+        test_loss = float(-np.mean(np.log(np.clip(predictions[np.arange(len(y_test)), y_test], 1e-7, 1.0))))
         
         print(f"Test Accuracy: {test_accuracy:.4f}")
         print(f"Test Loss: {test_loss:.4f}")
         
-        # Predictions
-        predictions = self.model.predict(X_test)
-        predicted_classes = np.argmax(predictions, axis=1)
-        
         # Confusion matrix
         from sklearn.metrics import confusion_matrix, classification_report
         
@@ -217,8 +428,10 @@ class JapaneseCharacterTrainer:
         
         return test_accuracy, cm
     
-    def plot_training_history(self, history):
-        """Plot training history"""
+    def plot_training_history(self, history, output_path='training_history.png', show=False):
+        """Plot training history (only blocks on plt.show() when show=True)"""
+        import matplotlib.pyplot as plt
+        
         plt.figure(figsize=(12, 4))
         
         plt.subplot(1, 2, 1)
@@ -238,19 +451,46 @@ class JapaneseCharacterTrainer:
         plt.legend()
         
         plt.tight_layout()
-        plt.savefig('training_history.png')
-        plt.show()
+        plt.savefig(output_path)
+        if show:
+            plt.show()
+        plt.close()
     
-    def convert_to_tflite(self, output_path='japanese_character_model.tflite'):
-        """Convert model to TensorFlow Lite format"""
+    def convert_to_tflite(self, output_path='japanese_character_model.tflite', model_path='best_model.h5',
+                          top_k=None, quantization='dynamic', representative_data=None):
+        """Convert model to TensorFlow Lite format
+        
+        With top_k the model outputs only the k best scores and class ids, which keeps
+        the output small for thousands of classes.
+        
+        quantization is 'float' (no quantization), 'dynamic' (int8 weights, float
+        activations) or 'int8' (fully integer with int8 input and output). 'int8'
+        needs representative_data (float images from the same domain as the training
+        data) to calibrate activation ranges.
+        """
+        import tensorflow as tf
+        from inference import is_logits_model
+        
         print("Converting model to TensorFlow Lite...")
         
-        # Load best model
-        self.model = keras.models.load_model('best_model.h5')
+        # Reuses the model evaluate_model() already loaded instead of reading it again
+        self.load_model(model_path)
         
         # Convert to TensorFlow Lite
-        converter = tf.lite.TFLiteConverter.from_keras_model(self.model)
-        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        export_model = self.model
+        if top_k or is_logits_model(self.model):
+            export_model = self._create_export_model(top_k)
+        converter = tf.lite.TFLiteConverter.from_keras_model(export_model)
+        if quantization != 'float':
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if quantization == 'int8':
+            if representative_data is None:
+                raise ValueError("Full integer quantization needs representative_data to calibrate on")
+            from quantization import representative_dataset
+            converter.representative_dataset = representative_dataset(representative_data)
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+            converter.inference_input_type = tf.int8
+            converter.inference_output_type = tf.int8
         
         # Convert
         tflite_model = converter.convert()
@@ -270,10 +510,33 @@ class JapaneseCharacterTrainer:
         
         print("TensorFlow Lite model details:")
         print(f"Input shape: {input_details[0]['shape']}")
-        print(f"Output shape: {output_details[0]['shape']}")
+        for details in output_details:
+            print(f"Output shape: {details['shape']}")
         
         return output_path
     
+    def _create_export_model(self, top_k=None):
+        """Wrap the model to output probabilities (softmax over logits), optionally top-k only"""
+        import tensorflow as tf
+        from tensorflow import keras
+        from inference import is_logits_model
+        
+        class TopK(keras.layers.Layer):
+            def __init__(self, k, **kwargs):
+                super().__init__(**kwargs)
+                self.k = k
+            
+            def call(self, inputs):
+                scores, classes = tf.math.top_k(inputs, k=self.k)
+                return {'scores': scores, 'classes': classes}
+        
+        outputs = self.model.outputs[0]
+        if is_logits_model(self.model):
+            outputs = keras.layers.Softmax()(outputs)
+        if top_k:
+            outputs = TopK(min(top_k, int(self.model.output_shape[-1])))(outputs)
+        return keras.Model(self.model.inputs, outputs)
+    
     def generate_synthetic_data(self, num_samples_per_class=100):
         """Generate synthetic training data for characters with few samples"""
         print("Generating synthetic training data...")
@@ -282,26 +545,43 @@ class JapaneseCharacterTrainer:
         # For now, we'll use the existing data
         pass
 
-def main():
-    """Main training function"""
+def main(data_path='training_data_export.json', epochs=50, batch_size=16,
+         hard_example_mining=False, show_plot=False, tflite_path='japanese_character_model.tflite',
+         report_path='run_report.json', profile_steps=0, profile_mode='cprofile', top_k=None,
+         hyperparameters=None, qat_epochs=0):
+    """Main training function
+    
+    With qat_epochs the trained model is also fine-tuned quantization-aware and float,
+    PTQ-INT8 and QAT-INT8 TFLite models are compared in quantization_report.json.
+    """
+    from instrumentation import RunInstrumentation, ThroughputCallback, ProfilerCallback
+    from evaluate_tflite import evaluate_tflite
+    
     print("Japanese Character Recognition Model Training")
     print("=" * 50)
     
+    run = RunInstrumentation(report_path)
+    
     # Initialize trainer
-    trainer = JapaneseCharacterTrainer()
+    trainer = JapaneseCharacterTrainer(hyperparameters=hyperparameters)
     
     # Load training data
-    data_path = 'training_data_export.json'
     if not os.path.exists(data_path):
         print(f"Training data file {data_path} not found!")
         print("Please export training data from the Flutter app first.")
-        return
+        return None
+    
+    # A directory holds a sharded dataset that is streamed from disk
+    if os.path.isdir(data_path):
+        return train_sharded(trainer, run, data_path, epochs, batch_size, show_plot,
+                             tflite_path, profile_steps, profile_mode, top_k)
     
-    X, y = trainer.load_training_data(data_path)
+    with run.phase('load'):
+        X, y = trainer.load_training_data(data_path)
     
     if len(X) < 50:
         print(f"Not enough training data ({len(X)} samples). Need at least 50 samples.")
-        return
+        return None
     
     # Reshape data for CNN
     X = X.reshape(-1, trainer.input_size, trainer.input_size, 1)
@@ -309,26 +589,129 @@ def main():
     print(f"Training data shape: {X.shape}")
     print(f"Labels shape: {y.shape}")
     print(f"Number of classes: {len(np.unique(y))}")
+    run.record('num_samples', int(len(X)))
+    run.record('num_classes', int(len(np.unique(y))))
     
     # Create model
-    model = trainer.create_model()
-    model.summary()
+    with run.phase('build'):
+        model = trainer.create_model()
+        model.summary()
+    run.record('model_parameters', int(model.count_params()))
+    
+    # Images were decoded in 'load', so per batch decode is only slicing the arrays
+    with run.phase('input_stages'):
+        datagen = trainer.create_datagen()
+        batches = ((X[i:i + batch_size].astype(np.float32), y[i:i + batch_size])
+                   for i in range(0, len(X), batch_size))
+        run.time_input_stages(batches, lambda images: np.stack([datagen.random_transform(x) for x in images]))
     
     # Train model
-    history = trainer.train_model(X, y, epochs=50, batch_size=16)
+    callbacks = [ThroughputCallback(run, batch_size)]
+    if profile_steps > 0:
+        callbacks.append(ProfilerCallback(run, profile_steps, mode=profile_mode))
+    
+    with run.phase('train'):
+        history = trainer.train_model(X, y, epochs=epochs, batch_size=batch_size,
+                                      hard_example_mining=hard_example_mining,
+                                      extra_callbacks=callbacks)
     
     # Plot training history
-    trainer.plot_training_history(history)
+    with run.phase('plot'):
+        trainer.plot_training_history(history, show=show_plot)
     
     # Evaluate model
-    test_accuracy, cm = trainer.evaluate_model(X, y)
+    with run.phase('evaluate'):
+        test_accuracy, cm = trainer.evaluate_model(X, y)
+    run.record('test_accuracy', float(test_accuracy))
     
     # Convert to TensorFlow Lite
-    tflite_path = trainer.convert_to_tflite()
+    with run.phase('convert'):
+        tflite_path = trainer.convert_to_tflite(tflite_path, top_k=top_k)
+    run.record('tflite_size_bytes', os.path.getsize(tflite_path))
+    
+    # Accuracy of the shipped (quantized) model, not just the Keras checkpoint
+    with run.phase('evaluate_tflite'):
+        tflite_report, _ = evaluate_tflite(tflite_path, (X, y))
+    run.record('tflite_accuracy', tflite_report['accuracy'])
+    
+    if qat_epochs > 0:
+        from quantization import quantization_report
+        
+        with run.phase('qat'):
+            X_val, y_val = trainer.quantization_aware_finetune(X, y, epochs=qat_epochs, batch_size=batch_size)
+        with run.phase('quantization_report'):
+            prefix = os.path.splitext(tflite_path)[0]
+            report = quantization_report(trainer, X_val, y_val, output_prefix=prefix)
+        for name, result in report['models'].items():
+            run.record(f'{name}_accuracy', result['accuracy'])
+    
+    run.write_report()
+    
+    print("\nTraining completed successfully!")
+    print(f"Final test accuracy: {test_accuracy:.4f}")
+    print(f"TensorFlow Lite model saved to: {tflite_path}")
+    return tflite_path
+
+def train_sharded(trainer, run, shard_dir, epochs, batch_size, show_plot,
+                  tflite_path, profile_steps=0, profile_mode='cprofile', top_k=None):
+    """Training pipeline for a sharded dataset directory (see sharded_dataset.py)"""
+    from instrumentation import ThroughputCallback, ProfilerCallback
+    from evaluate_tflite import evaluate_tflite
+    from sharded_dataset import ShardedDataset, build_augmentation
+    
+    dataset = ShardedDataset(shard_dir)
+    trainer.use_labels(dataset.labels)
+    print(f"Sharded dataset: {len(dataset)} samples in {len(dataset.shards)} shards")
+    run.record('num_samples', len(dataset))
+    run.record('num_classes', trainer.num_classes)
+    
+    with run.phase('build'):
+        model = trainer.create_model()
+        model.summary()
+    run.record('model_parameters', int(model.count_params()))
+    
+    # Shard reads and bit unpacking vs the augmentation layers
+    with run.phase('input_stages'):
+        augmentation = build_augmentation(**trainer.augmentation())
+        run.time_input_stages(
+            dataset.as_tf_dataset('train', batch_size, shuffle_buffer=0),
+            (lambda images: augmentation(images, training=True)) if augmentation is not None else None)
+    
+    callbacks = [ThroughputCallback(run, batch_size)]
+    if profile_steps > 0:
+        callbacks.append(ProfilerCallback(run, profile_steps, mode=profile_mode))
+    
+    with run.phase('train'):
+        history = trainer.train_from_shards(shard_dir, epochs=epochs, batch_size=batch_size,
+                                            extra_callbacks=callbacks)
+    
+    with run.phase('plot'):
+        trainer.plot_training_history(history, show=show_plot)
+    
+    with run.phase('evaluate'):
+        test_accuracy, cm = trainer.evaluate_from_shards(shard_dir)
+    run.record('test_accuracy', float(test_accuracy))
+    
+    with run.phase('convert'):
+        tflite_path = trainer.convert_to_tflite(tflite_path, top_k=top_k)
+    run.record('tflite_size_bytes', os.path.getsize(tflite_path))
+    
+    # The dataset's label order (e.g. from label_registry.py) must ship with the model
+    labels_path = os.path.join(os.path.dirname(tflite_path), 'japanese_character_labels.txt')
+    with open(labels_path, 'w', encoding='utf-8') as f:
+        f.write(''.join(f"{label}\n" for label in dataset.labels))
+    
+    with run.phase('evaluate_tflite'):
+        tflite_report, _ = evaluate_tflite(tflite_path, shard_dir, labels_path=labels_path)
+    run.record('tflite_accuracy', tflite_report['accuracy'])
+    
+    run.write_report()
     
     print("\nTraining completed successfully!")
     print(f"Final test accuracy: {test_accuracy:.4f}")
     print(f"TensorFlow Lite model saved to: {tflite_path}")
+    print(f"Labels saved to: {labels_path}")
+    return tflite_path
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
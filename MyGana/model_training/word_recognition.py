@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Word Recognition for Japanese Handwriting
+Segments a handwritten line into characters with connected components and a
+column projection profile, normalizes each segment like the training data and
+classifies all of them in one batched model call
+
+Optional lexicon decoding picks the most likely word or phrase from the app
+database (example_sentences and flashcards) with the same number of characters.
+
+Examples:
+    python word_recognition.py --image word.png
+    python word_recognition.py --strokes word_strokes.json --model japanese_character_model.tflite
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import base64
+import binascii
+import sqlite3
+import argparse
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from inference import load_predictor, load_labels, top_k
+from label_registry import DEFAULT_DB_PATH
+from preprocessing import INPUT_SIZE, INK_THRESHOLD, to_model_input, _point_xy
+
+LINE_HEIGHT = 128
+# Split DB sentences into lexicon entries at whitespace and punctuation (not ー, which is part of words)
+SEPARATORS = re.compile(r"[\s、。，．・「」『』（）()？！?!…〜～]+")
+
+
+def load_line_image(payload, height=LINE_HEIGHT):
+    """uint8 grayscale line image from {"imageData": base64 png} or {"strokes": [...]}
+
+    Images keep their resolution; strokes are rendered at the given line height.
+    """
+    if payload.get('imageData'):
+        try:
+            image = Image.open(io.BytesIO(base64.b64decode(payload['imageData'])))
+            return np.asarray(image.convert('L'), dtype=np.uint8)
+        except (OSError, binascii.Error):  # PIL.UnidentifiedImageError, bad base64
+            raise ValueError("invalid imageData")
+    if payload.get('strokes') is not None:
+        return render_line(payload['strokes'], height)
+    raise ValueError("Payload needs either 'imageData' or 'strokes'")
+
+
+def render_line(strokes, height=LINE_HEIGHT, stroke_width=4, padding=8):
+    """Rasterize the strokes of a whole line, scaled to the line height with the aspect ratio kept"""
+    strokes = [[_point_xy(p) for p in stroke] for stroke in strokes if len(stroke) > 0]
+    if not strokes:
+        return np.full((height, height), 255, dtype=np.uint8)
+
+    points = np.array([p for stroke in strokes for p in stroke], dtype=np.float32)
+    low = points.min(axis=0)
+    extent = np.maximum(points.max(axis=0) - low, 1.0)
+    scale = (height - 2 * padding) / extent[1]
+    width = int(np.ceil(extent[0] * scale)) + 2 * padding
+
+    image = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    for stroke in strokes:
+        xy = [tuple(float(v) for v in (np.array(p) - low) * scale + padding) for p in stroke]
+        if len(xy) == 1:
+            x, y = xy[0]
+            r = stroke_width / 2
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=0)
+        else:
+            draw.line(xy, fill=0, width=stroke_width, joint='curve')
+    return np.asarray(image, dtype=np.uint8)
+
+
+def merge_runs(starts, ends, line_height, char_width_ratio=0.9, max_width_ratio=1.3, gap_weight=1.0):
+    """Group column runs into characters with the fewest-cost segmentation
+
+    A group costs its squared deviation from one character width plus the gaps
+    it swallows (both relative to the line height). Dynamic programming over the
+    runs finds the cheapest grouping, so い or け (strokes with a gap between
+    them) stay whole while neighbouring narrow characters stay apart.
+    """
+    count = len(starts)
+    best = np.full(count + 1, np.inf)
+    best[0] = 0.0
+    previous = np.zeros(count + 1, dtype=int)
+    for end in range(1, count + 1):
+        for first in range(end - 1, -1, -1):
+            width = (ends[end - 1] - starts[first]) / line_height
+            if width > max_width_ratio and first < end - 1:
+                break
+            gaps = (starts[first + 1:end] - ends[first:end - 1]).sum() / line_height
+            cost = best[first] + (width - char_width_ratio) ** 2 + gap_weight * gaps
+            if cost < best[end]:
+                best[end], previous[end] = cost, first
+
+    groups = []
+    end = count
+    while end > 0:
+        groups.append((previous[end], end - 1))
+        end = previous[end]
+    return [(int(starts[first]), int(ends[last])) for first, last in reversed(groups)]
+
+
+def segment_line(image, threshold=INK_THRESHOLD, min_area_ratio=0.002, **merge_options):
+    """Character boxes (x0, y0, x1, y1), left to right, and the cleaned ink mask
+
+    Connected components drop specks; the column projection profile gives runs of
+    inked columns, which merge_runs() groups into characters.
+    """
+    import cv2
+
+    ink = (np.asarray(image) < threshold).astype(np.uint8)
+    rows = np.flatnonzero(ink.any(axis=1))
+    if len(rows) == 0:
+        return [], ink.astype(bool)
+
+    _, components, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    line_height = rows[-1] - rows[0] + 1
+    keep = stats[:, cv2.CC_STAT_AREA] >= max(2, min_area_ratio * line_height ** 2)
+    keep[0] = False  # background
+    ink = keep[components]
+
+    rows = np.flatnonzero(ink.any(axis=1))
+    if len(rows) == 0:
+        return [], ink
+    line_height = rows[-1] - rows[0] + 1
+
+    # Runs of inked columns from the projection profile
+    columns = ink.any(axis=0).astype(np.int8)
+    edges = np.diff(np.concatenate([[0], columns, [0]]))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+    boxes = []
+    for start, end in merge_runs(starts, ends, line_height, **merge_options):
+        inked_rows = np.flatnonzero(ink[:, start:end].any(axis=1))
+        boxes.append((start, int(inked_rows[0]), end, int(inked_rows[-1]) + 1))
+    return boxes, ink
+
+
+def normalize_segments(ink, boxes, input_size=INPUT_SIZE, padding=6):
+    """Crop each box and fit it into an input_size square like render_strokes (uint8, N x H x W)"""
+    import cv2
+
+    images = np.full((len(boxes), input_size, input_size), 255, dtype=np.uint8)
+    inner = input_size - 2 * padding
+    for i, (x0, y0, x1, y1) in enumerate(boxes):
+        crop = np.where(ink[y0:y1, x0:x1], 0, 255).astype(np.uint8)
+        scale = inner / max(x1 - x0, y1 - y0)
+        width, height = max(1, round((x1 - x0) * scale)), max(1, round((y1 - y0) * scale))
+        resized = cv2.resize(crop, (width, height), interpolation=cv2.INTER_AREA)
+        top, left = (input_size - height) // 2, (input_size - width) // 2
+        images[i, top:top + height, left:left + width] = resized
+    return images
+
+
+def line_segments(payload, input_size=INPUT_SIZE):
+    """(normalized segment images, boxes) of a line payload"""
+    boxes, ink = segment_line(load_line_image(payload))
+    return normalize_segments(ink, boxes, input_size), boxes
+
+
+def read_db_phrases(db_path=DEFAULT_DB_PATH):
+    """Words and phrases from the example sentences and flashcards of the app database"""
+    connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        texts = [row[0] for row in connection.execute("SELECT japanese FROM example_sentences")]
+        texts += [row[0] for row in connection.execute("SELECT front FROM flashcards")]
+    finally:
+        connection.close()
+    return {phrase for text in texts if text for phrase in SEPARATORS.split(text) if phrase}
+
+
+class Lexicon:
+    """Lexicon entries grouped by length as label index arrays, for vectorized scoring"""
+
+    def __init__(self, words, labels):
+        index = {label: i for i, label in enumerate(labels)}
+        by_length = {}
+        for word in sorted(set(words)):
+            # Entries with characters the model cannot output can never be decoded
+            if all(char in index for char in word):
+                by_length.setdefault(len(word), []).append(word)
+        self.words = by_length
+        self.indices = {n: np.array([[index[char] for char in word] for word in words])
+                        for n, words in by_length.items()}
+
+    @classmethod
+    def from_db(cls, labels, db_path=DEFAULT_DB_PATH):
+        return cls(read_db_phrases(db_path), labels)
+
+    def __len__(self):
+        return sum(len(words) for words in self.words.values())
+
+    def decode(self, probabilities, top=3):
+        """Best entries with one character per segment, scored by joint log probability"""
+        n = len(probabilities)
+        if n not in self.indices:
+            return []
+        log_p = np.log(np.clip(probabilities, 1e-9, 1.0))
+        scores = log_p[np.arange(n), self.indices[n]].sum(axis=1)
+        best = np.argsort(-scores)[:top]
+        return [{'word': self.words[n][i], 'confidence': float(np.exp(scores[i] / n))} for i in best]
+
+
+def decode_line(probabilities, boxes, labels, lexicon=None, top=5):
+    """Response for one line from the per-segment probabilities"""
+    predictions = top_k(probabilities, labels, top) if len(boxes) else []
+    result = {
+        'text': ''.join(p[0]['character'] for p in predictions),
+        'characters': [{'box': list(box), 'predictions': p} for box, p in zip(boxes, predictions)],
+    }
+    if lexicon is not None and len(boxes):
+        result['lexicon'] = lexicon.decode(probabilities)
+    return result
+
+
+def recognize_line(payload, predictor, labels, lexicon=None, top=5):
+    """Segment a line and classify every segment in a single batched call"""
+    images, boxes = line_segments(payload, predictor.input_shape[0])
+    if not boxes:
+        return decode_line(np.zeros((0, len(labels))), boxes, labels, lexicon, top)
+    probabilities = predictor.predict(to_model_input(images))
+    return decode_line(probabilities, boxes, labels, lexicon, top)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recognize a handwritten word or line")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--image', help="Image of the line (PNG/JPEG, dark ink on light background)")
+    source.add_argument('--strokes', help="JSON file with a list of strokes of [x, y] points")
+    parser.add_argument('--model', default='japanese_character_model.tflite')
+    parser.add_argument('--labels', default='japanese_character_labels.txt')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help="App database for the lexicon")
+    parser.add_argument('--no-lexicon', action='store_true')
+    parser.add_argument('--top', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    if args.image:
+        with open(args.image, 'rb') as f:
+            payload = {'imageData': base64.b64encode(f.read()).decode('ascii')}
+    else:
+        with open(args.strokes, 'r', encoding='utf-8') as f:
+            payload = {'strokes': json.load(f)}
+
+    predictor = load_predictor(args.model)
+    labels = load_labels(args.labels, predictor.num_classes, args.model)
+    lexicon = None
+    if not args.no_lexicon and os.path.exists(args.db):
+        lexicon = Lexicon.from_db(labels, args.db)
+
+    result = recognize_line(payload, predictor, labels, lexicon, args.top)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0 if result['characters'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())